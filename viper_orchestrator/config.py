@@ -3,7 +3,16 @@ from __future__ import annotations
 from pathlib import Path
 import sys
 
-from viper_orchestrator.visintent.tracking.tables import ProtectedListEntry
+from viper_orchestrator.db.utility_tables import (
+    HighWaterMark,
+    LastLightState,
+    LightTransition,
+    TableVersion,
+)
+from viper_orchestrator.visintent.tracking.tables import (
+    ProtectedListEntry,
+    RequestSummary,
+)
 from vipersci.vis.db.image_records import ImageRecord
 from vipersci.vis.db.image_requests import ImageRequest
 from vipersci.vis.db.image_stats import ImageStats
@@ -18,6 +27,17 @@ from vipersci.vis.db.light_records import LightRecord
 # are we running in test mode? primarily affects file write behavior
 TEST = True
 
+# should pipeline stages write latency traces to TRACE_LOG_FILE?
+TRACING = False
+# should views and station actors count and time their SQL queries? (see
+# db.instrumentation; summaries are written to QUERY_LOG_FILE)
+QUERY_INSTRUMENTATION = False
+# light_records is partitioned by month (see db.partitions). when the station
+# starts (or db.partitions is run as a script), partitions older than this
+# many months are archived to parquet files in LIGHT_ARCHIVE_ROOT and
+# dropped. None to keep everything in the database.
+LIGHT_RETENTION_MONTHS = 12
+
 # yamcs parameters we know we care about at the moment
 PARAMETERS = (
     "/ViperGround/Images/ImageData/Hazcam_back_left_icer",
@@ -33,6 +53,7 @@ PARAMETERS = (
 
 # tables the orchestrator interacts with
 BASES = [
+    HighWaterMark,
     ImageRecord,
     ImageRequest,
     ImageStats,
@@ -40,10 +61,14 @@ BASES = [
     JuncImagePano,
     JuncImageRecordTag,
     JuncImageRequestLDST,
+    LastLightState,
     LDST,
     LightRecord,
+    LightTransition,
     PanoRecord,
     ProtectedListEntry,
+    RequestSummary,
+    TableVersion,
 ]
 
 
@@ -74,6 +99,10 @@ def set_up_paths(test: bool = TEST):
     paths['STATIC_ROOT'] = paths['MEDIA_ROOT'] / "assets"
     paths['STATION_LOG_ROOT'] = paths['LOG_ROOT'] / "station"
     paths['LIGHTSTATE_LOG_FILE'] = paths['LOG_ROOT'] / "lightstate.csv"
+    paths['TRACE_LOG_FILE'] = paths['LOG_ROOT'] / "traces.csv"
+    paths['QUERY_LOG_FILE'] = paths['LOG_ROOT'] / "queries.csv"
+    # archived light_records partitions
+    paths['LIGHT_ARCHIVE_ROOT'] = paths['DB_ROOT'].parent / "light_archive"
     # location of mock data files for testing
     paths['MOCK_DATA_ROOT'] = (
         Path(__file__).parent / "mock_data/mock_events_build_9"
@@ -0,0 +1,264 @@
+"""
+streaming export of orchestrator tables as CSV, Parquet, or Arrow IPC
+streams. rows are read through a server-side cursor and written a chunk at
+a time, so exports run in constant memory however large the table is. used
+by the tracking app's export view and from the command line, e.g.:
+
+python -m viper_orchestrator.db.exports images images.parquet \\
+    --start=2025-01-01 --instruments='["NavCam Left"]'
+"""
+import csv
+import datetime as dt
+from enum import Enum
+from io import StringIO
+import json
+from pathlib import Path
+from typing import Any, Collection, Iterator, Literal, NamedTuple, Optional
+
+import fire
+from geoalchemy2 import Geometry
+import pyarrow as pa
+from pyarrow import parquet
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    Integer,
+    Select,
+    func,
+    select,
+)
+from sqlalchemy.orm import DeclarativeBase
+
+from viper_orchestrator.db import OSession
+from viper_orchestrator.visintent.tracking.tables import ProtectedListEntry
+from vipersci.vis.db.image_records import ImageRecord
+from vipersci.vis.db.image_requests import ImageRequest
+from vipersci.vis.db.light_records import LightRecord
+
+ExportFormat = Literal["csv", "parquet", "arrow"]
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+# rows per server-side cursor fetch and per written chunk
+CHUNK_SIZE = 5000
+
+
+class ExportSpec(NamedTuple):
+    table: type[DeclarativeBase]
+    # column the start / stop filters apply to
+    time_column: Column
+    # column the instruments filter applies to, if any
+    instrument_column: Optional[Column] = None
+
+
+EXPORTS = {
+    "images": ExportSpec(
+        ImageRecord, ImageRecord.start_time, ImageRecord.instrument_name
+    ),
+    "lights": ExportSpec(LightRecord, LightRecord.datetime),
+    "requests": ExportSpec(ImageRequest, ImageRequest.request_time),
+    "protected_list": ExportSpec(
+        ProtectedListEntry,
+        ProtectedListEntry.start_time,
+        ProtectedListEntry.instrument_name,
+    ),
+}
+
+
+def _parse_time(time: Optional[str | dt.datetime]) -> Optional[dt.datetime]:
+    if time is None or isinstance(time, dt.datetime):
+        parsed = time
+    else:
+        parsed = dt.datetime.fromisoformat(str(time))
+    if parsed is not None and parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=dt.UTC)
+    return parsed
+
+
+def export_selector(
+    name: str,
+    start: Optional[str | dt.datetime] = None,
+    stop: Optional[str | dt.datetime] = None,
+    instruments: Optional[Collection[str]] = None,
+) -> Select:
+    """
+    select the rows of an export (see EXPORTS) with time in [start, stop)
+    and, if given, instrument in instruments, in time order. geometry
+    columns are selected as WKT.
+    """
+    if name not in EXPORTS:
+        raise ValueError(f"unknown export {name}; choose from {list(EXPORTS)}")
+    spec = EXPORTS[name]
+    columns = [
+        func.ST_AsText(c).label(c.name)
+        if isinstance(c.type, Geometry) else c
+        for c in spec.table.__table__.columns
+    ]
+    selector = select(*columns)
+    if (start := _parse_time(start)) is not None:
+        selector = selector.where(spec.time_column >= start)
+    if (stop := _parse_time(stop)) is not None:
+        selector = selector.where(spec.time_column < stop)
+    if instruments is not None and len(instruments) > 0:
+        if spec.instrument_column is None:
+            raise ValueError(f"{name} can't be filtered by instrument")
+        selector = selector.where(spec.instrument_column.in_(instruments))
+    return selector.order_by(
+        spec.time_column, *spec.table.__table__.primary_key.columns
+    )
+
+
+def _plain(value: Any) -> Any:
+    """values as CSV / Arrow can hold them"""
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def _arrow_type(column) -> pa.DataType:
+    sqltype = column.type
+    if isinstance(sqltype, Boolean):
+        return pa.bool_()
+    if isinstance(sqltype, Integer):
+        return pa.int64()
+    if isinstance(sqltype, Float):
+        return pa.float64()
+    if isinstance(sqltype, DateTime):
+        return pa.timestamp("us", tz="UTC" if sqltype.timezone else None)
+    # strings, enums, JSON, WKT
+    return pa.string()
+
+
+def arrow_schema(selector: Select) -> pa.Schema:
+    return pa.schema(
+        [(c.name, _arrow_type(c)) for c in selector.selected_columns]
+    )
+
+
+def iter_chunks(
+    selector: Select, chunk_size: int = CHUNK_SIZE
+) -> Iterator[list[tuple]]:
+    """rows of selector, chunk_size at a time, via a server-side cursor."""
+    with OSession() as session:
+        result = session.connection().execution_options(
+            stream_results=True, yield_per=chunk_size
+        ).execute(selector)
+        for partition in result.partitions():
+            yield [tuple(map(_plain, row)) for row in partition]
+
+
+def csv_chunks(selector: Select, chunk_size: int = CHUNK_SIZE):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([c.name for c in selector.selected_columns])
+    for rows in iter_chunks(selector, chunk_size):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # header only, if there were no rows
+    if len(tail := buffer.getvalue()) > 0:
+        yield tail
+
+
+class _ChunkSink:
+    """
+    write-only file-like object for pyarrow writers that hands back what's
+    been written since the last drain().
+    """
+
+    def __init__(self):
+        self.chunks, self.position, self.closed = [], 0, False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def arrow_chunks(
+    selector: Select, fmt: ExportFormat, chunk_size: int = CHUNK_SIZE
+) -> Iterator[bytes]:
+    """parquet (one row group per chunk) or Arrow IPC stream chunks."""
+    schema, sink = arrow_schema(selector), _ChunkSink()
+    if fmt == "parquet":
+        writer = parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    for rows in iter_chunks(selector, chunk_size):
+        columns = [
+            pa.array([row[i] for row in rows], type=field.type)
+            for i, field in enumerate(schema)
+        ]
+        writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export_chunks(
+    name: str,
+    fmt: ExportFormat = "csv",
+    start: Optional[str | dt.datetime] = None,
+    stop: Optional[str | dt.datetime] = None,
+    instruments: Optional[Collection[str]] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[str | bytes]:
+    """
+    stream an export in fmt. raises ValueError immediately (rather than
+    when first iterated) for bad arguments.
+    """
+    if fmt not in CONTENT_TYPES:
+        raise ValueError(
+            f"unknown format {fmt}; choose from {list(CONTENT_TYPES)}"
+        )
+    selector = export_selector(name, start, stop, instruments)
+    if fmt == "csv":
+        return csv_chunks(selector, chunk_size)
+    return arrow_chunks(selector, fmt, chunk_size)
+
+
+def export_table(
+    name: str,
+    path: str,
+    fmt: Optional[ExportFormat] = None,
+    start: Optional[str] = None,
+    stop: Optional[str] = None,
+    instruments: Optional[Collection[str]] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Path:
+    """
+    write an export to path. fmt defaults to path's extension ('.arrow'
+    for Arrow IPC streams).
+    """
+    path = Path(path)
+    fmt = path.suffix.strip(".") if fmt is None else fmt
+    chunks = export_chunks(name, fmt, start, stop, instruments, chunk_size)
+    mode = {"mode": "w", "newline": ""} if fmt == "csv" else {"mode": "wb"}
+    with path.open(**mode) as stream:
+        for chunk in chunks:
+            stream.write(chunk)
+    return path
+
+
+if __name__ == "__main__":
+    fire.Fire(export_table)
@@ -0,0 +1,210 @@
+"""
+opt-in SQL query counting and timing. engine event listeners record every
+statement executed within a measure_queries() block -- including those made
+in worker threads started from it, since context variables propagate to
+them -- along with a fingerprint of the statement and the Session that made
+it:
+
+with measure_queries() as stats:
+    do_some_queries()
+print(stats.count, stats.seconds, stats.repeated())
+
+a fingerprint is the statement text with bound values, literals, and IN
+lists normalized away, so a query executed once per row of some other
+query (an 'N+1') shows up as a single fingerprint with a high count.
+
+the listeners are installed on first use and do nothing outside a
+measure_queries() block. if QUERY_INSTRUMENTATION is True, tracking views
+(via tracking.middleware.QueryCountMiddleware) and station actors (via
+counted_queries) measure their queries and log summaries to
+QUERY_LOG_FILE.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import Counter
+import csv
+from functools import wraps
+from hashlib import sha1
+from itertools import count
+from pathlib import Path
+import re
+from threading import Lock
+import time
+from typing import Callable, Optional
+import warnings
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool
+
+from viper_orchestrator.config import QUERY_INSTRUMENTATION, QUERY_LOG_FILE
+
+QUERY_LOG_COLUMNS = (
+    "time", "source", "count", "ms", "sessions", "max_repeats", "statement"
+)
+# all QueryStats currently measuring
+_ACTIVE: ContextVar[tuple["QueryStats", ...]] = ContextVar(
+    "active_query_stats", default=()
+)
+_INSTALL_LOCK = Lock()
+_SESSION_IDS = count()
+_PLACEHOLDER_LIST = re.compile(r"%\(\w+\)s(?:\s*,\s*%\(\w+\)s)+")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+
+
+def normalize_statement(statement: str) -> str:
+    statement = _PLACEHOLDER_LIST.sub("%(...)s", statement)
+    return _SPACE.sub(" ", _LITERAL.sub("?", statement)).strip()
+
+
+def fingerprint(statement: str) -> str:
+    """
+    fingerprint for a SQL statement that ignores bound values, literals,
+    whitespace, and the lengths of IN lists.
+    """
+    return sha1(normalize_statement(statement).encode()).hexdigest()[:12]
+
+
+class QueryStats:
+    """counts and timings of the statements executed while measuring."""
+
+    def __init__(self):
+        self.count, self.seconds = 0, 0.0
+        self.by_fingerprint: Counter[str] = Counter()
+        self.by_session: Counter[Optional[int]] = Counter()
+        # an example statement for each fingerprint
+        self.statements: dict[str, str] = {}
+        self._lock = Lock()
+
+    def record(
+        self, statement: str, seconds: float, session_id: Optional[int]
+    ):
+        key = fingerprint(statement)
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            self.by_fingerprint[key] += 1
+            self.by_session[session_id] += 1
+            self.statements.setdefault(key, normalize_statement(statement))
+
+    def repeated(self, threshold: int = 2) -> dict[str, int]:
+        """statements executed at least threshold times, most common first."""
+        return {
+            self.statements[key]: n
+            for key, n in self.by_fingerprint.most_common()
+            if n >= threshold
+        }
+
+    @property
+    def max_repeats(self) -> int:
+        if len(self.by_fingerprint) == 0:
+            return 0
+        return self.by_fingerprint.most_common(1)[0][1]
+
+    def __repr__(self):
+        return (
+            f"QueryStats({self.count} queries, {self.seconds * 1000:.1f} "
+            f"ms, {len(self.by_session)} sessions)"
+        )
+
+
+def _before_execute(conn, _cursor, _statement, _params, _context, _many):
+    if len(_ACTIVE.get()) > 0:
+        conn.info.setdefault("query_starts", []).append(time.perf_counter())
+
+
+def _after_execute(conn, _cursor, statement, _params, _context, _many):
+    if len(active := _ACTIVE.get()) == 0:
+        return
+    if len(starts := conn.info.get("query_starts", [])) == 0:
+        # started before we began measuring
+        return
+    seconds = time.perf_counter() - starts.pop()
+    for stats in active:
+        stats.record(statement, seconds, conn.info.get("session_id"))
+
+
+def _tag_connection(session, _transaction, connection):
+    if "instrumentation_id" not in session.info:
+        session.info["instrumentation_id"] = next(_SESSION_IDS)
+    connection.info["session_id"] = session.info["instrumentation_id"]
+
+
+def _untag_connection(_dbapi_connection, connection_record):
+    connection_record.info.pop("session_id", None)
+    connection_record.info.pop("query_starts", None)
+
+
+def install():
+    """install the instrumentation listeners, if they aren't already."""
+    with _INSTALL_LOCK:
+        if event.contains(Engine, "after_cursor_execute", _after_execute):
+            return
+        event.listen(Engine, "before_cursor_execute", _before_execute)
+        event.listen(Engine, "after_cursor_execute", _after_execute)
+        event.listen(Session, "after_begin", _tag_connection)
+        event.listen(Pool, "checkin", _untag_connection)
+
+
+@contextmanager
+def measure_queries():
+    """
+    measure the queries executed within a with block. blocks may be
+    nested; each measures everything executed inside it.
+    """
+    install()
+    stats = QueryStats()
+    token = _ACTIVE.set(_ACTIVE.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _ACTIVE.reset(token)
+
+
+def log_query_summary(
+    source: str, stats: QueryStats, logpath: Optional[Path] = None
+):
+    """
+    append a one-line summary of stats to the query log. warns rather than
+    raising if it can't, so instrumentation never fails the work it measures.
+    """
+    logpath = QUERY_LOG_FILE if logpath is None else logpath
+    repeated = next(iter(stats.repeated()), "")
+    try:
+        with open(logpath, "a", newline="") as stream:
+            csv.writer(stream).writerow(
+                (
+                    f"{time.time():.6f}",
+                    source,
+                    stats.count,
+                    f"{stats.seconds * 1000:.3f}",
+                    len(stats.by_session),
+                    stats.max_repeats,
+                    repeated[:200],
+                )
+            )
+    except OSError as ose:
+        warnings.warn(
+            f"couldn't write {source} query summary to {logpath}: {ose}"
+        )
+
+
+def counted_queries(execute: Callable) -> Callable:
+    """
+    decorator for Actor.execute methods. if QUERY_INSTRUMENTATION is True,
+    logs a summary of the queries each execution makes.
+    """
+
+    @wraps(execute)
+    def execute_with_query_count(self, *args, **kwargs):
+        if QUERY_INSTRUMENTATION is False:
+            return execute(self, *args, **kwargs)
+        with measure_queries() as stats:
+            try:
+                return execute(self, *args, **kwargs)
+            finally:
+                log_query_summary(f"actor:{self.name}", stats)
+
+    return execute_with_query_count
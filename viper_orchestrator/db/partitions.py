@@ -0,0 +1,339 @@
+"""
+monthly range partitioning of light_records, and parquet archival of old
+partitions.
+
+vipersci defines light_records as an ordinary table. db.runtime converts it
+(once) into a table partitioned by datetime, with one partition per UTC
+calendar month; because postgres requires a partitioned table's unique
+constraints to include the partition key, the converted table's primary key
+is (id, datetime). ids come from the light_record_ids sequence.
+
+queries with datetime bounds touch only the partitions that overlap them,
+and 'latest record before t' queries (ORDER BY datetime DESC LIMIT 1) read
+partitions newest-first and stop at the first match, so lookups don't slow
+down as the table grows. there is no default partition: anything that
+inserts LightRecords must call ensure_light_partitions() for their
+datetimes first, and, because it caches partitions that another process may
+archive, call forget_light_partitions() and retry if the insert finds no
+partition (InsertIntoDatabase does both).
+
+archive_light_partitions() writes partitions that end before a cutoff to
+LIGHT_ARCHIVE_ROOT and drops them. archived records are still visible to
+get_light_state() through archived_light_state(). archival is maintenance,
+not setup: the station runs archive_old_light_partitions() when it starts,
+and it can also be run on its own:
+
+python -m viper_orchestrator.db.partitions
+
+every process that imports db.runtime prepares partitions, and all
+structural changes to light_records happen under the LIGHT_PARTITION_LOCK
+advisory lock.
+"""
+import datetime as dt
+from pathlib import Path
+from typing import Collection, Iterator, Optional
+
+import fire
+import pandas as pd
+from sqlalchemy import Connection, text
+
+from viper_orchestrator.config import (
+    LIGHT_ARCHIVE_ROOT,
+    LIGHT_RETENTION_MONTHS,
+)
+from viper_orchestrator.db.utility_tables import LIGHT_RECORD_KEY
+from vipersci.vis.db.light_records import LightRecord, luminaire_names
+
+LIGHT_RECORD_TABLE = LightRecord.__tablename__
+LIGHT_ID_SEQUENCE = "light_record_ids"
+# months of partitions to create beyond the current one at startup
+MONTHS_AHEAD = 1
+# committed partitions, so that ensure_light_partitions() is usually free.
+# another process may archive one of them; see forget_light_partitions().
+_KNOWN_PARTITIONS: set[str] = set()
+# postgres advisory lock key serializing partition creation, conversion,
+# and archival across processes
+LIGHT_PARTITION_LOCK = 0x6C696768
+
+
+def lock_light_partitions(connection: Connection):
+    """wait for LIGHT_PARTITION_LOCK, holding it until the transaction ends"""
+    connection.execute(
+        text("SELECT pg_advisory_xact_lock(:key)"),
+        {"key": LIGHT_PARTITION_LOCK},
+    )
+
+
+def month_start(time: dt.datetime) -> dt.datetime:
+    time = time.astimezone(dt.UTC)
+    return dt.datetime(time.year, time.month, 1, tzinfo=dt.UTC)
+
+
+def add_months(start: dt.datetime, months: int) -> dt.datetime:
+    """start of the month `months` months after the month starting at start"""
+    years, month = divmod(start.month - 1 + months, 12)
+    return start.replace(year=start.year + years, month=month + 1)
+
+
+def next_month(start: dt.datetime) -> dt.datetime:
+    return add_months(start, 1)
+
+
+def months_between(
+    start: dt.datetime, stop: dt.datetime
+) -> Iterator[dt.datetime]:
+    """starts of the months that overlap [start, stop]."""
+    month, stop = month_start(start), month_start(stop)
+    while month <= stop:
+        yield month
+        month = next_month(month)
+
+
+def partition_name(month: dt.datetime) -> str:
+    return f"{LIGHT_RECORD_TABLE}_{month:%Y_%m}"
+
+
+def partition_month(name: str) -> dt.datetime:
+    return dt.datetime.strptime(
+        name.removeprefix(f"{LIGHT_RECORD_TABLE}_"), "%Y_%m"
+    ).replace(tzinfo=dt.UTC)
+
+
+def is_partitioned(connection: Connection) -> bool:
+    relkind = connection.scalar(
+        text("SELECT relkind FROM pg_class WHERE relname = :name"),
+        {"name": LIGHT_RECORD_TABLE},
+    )
+    return relkind == "p"
+
+
+def light_partitions(connection: Connection) -> list[str]:
+    """names of the existing partitions of light_records, oldest first."""
+    return sorted(
+        connection.scalars(
+            text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = :name"
+            ),
+            {"name": LIGHT_RECORD_TABLE},
+        )
+    )
+
+
+def forget_light_partitions():
+    """
+    clear ensure_light_partitions()' cache of existing partitions. call this
+    if an insert fails with 'no partition of relation ... found for row':
+    another process has dropped a partition this one thought existed.
+    """
+    _KNOWN_PARTITIONS.clear()
+
+
+def ensure_light_partitions(
+    times: Collection[dt.datetime], connection: Connection
+):
+    """create any missing partitions for records with these datetimes."""
+    if len(times) == 0:
+        return
+    locked = False
+    for month in months_between(min(times), max(times)):
+        if (name := partition_name(month)) in _KNOWN_PARTITIONS:
+            continue
+        exists = text(f"SELECT to_regclass('{name}')")
+        if connection.scalar(exists):
+            # only cache partitions we didn't just create: if this
+            # transaction is rolled back, ours will vanish with it
+            _KNOWN_PARTITIONS.add(name)
+            continue
+        if locked is False:
+            lock_light_partitions(connection)
+            locked = True
+            # another process may have created it while we waited
+            if connection.scalar(exists):
+                continue
+        connection.execute(
+            text(
+                f"CREATE TABLE {name} PARTITION OF {LIGHT_RECORD_TABLE} "
+                f"FOR VALUES FROM ('{month.isoformat()}') "
+                f"TO ('{next_month(month).isoformat()}')"
+            )
+        )
+
+
+def partition_light_records(connection: Connection):
+    """
+    convert an ordinary light_records table into a partitioned one, along
+    with its contents. does nothing if it's already partitioned. does not
+    commit.
+    """
+    if is_partitioned(connection):
+        return
+    old = f"{LIGHT_RECORD_TABLE}_unpartitioned"
+    for statement in (
+        f"ALTER TABLE {LIGHT_RECORD_TABLE} RENAME TO {old}",
+        f"ALTER INDEX IF EXISTS {LIGHT_RECORD_TABLE}_pkey "
+        f"RENAME TO {old}_pkey",
+        f"ALTER INDEX IF EXISTS {LIGHT_RECORD_KEY.name} "
+        f"RENAME TO {old}_name_datetime_key",
+        f"CREATE SEQUENCE IF NOT EXISTS {LIGHT_ID_SEQUENCE}",
+        f"CREATE TABLE {LIGHT_RECORD_TABLE} ("
+        f"id INTEGER NOT NULL DEFAULT nextval('{LIGHT_ID_SEQUENCE}'), "
+        f'name VARCHAR NOT NULL, "on" BOOLEAN NOT NULL, '
+        f"datetime TIMESTAMP WITH TIME ZONE NOT NULL, "
+        f"PRIMARY KEY (id, datetime)"
+        f") PARTITION BY RANGE (datetime)",
+        f"ALTER SEQUENCE {LIGHT_ID_SEQUENCE} "
+        f"OWNED BY {LIGHT_RECORD_TABLE}.id",
+    ):
+        connection.execute(text(statement))
+    LIGHT_RECORD_KEY.create(connection)
+    first, last = connection.execute(
+        text(f"SELECT min(datetime), max(datetime) FROM {old}")
+    ).one()
+    ensure_light_partitions(
+        [t for t in (first, last) if t is not None], connection
+    )
+    for statement in (
+        f'INSERT INTO {LIGHT_RECORD_TABLE} (id, name, "on", datetime) '
+        f'SELECT id, name, "on", datetime FROM {old}',
+        f"SELECT setval('{LIGHT_ID_SEQUENCE}', "
+        f"coalesce(max(id), 0) + 1, false) FROM {LIGHT_RECORD_TABLE}",
+        f"DROP TABLE {old}",
+    ):
+        connection.execute(text(statement))
+
+
+def prepare_light_partitions(connection: Connection):
+    """
+    partition light_records if it isn't already, and create partitions for
+    this month and the next MONTHS_AHEAD. does not commit.
+    """
+    lock_light_partitions(connection)
+    partition_light_records(connection)
+    this_month = month_start(dt.datetime.now(dt.UTC))
+    ensure_light_partitions(
+        [this_month, add_months(this_month, MONTHS_AHEAD)], connection
+    )
+
+
+def archive_path(name: str, archive_root: Optional[Path] = None) -> Path:
+    archive_root = LIGHT_ARCHIVE_ROOT if archive_root is None else archive_root
+    return Path(archive_root, f"{name}.parquet")
+
+
+def archive_light_partitions(
+    before: dt.datetime,
+    connection: Connection,
+    archive_root: Optional[Path] = None,
+) -> list[Path]:
+    """
+    write each partition that ends on or before `before` to a parquet file,
+    then detach and drop it. commits after each partition, so call it with
+    a Connection dedicated to the purpose. does nothing if another process
+    holds LIGHT_PARTITION_LOCK (e.g. it's already archiving). returns the
+    archive paths.
+    """
+    key = {"key": LIGHT_PARTITION_LOCK}
+    if not connection.scalar(text("SELECT pg_try_advisory_lock(:key)"), key):
+        connection.rollback()
+        return []
+    try:
+        return _archive_light_partitions(before, connection, archive_root)
+    finally:
+        # session-level advisory locks outlive transactions; release it
+        # whether or not archiving succeeded
+        connection.rollback()
+        connection.execute(text("SELECT pg_advisory_unlock(:key)"), key)
+        connection.commit()
+
+
+def archive_old_light_partitions(
+    retention_months: Optional[int] = LIGHT_RETENTION_MONTHS,
+) -> list[Path]:
+    """
+    archive partitions of light_records older than retention_months
+    (counting back from the start of this month). does nothing if
+    retention_months is None. returns the archive paths.
+    """
+    if retention_months is None:
+        return []
+    # imported here because db.runtime imports this module
+    from viper_orchestrator.db.runtime import ENGINE
+
+    cutoff = add_months(
+        month_start(dt.datetime.now(dt.UTC)), -retention_months
+    )
+    with ENGINE.connect() as connection:
+        return archive_light_partitions(cutoff, connection)
+
+
+def _archive_light_partitions(
+    before: dt.datetime, connection: Connection, archive_root: Optional[Path]
+) -> list[Path]:
+    archived = []
+    for name in light_partitions(connection):
+        if next_month(partition_month(name)) > before:
+            continue
+        path = archive_path(name, archive_root)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        rows = connection.execute(
+            text(f'SELECT id, name, "on", datetime FROM {name} ORDER BY id')
+        )
+        # if this partition was archived before and then recreated by a
+        # backfill, keep the records from both
+        records = pd.DataFrame(rows.all(), columns=list(rows.keys()))
+        if path.exists():
+            records = pd.concat([pd.read_parquet(path), records])
+            records = records.drop_duplicates(["name", "datetime"])
+        records.to_parquet(path, index=False)
+        connection.execute(
+            text(f"ALTER TABLE {LIGHT_RECORD_TABLE} DETACH PARTITION {name}")
+        )
+        connection.execute(text(f"DROP TABLE {name}"))
+        connection.commit()
+        _KNOWN_PARTITIONS.discard(name)
+        archived.append(path)
+    return archived
+
+
+def archived_light_state(
+    before: Optional[dt.datetime],
+    names: Collection[str],
+    archive_root: Optional[Path] = None,
+) -> dict[str, tuple[dt.datetime, bool]]:
+    """
+    (datetime, on) of the latest archived record before `before` (or at all,
+    if before is None) for each luminaire in names that has one, keyed as in
+    names (either luminaire keys or full names). reads archives newest
+    first, and only as many as it needs.
+    """
+    archive_root = LIGHT_ARCHIVE_ROOT if archive_root is None else archive_root
+    if len(names) == 0 or not Path(archive_root).exists():
+        return {}
+    # LightRecords hold full luminaire names
+    requested = {luminaire_names.get(n, n): n for n in names}
+    found, names = {}, set(requested.keys())
+    paths = sorted(
+        Path(archive_root).glob(f"{LIGHT_RECORD_TABLE}_*.parquet"),
+        reverse=True,
+    )
+    for path in paths:
+        if before is not None and partition_month(path.stem) >= before:
+            continue
+        records = pd.read_parquet(path).sort_values("datetime")
+        if before is not None:
+            records = records.loc[records["datetime"] < before]
+        latest = records.loc[records["name"].isin(names - found.keys())]
+        for _, rec in latest.groupby("name").last().iterrows():
+            found[rec.name] = (
+                rec["datetime"].to_pydatetime(), bool(rec["on"])
+            )
+        if found.keys() == names:
+            break
+    return {requested[name]: value for name, value in found.items()}
+
+
+if __name__ == "__main__":
+    fire.Fire(archive_old_light_partitions)
@@ -9,12 +9,25 @@ from pathlib import Path
 import re
 
 from invoke import UnexpectedExit
-from sqlalchemy import create_engine, select, insert
+from sqlalchemy import create_engine, insert, inspect, select, text
 from sqlalchemy.orm import Session
 
 from hostess.subutils import Viewer, run
 from hostess.utilities import timeout_factory
 from viper_orchestrator.config import BASES, DB_ROOT
+from viper_orchestrator.db.partitions import (
+    is_partitioned,
+    prepare_light_partitions,
+)
+from viper_orchestrator.db.utility_tables import (
+    BUMP_TABLE_VERSION,
+    LIGHT_RECORD_KEY,
+    LOOKUP_INDEXES,
+    LightTransition,
+    VERSIONED_TABLES,
+    rebuild_light_transitions,
+)
+from vipersci.vis.db.light_records import LightRecord
 from vipersci.vis.db.image_tags import ImageTag, taglist
 from vipersci.vis.db.ldst import LDST
 
@@ -150,6 +163,107 @@ for base in BASES:
     base.metadata.create_all(ENGINE)
 
 
+def set_up_light_record_key():
+    """
+    create the unique (name, datetime) index on light_records that
+    InsertIntoDatabase's upserts rely on. create_all() only creates indexes
+    along with their tables, so databases that predate the index need it
+    added here, after dropping any exact duplicates it would reject.
+    """
+    with ENGINE.begin() as connection:
+        if is_partitioned(connection):
+            # created along with the partitioned table
+            return
+        indexes = inspect(connection).get_indexes("light_records")
+        if LIGHT_RECORD_KEY.name in {i["name"] for i in indexes}:
+            return
+        connection.execute(
+            text(
+                "DELETE FROM light_records a USING light_records b "
+                "WHERE a.name = b.name AND a.datetime = b.datetime "
+                "AND a.id > b.id"
+            )
+        )
+        LIGHT_RECORD_KEY.create(connection)
+
+
+set_up_light_record_key()
+
+
+def set_up_lookup_indexes():
+    """
+    create any missing LOOKUP_INDEXES. as with LIGHT_RECORD_KEY,
+    create_all() only creates them along with their tables.
+    """
+    with ENGINE.begin() as connection:
+        for index in LOOKUP_INDEXES:
+            index.create(connection, checkfirst=True)
+
+
+set_up_lookup_indexes()
+
+
+def set_up_light_partitions():
+    """
+    partition light_records by month, and create partitions for this month
+    and the next (see db.partitions). old partitions are archived by
+    db.partitions.archive_old_light_partitions(), not here.
+    """
+    with ENGINE.begin() as connection:
+        prepare_light_partitions(connection)
+
+
+set_up_light_partitions()
+
+
+def set_up_light_transitions():
+    """
+    populate the LightTransition table from existing LightRecords if it's
+    empty (e.g. it's new and the database isn't).
+    """
+    with Session(ENGINE) as session:
+        transition = session.scalars(select(LightTransition).limit(1))
+        if transition.first() is not None:
+            return
+        if session.scalars(select(LightRecord.id).limit(1)).first() is None:
+            return
+        rebuild_light_transitions(session=session)
+
+
+set_up_light_transitions()
+
+
+def set_up_table_versions():
+    """
+    create the trigger function that maintains TableVersion, and attach it
+    to any of VERSIONED_TABLES that lack it.
+    """
+    with ENGINE.begin() as connection:
+        function = connection.scalar(
+            text("SELECT to_regproc('bump_table_version')")
+        )
+        if function is None:
+            connection.execute(text(BUMP_TABLE_VERSION))
+        triggers = set(
+            connection.scalars(
+                text("SELECT tgname FROM pg_trigger WHERE NOT tgisinternal")
+            )
+        )
+        for table in VERSIONED_TABLES:
+            if f"{table}_version" in triggers:
+                continue
+            connection.execute(
+                text(
+                    f"CREATE TRIGGER {table}_version AFTER INSERT OR UPDATE "
+                    f"OR DELETE OR TRUNCATE ON {table} FOR EACH STATEMENT "
+                    f"EXECUTE FUNCTION bump_table_version()"
+                )
+            )
+
+
+set_up_table_versions()
+
+
 # initialize pseudo-enums from configuration file
 # NOTE: semi-vendored from init function in science repo. it must exactly copy
 # this 'official' code and should not be changed.
@@ -1,8 +1,11 @@
+import asyncio
 from functools import wraps
-from typing import Any, Optional
+from typing import Any, Callable, Optional, TypeVar
 
 from sqlalchemy.orm import Session
 
+T = TypeVar("T")
+
 
 class OSession:
     """
@@ -53,3 +56,23 @@ def autosession(func, manager=OSession):
             return func(*args, session=session, **kwargs)
 
     return with_autosession
+
+
+async def in_session(
+    func: Callable[[Session], T], manager: type = OSession
+) -> T:
+    """
+    await func(session) run with its own Session in a worker thread. this
+    lets async code (e.g. async Django views) make blocking queries without
+    stalling the event loop, and make independent queries concurrently with
+    asyncio.gather().
+
+    as with autosession, any DeclarativeBase instances func returns will be
+    detached, so func should do everything that needs the Session itself.
+    """
+
+    def run_in_session():
+        with manager() as session:
+            return func(session)
+
+    return await asyncio.to_thread(run_in_session)
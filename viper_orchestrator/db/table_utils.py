@@ -1,10 +1,24 @@
 """abstractions for ORM object queries and introspection."""
 from __future__ import annotations
 
+from functools import cache
 from operator import gt, lt
-from typing import Collection, Union, Any, Optional, TYPE_CHECKING
-
-from sqlalchemy import select, inspect, sql
+from sys import getsizeof
+from typing import Collection, Iterator, Union, Any, Optional, TYPE_CHECKING
+
+from sqlalchemy import (
+    ColumnElement,
+    Select,
+    any_,
+    delete,
+    inspect,
+    literal,
+    select,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.orm import Session, DeclarativeBase
 from sqlalchemy.orm.decl_api import DeclarativeAttributeIntercept
@@ -13,6 +27,9 @@ from viper_orchestrator.db import OSession
 from viper_orchestrator.db.session import autosession
 from vipersci.vis.db.image_records import ImageRecord, ImageType
 from vipersci.vis.db.image_requests import ImageRequest
+from vipersci.vis.db.junc_image_req_ldst import JuncImageRequestLDST
+from vipersci.vis.db.ldst import LDST
+from vipersci.vis.db.light_records import LightRecord
 
 if TYPE_CHECKING:
     from viper_orchestrator.orchtypes import MappedRow
@@ -27,18 +44,30 @@ def collstring(coll: Collection) -> str:
     return ",".join(map(str, coll))
 
 
-def pk(obj: Union[type[MappedRow], MappedRow]) -> Union[str, tuple[str]]:
-    """get the name of a SQLAlchemy table's primary key(s)"""
-    if not isinstance(obj, DeclarativeAttributeIntercept):
-        inspection = inspect(type(obj))
-    else:
-        inspection = inspect(obj)
-    keys = [key.name for key in inspection.primary_key]
+@cache
+def _pk_names(table: type[MappedRow]) -> Union[str, tuple[str]]:
+    keys = [key.name for key in inspect(table).primary_key]
     if len(keys) > 1:
         return tuple(keys)
     return keys[0]
 
 
+def pk(obj: Union[type[MappedRow], MappedRow]) -> Union[str, tuple[str]]:
+    """
+    get the name of a SQLAlchemy table's primary key(s). cached per class.
+    """
+    if not isinstance(obj, DeclarativeAttributeIntercept):
+        return _pk_names(type(obj))
+    return _pk_names(obj)
+
+
+def pk_value(row: MappedRow) -> Any:
+    """get a row's primary key value (a tuple, for composite keys)."""
+    if isinstance(names := pk(row), tuple):
+        return tuple(getattr(row, n) for n in names)
+    return getattr(row, names)
+
+
 def get_record_attrs(
     recs: Union[ImageRequest, Collection[ImageRecord]],
     attr: str,
@@ -113,6 +142,48 @@ def records_from_capture_ids(
     return records
 
 
+# columns that identify a row independently of its surrogate primary key.
+# LightRecord's are backed by an index created in db.runtime.
+NATURAL_KEYS = {
+    ImageRecord: ("product_id",),
+    LightRecord: ("name", "datetime"),
+}
+
+
+def row_values(row: MappedRow) -> dict[str, Any]:
+    """
+    get the column attributes that have actually been set on an ORM object,
+    suitable for use as parameters to an ORM bulk insert.
+    """
+    columns = inspect(type(row)).column_attrs.keys()
+    return {k: v for k, v in vars(row).items() if k in columns}
+
+
+def insert_new_rows(
+    rows: Collection[MappedRow], session: Session
+) -> tuple[int, int]:
+    """
+    insert ORM objects whose tables have natural keys (see NATURAL_KEYS)
+    with one INSERT ... ON CONFLICT DO NOTHING statement per table, so that
+    republished or replayed rows are skipped rather than failing (or
+    duplicating) the whole batch. all rows must belong to tables in
+    NATURAL_KEYS. does not commit. objects are not added to the session.
+    returns (number inserted, number skipped).
+    """
+    bytable = {}
+    for row in rows:
+        bytable.setdefault(type(row), []).append(row_values(row))
+    inserted = 0
+    for table, params in bytable.items():
+        statement = (
+            pg_insert(table)
+            .on_conflict_do_nothing(index_elements=NATURAL_KEYS[table])
+            .returning(getattr(table, pk(table)))
+        )
+        inserted += len(session.execute(statement, params).all())
+    return inserted, len(rows) - inserted
+
+
 @autosession
 def get_one(
     table: type[MappedRow],
@@ -171,33 +242,228 @@ def delete_cascade(
         session.commit()
 
 
+@autosession
+def bulk_delete(
+    table: type[MappedRow],
+    targets: Union[Select, Collection[Any]],
+    junc_names: Collection[str] = (),
+    session: Optional[Session] = None,
+    commit: bool = True,
+) -> dict[str, int]:
+    """
+    set-based equivalent of delete_cascade() for many rows at once. targets
+    is either a Select of table (or of its primary key) or a collection of
+    primary key values. deletes the rows of the relationships named in
+    junc_names that refer to targets, then -- as the ORM would on delete --
+    rows of the secondary tables of table's many-to-many relationships and
+    foreign keys to targets in its other one-to-many relationships are
+    deleted and set to NULL respectively, and finally the targets
+    themselves. issues one statement per table, all in the same
+    transaction, and commits only if commit is True.
+
+    returns the number of rows deleted from each table, along with the
+    number of rows whose foreign keys were set to NULL, keyed by
+    "table.column".
+
+    bypasses the ORM, so any objects already loaded into session that
+    represent (or refer to) deleted rows will be stale until it's committed
+    or they're expired. it also bypasses the Session hooks that maintain
+    RequestSummaries, so it refreshes the summaries of affected requests
+    itself, in the same transaction.
+    """
+    if isinstance(pk(table), tuple):
+        raise TypeError("bulk_delete() doesn't support composite keys")
+    key = getattr(table, pk(table))
+    if isinstance(targets, Select):
+        # resolve targets once, since later statements may change which
+        # rows a selector matches
+        targets = session.scalars(targets.with_only_columns(key)).all()
+    ids = literal(list(targets), ARRAY(key.type))
+    stale = _summarized_requests(table, ids, session)
+    deletes, nulls = [], []
+    for relationship in inspect(table).relationships:
+        if relationship.viewonly is True:
+            continue
+        if relationship.secondary is not None:
+            deletes += [
+                (relationship.secondary, child, parent)
+                for parent, child in relationship.synchronize_pairs
+            ]
+        elif relationship.direction.name != "ONETOMANY":
+            continue
+        elif relationship.key in junc_names:
+            deletes += [
+                (child.table, child, parent)
+                for parent, child in relationship.synchronize_pairs
+            ]
+        else:
+            nulls += [
+                (child.table, child, parent)
+                for parent, child in relationship.synchronize_pairs
+            ]
+    counts = {}
+
+    def refers(child, parent):
+        if parent.name == key.expression.name:
+            return child == any_(ids)
+        return child.in_(select(parent).where(key == any_(ids)))
+
+    for junction, child, parent in deletes:
+        result = session.execute(
+            delete(junction).where(refers(child, parent))
+        )
+        counts[junction.name] = counts.get(junction.name, 0) + result.rowcount
+    for child_table, child, parent in nulls:
+        result = session.execute(
+            update(child_table)
+            .where(refers(child, parent))
+            .values({child.name: None})
+        )
+        counts[f"{child_table.name}.{child.name}"] = result.rowcount
+    result = session.execute(delete(table.__table__).where(key == any_(ids)))
+    counts[table.__tablename__] = result.rowcount
+    if len(stale) > 0:
+        # imported here to avoid a circular import (and only registers
+        # summaries' Session hooks if they're needed)
+        from viper_orchestrator.visintent.tracking.summaries import (
+            refresh_request_summaries,
+        )
+
+        refresh_request_summaries(stale, session.connection())
+    if commit is True:
+        session.commit()
+    return counts
+
+
+def _summarized_requests(
+    table: type[MappedRow], ids: ColumnElement, session: Session
+) -> set[int]:
+    """
+    ids of the ImageRequests whose RequestSummaries deleting the rows of
+    table with primary keys in ids will change.
+    """
+    if table is ImageRequest:
+        selector = select(ImageRequest.id).where(ImageRequest.id == any_(ids))
+    elif table is ImageRecord:
+        selector = select(ImageRecord.image_request_id).where(
+            ImageRecord.id == any_(ids)
+        )
+    elif table is LDST:
+        selector = select(JuncImageRequestLDST.image_request_id).where(
+            JuncImageRequestLDST.ldst_id == any_(ids)
+        )
+    else:
+        return set()
+    return set(session.scalars(selector.distinct())) - {None}
+
+
 @autosession
 def delete_image_request(request=None, req_id=None, session=None):
     if request is None and req_id is None:
         raise TypeError
     if request is None:
-        request = get_one(ImageRequest, req_id)
-    delete_cascade(request, ("ldst_associations",), session=session)
+        request = get_one(ImageRequest, req_id, session=session)
+    return bulk_delete(
+        ImageRequest, [request.id], ("ldst_associations",), session=session
+    )
 
 
-@autosession
-def iterquery(selector, column, descending=True, window=50, session=None):
-    last_key = None
-    ordering = f"{column.name} desc" if descending is True else column
-    comparator = lt if descending is True else gt
-    statement = selector.add_columns(column).order_by(sql.text(ordering))
-    while True:
-        query = statement
-        if last_key is not None:
-            query = query.filter(comparator(column, last_key))
-        result = session.execute(query.limit(window))
-        frozen = result.freeze()
-        chunk = frozen().all()
-        if not chunk:
-            break
-        result_width = len(chunk[0])
-        last_key = chunk[-1][-1]
-        yield frozen().columns(
-            *list(range(0, result_width - 1))
-        ).scalars().all()
+def _approx_bytes(value: Any) -> int:
+    """rough in-memory size of a result value (or ORM object's columns)"""
+    if isinstance(type(value), DeclarativeAttributeIntercept):
+        return sum(map(getsizeof, row_values(value).values()))
+    return getsizeof(value)
+
 
+def _keyset_pages(
+    statement: Select,
+    keys: tuple[ColumnElement, ...],
+    descending: bool,
+    window: int,
+    target_bytes: Optional[int],
+    max_window: int,
+    stream: bool,
+    session: Session,
+) -> Iterator[list]:
+    comparator = lt if descending is True else gt
+    last_key, result = None, None
+    if stream is True:
+        result = session.execute(
+            statement, execution_options={"yield_per": max_window}
+        )
+    try:
+        while True:
+            if result is not None:
+                rows = result.fetchmany(window)
+            else:
+                query = statement
+                if last_key is not None:
+                    query = query.where(
+                        comparator(tuple_(*keys), tuple_(*last_key))
+                    )
+                rows = session.execute(query.limit(window)).all()
+            if len(rows) == 0:
+                return
+            exhausted = result is None and len(rows) < window
+            width = len(rows[0]) - len(keys)
+            last_key = tuple(rows[-1][width:])
+            if target_bytes is not None:
+                row_bytes = sum(map(_approx_bytes, rows[-1][:width]))
+                window = max(1, min(max_window, target_bytes // row_bytes))
+            if width == 1:
+                yield [row[0] for row in rows]
+            else:
+                yield [tuple(row[:width]) for row in rows]
+            if exhausted:
+                return
+    finally:
+        if result is not None:
+            result.close()
+
+
+def iterkeyset(
+    selector: Select,
+    column: ColumnElement,
+    descending: bool = True,
+    window: int = 50,
+    target_bytes: Optional[int] = None,
+    max_window: int = 5000,
+    stream: bool = False,
+    session: Optional[Session] = None,
+) -> Iterator[list]:
+    """
+    iterate over the results of selector in pages, ordered by column and
+    then by the primary key of column's table, which breaks ties so that
+    rows that share a value of column are neither skipped nor repeated.
+    each page is a list of scalars if selector selects a single entity or
+    column, and of tuples otherwise. column should be non-nullable.
+
+    by default, each page is a separate query that resumes after the last
+    row of the previous one (WHERE (column, pk) < (last column, last pk),
+    if descending), which is cheap given an index on (column, pk) and safe
+    to pause between pages. if stream is True, instead runs one query
+    through a server-side cursor and fetches pages from it, which saves the
+    repeated queries but holds a transaction open until iteration ends.
+
+    if target_bytes is not None, window is only the size of the first page;
+    later pages are sized (up to max_window rows) to hold about
+    target_bytes, estimated from the width of the previous page's rows.
+
+    like autosession, opens (and closes, once exhausted or closed) its own
+    Session if not passed one.
+    """
+    keys = (column, *column.expression.table.primary_key.columns)
+    order = [key.desc() if descending is True else key for key in keys]
+    statement = (
+        selector.add_columns(
+            *(key.label(f"_keyset_{i}") for i, key in enumerate(keys))
+        )
+        .order_by(None)
+        .order_by(*order)
+    )
+    args = (keys, descending, window, target_bytes, max_window, stream)
+    if session is not None:
+        yield from _keyset_pages(statement, *args, session)
+        return
+    with OSession() as session:
+        yield from _keyset_pages(statement, *args, session)
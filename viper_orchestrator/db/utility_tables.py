@@ -1,24 +1,403 @@
 """
-utility tables for persisting orchestrator state.
-currently empty as what needs to be persisted is in flux.
+utility tables for persisting orchestrator state between runs, along with
+a small API for reading and updating them.
+
+the writers in this module do not commit. they are intended to be executed
+in the same transaction as the inserts they describe, so that the persisted
+state never gets ahead of (or falls behind) the records themselves.
+"""
+from __future__ import annotations
+
+import datetime as dt
+from typing import Mapping, Optional
+
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    DateTime,
+    Index,
+    Integer,
+    String,
+    delete,
+    func,
+    select,
+    text,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import DeclarativeBase, Session, mapped_column
+
+from viper_orchestrator.db.session import autosession
+from vipersci.vis.db.image_records import ImageRecord
+from vipersci.vis.db.light_records import LightRecord, luminaire_names
+
+
+# LightRecords may carry either luminaire keys or full luminaire names
+_LUMINAIRE_KEYS = {v: k for k, v in luminaire_names.items()}
+# bit of each luminaire in LightTransition masks. order is that of
+# vipersci's luminaire_names, so changing it there invalidates stored masks.
+LUMINAIRE_BITS = {name: 1 << i for i, name in enumerate(luminaire_names)}
+# postgres advisory lock key serializing writes to LightTransition, whose
+# rows depend on the rows before them
+LIGHT_TRANSITION_LOCK = 0x6C747278
+
+
+# natural key for LightRecords. vipersci doesn't define one, so we own it;
+# db.runtime creates it on existing databases.
+LIGHT_RECORD_KEY = Index(
+    "light_records_name_datetime_key",
+    LightRecord.name,
+    LightRecord.datetime,
+    unique=True,
+)
+# indexes backing the orchestrator's hot ImageRecord lookups. product_id
+# (get_one(..., "_pid")) is already covered by its unique constraint, and
+# LightRecord (name, datetime) lookups by LIGHT_RECORD_KEY. like that key,
+# these are created along with new tables and added to existing databases
+# by db.runtime.
+LOOKUP_INDEXES = (
+    # table_utils.records_from_capture_ids
+    Index("image_records_capture_id_idx", ImageRecord.capture_id),
+    # ProtectedListEntry.match_selector / supselector / populate_many
+    Index(
+        "image_records_slot_idx",
+        ImageRecord.image_id,
+        ImageRecord.instrument_name,
+        ImageRecord.start_time,
+    ),
+    # start_time-ordered keyset paging (table_utils.iterkeyset)
+    Index(
+        "image_records_start_time_id_idx",
+        ImageRecord.start_time,
+        ImageRecord.id,
+    ),
+    # per-request lookups (tracking.summaries)
+    Index("image_records_image_request_id_idx", ImageRecord.image_request_id),
+)
+
+
+# tables whose modifications TableVersion counts. db.runtime attaches
+# BUMP_TABLE_VERSION to each of them as a statement-level trigger.
+VERSIONED_TABLES = (
+    "image_records",
+    "image_requests",
+    "image_tags",
+    "junc_image_record_tags",
+    "junc_image_request_ldst",
+    "light_transition",
+    "protected_list",
+)
+BUMP_TABLE_VERSION = """
+CREATE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO table_version (table_name, version)
+    VALUES (TG_TABLE_NAME, 1)
+    ON CONFLICT (table_name)
+    DO UPDATE SET version = table_version.version + 1;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
 """
-# from sqlalchemy import Column, DateTime, Integer
-# from sqlalchemy.orm import declarative_base
-
-# UtilityBase = declarative_base()
-
-#
-# def make_last_time_table_class():
-#     definition = {
-#         "__tablename__": "last_time",
-#         "pk": Column(name="pk", type_=Integer, primary_key=True),
-#     } | {
-#         param.replace("/", "_"): Column(
-#             name=param.replace("/", "_"), type_=DateTime(timezone=True)
-#         )
-#         for param in PARAMETERS_OF_INTEREST
-#     }
-#     return type("LastTime", (UtilityBase,), definition)
-#
-#
-# LastTime = make_last_time_table_class()
+
+
+class UtilityBase(DeclarativeBase):
+    pass
+
+
+class HighWaterMark(UtilityBase):
+    """
+    generation time of the latest value of each yamcs parameter the
+    orchestrator has processed. archive backfills start from here.
+    """
+
+    __tablename__ = "high_water_mark"
+    parameter = mapped_column(
+        String, primary_key=True, doc="fully-qualified yamcs parameter name"
+    )
+    generation_time = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        doc="generation time of latest processed value",
+    )
+
+
+class TableVersion(UtilityBase):
+    """
+    number of statements that have modified each of VERSIONED_TABLES,
+    maintained by triggers. a change to any of those tables changes its
+    version when the change commits, so cached pages can be checked for
+    staleness without looking at the tables themselves.
+    """
+
+    __tablename__ = "table_version"
+    table_name = mapped_column(String, primary_key=True, doc="table name")
+    version = mapped_column(
+        BigInteger, nullable=False, doc="count of modifying statements"
+    )
+
+
+class LastLightState(UtilityBase):
+    """last known state of each luminaire."""
+
+    __tablename__ = "last_light_state"
+    name = mapped_column(
+        String, primary_key=True, doc="luminaire name (key of luminaire_names)"
+    )
+    on = mapped_column(Boolean, nullable=False, doc="is the luminaire on?")
+    generation_time = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        doc="generation time of the latest value known to reflect this state",
+    )
+
+
+class LightTransition(UtilityBase):
+    """
+    the state of all luminaires after each change in light state, as a
+    bitmask (see LUMINAIRE_BITS), along with a mask of the luminaires that
+    changed. written alongside the per-luminaire LightRecords, so that the
+    state at any time is a single indexed lookup.
+    """
+
+    __tablename__ = "light_transition"
+    generation_time = mapped_column(
+        DateTime(timezone=True),
+        primary_key=True,
+        doc="generation time of the light state value",
+    )
+    state = mapped_column(
+        Integer, nullable=False, doc="mask of luminaires that are on"
+    )
+    changed = mapped_column(
+        Integer, nullable=False, doc="mask of luminaires that changed"
+    )
+
+
+def encode_light_state(states: Mapping[str, bool]) -> int:
+    """mask of the luminaires in states that are on."""
+    return sum(
+        LUMINAIRE_BITS[_LUMINAIRE_KEYS.get(k, k)]
+        for k, on in states.items()
+        if on is True
+    )
+
+
+def decode_light_state(mask: int) -> dict[str, bool]:
+    return {name: bool(mask & bit) for name, bit in LUMINAIRE_BITS.items()}
+
+
+@autosession
+def read_high_water_marks(session=None) -> dict[str, dt.datetime]:
+    """get all persisted high-water marks, keyed by parameter name."""
+    selector = select(HighWaterMark.parameter, HighWaterMark.generation_time)
+    return dict(session.execute(selector).all())
+
+
+def advance_high_water_marks(
+    marks: Mapping[str, dt.datetime], session: Session
+):
+    """
+    upsert high-water marks in a single statement. marks never move
+    backwards. does not commit.
+    """
+    if len(marks) == 0:
+        return
+    statement = pg_insert(HighWaterMark).values(
+        [{"parameter": p, "generation_time": t} for p, t in marks.items()]
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[HighWaterMark.parameter],
+        set_={
+            "generation_time": func.greatest(
+                HighWaterMark.generation_time,
+                statement.excluded.generation_time,
+            )
+        },
+    )
+    session.execute(statement)
+
+
+@autosession
+def read_light_state(session=None) -> Optional[dict]:
+    """
+    get the last known light state in the format returned by
+    station.components.get_light_state(), or None if none has been persisted.
+    """
+    rows = session.scalars(select(LastLightState)).all()
+    if len(rows) == 0:
+        return None
+    lightstate = {name: False for name in luminaire_names.keys()}
+    for row in rows:
+        lightstate[row.name] = row.on
+    gentime = max(row.generation_time for row in rows)
+    return lightstate | {"generation_time": gentime}
+
+
+def write_light_state(
+    states: Mapping[str, bool], gentime: dt.datetime, session: Session
+):
+    """
+    upsert the state of some or all luminaires as of gentime in a single
+    statement. rows already holding a later state are left alone. does not
+    commit.
+    """
+    states = {_LUMINAIRE_KEYS.get(k, k): v for k, v in states.items()}
+    rows = [
+        {"name": name, "on": on, "generation_time": gentime}
+        for name, on in states.items()
+        if name in luminaire_names.keys()
+    ]
+    if len(rows) == 0:
+        return
+    statement = pg_insert(LastLightState).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[LastLightState.name],
+        set_={
+            "on": statement.excluded.on,
+            "generation_time": statement.excluded.generation_time,
+        },
+        where=(
+            LastLightState.generation_time
+            <= statement.excluded.generation_time
+        ),
+    )
+    session.execute(statement)
+
+
+def lock_light_transitions(session: Session):
+    """wait for LIGHT_TRANSITION_LOCK, holding it until the transaction ends"""
+    session.execute(
+        text("SELECT pg_advisory_xact_lock(:key)"),
+        {"key": LIGHT_TRANSITION_LOCK},
+    )
+
+
+def write_light_transitions(
+    changes: Mapping[dt.datetime, Mapping[str, bool]], session: Session
+):
+    """
+    record changes in light state (generation time -> states of the
+    luminaires that changed then). transitions after the earliest change
+    are rewritten too, so changes that arrive out of order (e.g. from a
+    backfill) carry forward into the states that follow them. does not
+    commit.
+
+    holds LIGHT_TRANSITION_LOCK until the transaction ends, so concurrent
+    writers each see the other's transitions rather than overwriting them
+    with states computed without them.
+    """
+    if len(changes) == 0:
+        return
+    lock_light_transitions(session)
+    start = min(changes)
+    state = session.scalar(
+        select(LightTransition.state)
+        .where(LightTransition.generation_time < start)
+        .order_by(LightTransition.generation_time.desc())
+        .limit(1)
+    )
+    state = 0 if state is None else state
+    # generation time -> (changed mask, mask of values of changed bits)
+    transitions = {
+        row.generation_time: (row.changed, row.state & row.changed)
+        for row in session.execute(
+            select(LightTransition).where(
+                LightTransition.generation_time >= start
+            )
+        ).scalars()
+    }
+    for gentime, states in changes.items():
+        changed, values = transitions.get(gentime, (0, 0))
+        for name, on in states.items():
+            bit = LUMINAIRE_BITS[_LUMINAIRE_KEYS.get(name, name)]
+            changed |= bit
+            values = values | bit if on is True else values & ~bit
+        transitions[gentime] = (changed, values)
+    rows = []
+    for gentime in sorted(transitions):
+        changed, values = transitions[gentime]
+        state = (state & ~changed) | values
+        rows.append(
+            {"generation_time": gentime, "state": state, "changed": changed}
+        )
+    statement = pg_insert(LightTransition)
+    statement = statement.on_conflict_do_update(
+        index_elements=[LightTransition.generation_time],
+        set_={
+            "state": statement.excluded.state,
+            "changed": statement.excluded.changed,
+        },
+    )
+    session.execute(statement, rows)
+
+
+@autosession
+def light_state_at(
+    at_time: Optional[dt.datetime] = None, session=None
+) -> Optional[dict]:
+    """
+    light state immediately prior to at_time (or the latest light state if
+    at_time is None) in the format returned by
+    station.components.get_light_state(), or None if no transitions have
+    been recorded by then.
+    """
+    selector = select(LightTransition)
+    if at_time is not None:
+        selector = selector.where(LightTransition.generation_time < at_time)
+    transition = session.scalars(
+        selector.order_by(LightTransition.generation_time.desc()).limit(1)
+    ).first()
+    if transition is None:
+        return None
+    return decode_light_state(transition.state) | {
+        "generation_time": transition.generation_time
+    }
+
+
+@autosession
+def light_transitions(
+    start: Optional[dt.datetime] = None,
+    stop: Optional[dt.datetime] = None,
+    session=None,
+) -> list[tuple[dt.datetime, int]]:
+    """
+    (generation time, state mask) of each transition in [start, stop),
+    preceded by the transition in effect at start, if any.
+    """
+    selector = select(LightTransition.generation_time, LightTransition.state)
+    transitions = []
+    if start is not None:
+        selector = selector.where(LightTransition.generation_time >= start)
+        prior = session.execute(
+            select(LightTransition.generation_time, LightTransition.state)
+            .where(LightTransition.generation_time < start)
+            .order_by(LightTransition.generation_time.desc())
+            .limit(1)
+        ).first()
+        if prior is not None:
+            transitions.append(tuple(prior))
+    if stop is not None:
+        selector = selector.where(LightTransition.generation_time < stop)
+    transitions += map(
+        tuple,
+        session.execute(selector.order_by(LightTransition.generation_time)),
+    )
+    return transitions
+
+
+@autosession
+def rebuild_light_transitions(session=None):
+    """
+    recompute all transitions from the LightRecords in the database. records
+    in archived light_records partitions (see db.partitions) are not
+    included.
+    """
+    # lock before reading, so no writer can add transitions we don't see
+    lock_light_transitions(session)
+    changes = {}
+    for name, on, datetime in session.execute(
+        select(LightRecord.name, LightRecord.on, LightRecord.datetime)
+    ):
+        changes.setdefault(datetime, {})[name] = on
+    session.execute(delete(LightTransition))
+    write_light_transitions(changes, session)
+    session.commit()
@@ -0,0 +1,167 @@
+"""
+layout of raw and browse product files on disk. products are sharded into
+one directory per day per instrument, e.g.:
+
+DATA_ROOT/231015/ncl/231015-123456-ncl-c.tif
+BROWSE_ROOT/231015/ncl/231015-123456-ncl-c_thumb.jpg
+
+so that no single directory grows without bound over the course of the
+mission. everything that needs to find a product file (or build a URL to
+one) should go through the functions in this module rather than joining
+names to DATA_ROOT / BROWSE_ROOT directly.
+
+parsed JSON labels are cached in memory by read_label(); see LabelCache.
+
+run this module to migrate a flat (unsharded) product tree:
+
+python -m viper_orchestrator.products [--dry_run]
+"""
+from collections import OrderedDict
+import json
+from pathlib import Path, PurePosixPath
+import re
+from threading import Lock
+from typing import Any, Literal, Optional
+
+import fire
+
+from viper_orchestrator.config import BROWSE_ROOT, DATA_ROOT
+from vipersci.pds.pid import VISID
+
+BrowseKind = Literal["thumb", "browse"]
+# product id at the start of a product filename
+PID_PATTERN = re.compile(r"^\d{6}-\d{6}-[a-z]{3}-[a-z]")
+
+
+def product_shard(pid: str) -> PurePosixPath:
+    """shard directory for a product, relative to DATA_ROOT or BROWSE_ROOT."""
+    visid = VISID(str(pid))
+    return PurePosixPath(visid.date, visid.instrument)
+
+
+def data_relpath(pid: str, suffix: str = ".tif") -> PurePosixPath:
+    """path of a raw product file relative to DATA_ROOT (or DATA_URL)."""
+    return product_shard(pid) / f"{pid}{suffix}"
+
+
+def browse_relpath(pid: str, kind: BrowseKind = "browse") -> PurePosixPath:
+    """
+    path of a browse product file relative to BROWSE_ROOT (or BROWSE_URL).
+    """
+    return product_shard(pid) / f"{pid}_{kind}.jpg"
+
+
+def data_path(
+    pid: str, suffix: str = ".tif", root: Optional[Path] = None
+) -> Path:
+    """path to a raw product file (by default, the TIFF)."""
+    return (DATA_ROOT if root is None else root) / data_relpath(pid, suffix)
+
+
+def label_path(pid: str, root: Optional[Path] = None) -> Path:
+    """path to a product's JSON label."""
+    return data_path(pid, ".json", root)
+
+
+def browse_path(
+    pid: str, kind: BrowseKind = "browse", root: Optional[Path] = None
+) -> Path:
+    """path to a product's thumbnail or full-size browse JPEG."""
+    return (BROWSE_ROOT if root is None else root) / browse_relpath(pid, kind)
+
+
+class LabelCache:
+    """
+    thread-safe LRU cache of parsed JSON labels, keyed by path and validated
+    against the file's mtime on every lookup, so that a rewritten label is
+    never served stale. holds at most maxsize labels.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._labels: OrderedDict[Path, tuple[int, dict]] = OrderedDict()
+        self._lock = Lock()
+        self.hits, self.misses, self.stale, self.evictions = 0, 0, 0, 0
+
+    def get(self, path: Path) -> dict[str, Any]:
+        """
+        get the parsed contents of the label at path. returns a shallow copy,
+        so callers may add or replace top-level keys.
+        """
+        mtime = path.stat().st_mtime_ns
+        with self._lock:
+            cached = self._labels.get(path)
+            if cached is not None and cached[0] == mtime:
+                self._labels.move_to_end(path)
+                self.hits += 1
+                return cached[1].copy()
+            if cached is not None:
+                self.stale += 1
+            self.misses += 1
+        # don't hold the lock while reading from disk
+        with path.open() as stream:
+            label = json.load(stream)
+        with self._lock:
+            self._labels[path] = (mtime, label)
+            self._labels.move_to_end(path)
+            while len(self._labels) > self.maxsize:
+                self._labels.popitem(last=False)
+                self.evictions += 1
+        return label.copy()
+
+    def clear(self):
+        with self._lock:
+            self._labels.clear()
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._labels),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions,
+        }
+
+
+LABEL_CACHE = LabelCache()
+
+
+def read_label(pid: str, root: Optional[Path] = None) -> dict[str, Any]:
+    """read a product's JSON label, from LABEL_CACHE if possible."""
+    return LABEL_CACHE.get(label_path(pid, root))
+
+
+def migrate_flat_tree(
+    data_root: Optional[str] = None,
+    browse_root: Optional[str] = None,
+    dry_run: bool = False,
+) -> dict[str, int]:
+    """
+    move product files that sit directly in data_root or browse_root
+    (DATA_ROOT and BROWSE_ROOT by default) into their shards. files whose
+    names don't start with a product id are left alone. safe to rerun.
+    """
+    counts = {"moved": 0, "unrecognized": 0}
+    roots = (
+        DATA_ROOT if data_root is None else Path(data_root),
+        BROWSE_ROOT if browse_root is None else Path(browse_root),
+    )
+    for root in roots:
+        for path in root.iterdir():
+            if not path.is_file():
+                continue
+            if (match := PID_PATTERN.match(path.name)) is None:
+                counts["unrecognized"] += 1
+                continue
+            target = root / product_shard(match.group()) / path.name
+            if dry_run is False:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                path.rename(target)
+            counts["moved"] += 1
+    return counts
+
+
+if __name__ == "__main__":
+    fire.Fire(migrate_flat_tree)
@@ -2,15 +2,16 @@
 Sensors, Actors, and Message constructors for the orchestrator application
 """
 import datetime as dt
+import time
 from abc import ABC
 from collections import deque, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from itertools import chain
 from pathlib import Path
 from typing import (
     Any,
     Collection,
     Optional,
-    Mapping,
 )
 
 from dustgoggles.structures import listify
@@ -18,20 +19,29 @@ from google.protobuf.message import Message
 from sqlalchemy import (
     Integer,
     ForeignKey,
-    Identity, select,
+    Identity,
+    func,
+    select,
 )
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import DeclarativeBase, mapped_column
 from viper_orchestrator.station.utilities import (
+    IMAGE_PARAMETER_KEYS,
+    LightTimeline,
+    ParameterView,
+    ReorderBuffer,
     UnpackedParameter,
     unpack_parameters,
     popleft,
     push,
     validate_pdict,
-    unpack_image_parameter_data, stringify_timedict,
+    unpack_image_parameter_data,
+    stringify_timedict,
+    utcnow,
 )
 from yamcs.client import YamcsClient
 
-from hostess.station.actors import reported
+from hostess.station.actors import InstructionFromInfo, reported
 from hostess.station.bases import (
     Actor,
     Node,
@@ -47,74 +57,150 @@ from hostess.station.messages import (
     pack_obj,
 )
 from hostess.station.proto import station_pb2 as pro
-from viper_orchestrator.config import BROWSE_ROOT
 from viper_orchestrator.db import OSession
-from viper_orchestrator.yamcsutils.mock import MockYamcsClient, MockContext
+from viper_orchestrator.db.instrumentation import counted_queries
+from viper_orchestrator.db.partitions import (
+    archived_light_state,
+    ensure_light_partitions,
+    forget_light_partitions,
+)
+from viper_orchestrator.db.table_utils import NATURAL_KEYS, insert_new_rows
+from viper_orchestrator.db.utility_tables import (
+    advance_high_water_marks,
+    light_state_at,
+    light_transitions,
+    read_high_water_marks,
+    read_light_state,
+    write_light_state,
+    write_light_transitions,
+)
+from viper_orchestrator.products import browse_path, data_path, product_shard
+from viper_orchestrator.station.tracing import (
+    new_trace_id,
+    record_span,
+    traced,
+)
+from viper_orchestrator.yamcsutils.mock import (
+    MockArchive,
+    MockContext,
+    MockServer,
+    MockYamcsClient,
+)
 from vipersci.pds.pid import VISID
 from vipersci.vis import create_image
 from vipersci.vis.db.image_records import ImageRecord
 from vipersci.vis.db.image_stats import ImageStats
 from vipersci.vis.db.light_records import luminaire_names, LightRecord
 
+LIGHT_STATE_PARAMETER = "/ViperRover/LightsControl/state"
+
+
 # noinspection PyTypeChecker
 
 
+def image_task_title(instrument: str, lobt: int) -> str:
+    """
+    title of the process_image task for an image. also used to match
+    ImageRecords back to their tasks.
+    """
+    return f"{instrument} {dt.datetime.fromtimestamp(lobt, tz=dt.UTC)}"
+
+
 def process_image_instruction(note: UnpackedParameter) -> pro.Action:
     """
     convert a mapping constructed from an unpacked ParameterValue into an
     Action message specifying an image processing task.
     """
-    instrument = VISID.instrument_name(
-        note["data"]["eng_value"]["imageHeader"]["cameraId"]
-    )
-    timestamp = dt.datetime.fromtimestamp(
-        note["data"]["eng_value"]["imageHeader"]["lobt"], tz=dt.UTC
-    )
-    action = make_action(
-        name="process_image",
-        localcall=pack_obj(note["data"]),
-        description={"title": f"{instrument} {timestamp}"},
-    )
-    return make_instruction("do", action=action)
+    trace_id = note.get("trace_id", "")
+    with traced("process_image_instruction", trace_id):
+        header = note["data"]["eng_value"]["imageHeader"]
+        instrument = VISID.instrument_name(header["cameraId"])
+        action = make_action(
+            name="process_image",
+            localcall=pack_obj(note["data"]),
+            description={
+                "title": image_task_title(instrument, header["lobt"]),
+                "trace_id": trace_id,
+            },
+        )
+        return make_instruction("do", action=action)
+
 
+def tiff_path(record: ImageRecord) -> Path:
+    """path to the TIFF file ImageProcessor wrote for an ImageRecord."""
+    return data_path(record.product_id)
 
-def thumbnail_instruction(note: Mapping[str, Any]) -> pro.Action:
+
+def has_tiff(obj: Any) -> bool:
     """
-    convert a report of a newly-published image into an Action message
-    specifying a thumbnailing task.
+    is this an ImageRecord with a TIFF file? used as the Station's criterion
+    for making browse products from ImageProcessor's completion reports.
     """
-    action = make_function_call_action(
-        func="convert_16bit_tif",
-        module="viper_orchestrator.station.utilities",
-        kwargs={
-            "inpath": Path(note["content"]),
-            "outpath": BROWSE_ROOT
-            / Path(note["content"]).name.replace(".tif", "_thumb.jpg"),
-            "size": (240, 240)
-        },
-        context="process",
-        description={"title": f'thumbnail {Path(note["content"]).name}'},
+    return (
+        isinstance(obj, ImageRecord)
+        and obj.file_path is not None
+        and tiff_path(obj).is_file()
     )
-    return make_instruction("do", action=action)
 
 
-def jpeg_instruction(note: Mapping[str, Any]) -> pro.Action:
+def thumbnail_instruction(record: ImageRecord) -> pro.Action:
     """
-    convert a report of a newly-published image into an Action message
-    specifying a full-res JPEG conversion task (intended for web display).
+    convert an ImageRecord for a newly-processed image into an Action
+    message specifying a thumbnailing task.
     """
-    action = make_function_call_action(
-        func="convert_16bit_tif",
-        module="viper_orchestrator.station.utilities",
-        kwargs={
-            "inpath": Path(note["content"]),
-            "outpath": BROWSE_ROOT
-            / Path(note["content"]).name.replace(".tif", "_browse.jpg"),
-        },
-        context="process",
-        description={"title": f'make JPEG of {Path(note["content"]).name}'},
+    inpath = tiff_path(record)
+    # also trace how long it took the Station to hear about the TIFF
+    record_span(
+        "tiff_detected",
+        inpath.stat().st_mtime,
+        time.time(),
+        product_id=inpath.stem,
     )
-    return make_instruction("do", action=action)
+    with traced("thumbnail_instruction", product_id=inpath.stem):
+        action = make_function_call_action(
+            func="convert_16bit_tif",
+            module="viper_orchestrator.station.utilities",
+            kwargs={
+                "inpath": inpath,
+                "outpath": browse_path(record.product_id, "thumb"),
+                "size": (240, 240),
+                "trace_stage": "thumbnail",
+            },
+            context="process",
+            description={"title": f"thumbnail {inpath.name}"},
+        )
+        return make_instruction("do", action=action)
+
+
+def jpeg_instruction(record: ImageRecord) -> pro.Action:
+    """
+    convert an ImageRecord for a newly-processed image into an Action
+    message specifying a full-res JPEG conversion task (intended for web
+    display).
+    """
+    inpath = tiff_path(record)
+    with traced("jpeg_instruction", product_id=inpath.stem):
+        action = make_function_call_action(
+            func="convert_16bit_tif",
+            module="viper_orchestrator.station.utilities",
+            kwargs={
+                "inpath": inpath,
+                "outpath": browse_path(record.product_id, "browse"),
+                "trace_stage": "browse",
+            },
+            context="process",
+            description={"title": f"make JPEG of {inpath.name}"},
+        )
+        return make_instruction("do", action=action)
+
+
+class InstructionFromCompletion(InstructionFromInfo):
+    """
+    like InstructionFromInfo, but makes Instructions from objects returned
+    in completion reports rather than info notes.
+    """
+
+    actortype = "completion"
 
 
 class ImageCheck(Actor):
@@ -133,11 +219,17 @@ class ImageCheck(Actor):
             self.owner.owner._log("parameter match failed", exception=ex)
 
     def execute(self, node: Node, pdict: dict, **_):
+        if isinstance(pdict, ParameterView):
+            # only decoded fields are sent along to the Station
+            pdict.require(*IMAGE_PARAMETER_KEYS)
+        trace_id = new_trace_id()
+        record_span("image_check", time.time(), trace_id=trace_id)
         node.add_actionable_event(
             {
                 "data": pdict,
                 "parameter": pdict["name"],
                 "event_type": "image_published",
+                "trace_id": trace_id,
             },
             self.owner,
         )
@@ -151,15 +243,23 @@ def get_light_state(
 ) -> dict[str, bool]:
     """
     make dict representing light state immediately prior to at_time (or just
-    the most recent light state if at_time is None).
-    If no LightRecord available for a luminaire, it is set to False (off).
+    the most recent light state if at_time is None), from the LightTransition
+    table if possible and from LightRecords otherwise. in the latter case,
+    if a luminaire has no LightRecord in the database, its latest archived
+    record is used (see db.partitions); if it has none at all, it is set to
+    False (off).
     """
-    lightstate, gentime = {}, None
-    for name in luminaire_names.keys():
-        selector = select(LightRecord).where(LightRecord.name == name)
+    if (lightstate := light_state_at(at_time)) is not None:
+        return lightstate
+    # no transitions recorded by at_time. only light_records partitions
+    # before at_time are scanned, newest first.
+    lightstate, gentime, missing = {}, None, []
+    for name, full_name in luminaire_names.items():
+        # LightRecords hold full luminaire names
+        selector = select(LightRecord).where(LightRecord.name == full_name)
         if at_time is not None:
             selector = selector.where(LightRecord.datetime < at_time)
-        selector = selector.order_by(LightRecord.datetime.desc())
+        selector = selector.order_by(LightRecord.datetime.desc()).limit(1)
         with OSession() as session:
             record = session.scalars(selector).first()
             if record is None:
@@ -169,9 +269,92 @@ def get_light_state(
                 if gentime is None or gentime < record.datetime:
                     gentime = record.datetime
         lightstate[name] = False if record is None else record.on
+        if record is None:
+            missing.append(name)
+    for name, (datetime, on) in archived_light_state(
+        at_time, missing
+    ).items():
+        lightstate[name] = on
+        if gentime is None or gentime < datetime:
+            gentime = datetime
     return lightstate | {'generation_time': gentime}
 
 
+def get_high_water_marks(
+    parameters: Collection[str],
+) -> dict[str, Optional[dt.datetime]]:
+    """
+    latest generation time already recorded in the database for each
+    parameter: from ImageRecords for image parameters and from LightRecords
+    for the light state parameter. None if nothing has been recorded.
+    """
+    marks = {}
+    with OSession() as session:
+        for param in parameters:
+            if param == LIGHT_STATE_PARAMETER:
+                selector = select(func.max(LightRecord.datetime))
+            else:
+                # noinspection PyTypeChecker
+                selector = select(
+                    func.max(ImageRecord.yamcs_generation_time)
+                ).where(ImageRecord.yamcs_name == param)
+            marks[param] = session.scalars(selector).first()
+    return marks
+
+
+def recorded_generation_times(
+    parameters: Collection[str], start: dt.datetime, stop: dt.datetime
+) -> set[tuple[str, dt.datetime]]:
+    """
+    (parameter name, generation time) pairs in [start, stop) that already
+    have ImageRecords or LightRecords.
+    """
+    image_params = [p for p in parameters if p != LIGHT_STATE_PARAMETER]
+    recorded = set()
+    with OSession() as session:
+        if len(image_params) > 0:
+            # noinspection PyTypeChecker
+            selector = select(
+                ImageRecord.yamcs_name, ImageRecord.yamcs_generation_time
+            ).where(
+                ImageRecord.yamcs_name.in_(image_params),
+                ImageRecord.yamcs_generation_time >= start,
+                ImageRecord.yamcs_generation_time < stop,
+            )
+            recorded.update(map(tuple, session.execute(selector).all()))
+        if LIGHT_STATE_PARAMETER in parameters:
+            # noinspection PyTypeChecker
+            selector = select(LightRecord.datetime).distinct().where(
+                LightRecord.datetime >= start, LightRecord.datetime < stop
+            )
+            recorded.update(
+                (LIGHT_STATE_PARAMETER, t)
+                for t in session.scalars(selector).all()
+            )
+    return recorded
+
+
+def fetch_archive_window(
+    archive: Any,
+    parameters: Collection[str],
+    start: dt.datetime,
+    stop: dt.datetime,
+    unpack: bool,
+) -> tuple[list[UnpackedParameter], set[tuple[str, dt.datetime]]]:
+    """
+    fetch all values of parameters in [start, stop) from a yamcs (or mock)
+    archive, sorted by generation time, along with the already-recorded
+    (parameter, generation time) pairs in that window.
+    """
+    values = archive.stream_parameter_values(
+        parameters, start=start, stop=stop
+    )
+    if unpack is True:
+        values = chain(*[unpack_parameters(v) for v in values])
+    values = sorted(values, key=lambda v: v["generation_time"])
+    return values, recorded_generation_times(parameters, start, stop)
+
+
 class LightStateProcessor(Actor):
     """
     actor that makes LightRecord objects from light state parameters.
@@ -180,27 +363,31 @@ class LightStateProcessor(Actor):
 
     def match(self, pdict: dict, **_) -> bool:
         validate_pdict(pdict)
-        if pdict["name"] != "/ViperRover/LightsControl/state":
+        if pdict["name"] != LIGHT_STATE_PARAMETER:
             raise NoMatch("not a light state parameter value")
         return True
 
+    @counted_queries
     def execute(self, node: Node, light_pv: dict, **_):
         if self.owner.lightmem is None:
             return
         gentime = light_pv["generation_time"].astimezone(dt.UTC)
-        # holding light state in memory is an optimization, but it is possible
-        # for parameter values to arrive out of order. to avoid race
-        # conditions, if we get an out-of-order value, reset our memory to the
-        # state immediately prior to the generation time of the value.
-        if self.owner.lightmem['generation_time'] is not None:
-            if gentime < self.owner.lightmem['generation_time']:
-                self.owner.lightmem = get_light_state(gentime)
-        state, changed = self.owner.lightmem.copy(), []
+        # LightSensor's reorder buffer releases values in generation time
+        # order, so our in-memory state is normally all we need. a value that
+        # arrives after the buffer has released later ones is compared with
+        # the state immediately prior to its generation time in the
+        # database instead, and leaves our in-memory (latest) state alone.
+        late = (
+            self.owner.lightmem['generation_time'] is not None
+            and gentime < self.owner.lightmem['generation_time']
+        )
+        previous = get_light_state(gentime) if late else self.owner.lightmem
+        state, changed = previous.copy(), []
         state['generation_time'] = gentime
         lights = light_pv["eng_value"]
         for light in luminaire_names.keys():
             on = {'OFF': False, 'ON': True}[lights[light]["measuredState"]]
-            if on != self.owner.lightmem[light]:
+            if on != previous[light]:
                 changed.append(light)
                 state[light] = on
         columns = ("generation_time",) + tuple(luminaire_names.keys())
@@ -218,6 +405,11 @@ class LightStateProcessor(Actor):
         # if we made records, queue them for transmission to the Station
         if len(recs) > 0:
             node.add_actionable_event(recs, "made_light_records")
+        if late:
+            return
+        # note that persisted light state and the light state parameter's
+        # high-water mark are advanced only by InsertIntoDatabase, along
+        # with the LightRecords for each transition
         self.owner.lightmem = state
 
     name = "light_state_processor"
@@ -252,8 +444,45 @@ class ImageProcessor(Actor):
     parameters, writes TIFF files and json labels, and then prepares an
     ImageRecord object for entry into the VIS db. essentially a managed wrapper
     for vipersci.vis.create_image.create().
+
+    the luminaire fields of each image's header are filled in from an
+    in-memory LightTimeline, loaded on first use and extended with newer
+    light state transitions when an image is newer than the timeline is
+    known to be complete -- at most once every timeline_refresh_interval
+    seconds, so it never costs a query per image. transitions rewritten
+    after they're loaded (by an out-of-order backfill) are not noticed until
+    the processor restarts.
     """
 
+    def __init__(self):
+        super().__init__()
+        self.timeline = LightTimeline()
+        # wall-clock time of the last timeline query, and monotonic time
+        # for rate-limiting
+        self._timeline_synced, self._last_refresh = None, None
+
+    def _refresh_timeline(self):
+        now = time.monotonic()
+        if (
+            self._last_refresh is not None
+            and now - self._last_refresh < self.timeline_refresh_interval
+        ):
+            return
+        self._last_refresh = now
+        synced = dt.datetime.now(dt.UTC)
+        self.timeline.extend(light_transitions(start=self.timeline.latest))
+        self._timeline_synced = synced
+
+    def light_header_values(self, start_time: dt.datetime) -> dict[str, bool]:
+        """luminaire header fields for an image with this start time."""
+        # transitions take a little while to reach the database, so the
+        # timeline is only known to be complete a bit before we queried it
+        if self._timeline_synced is None or start_time >= (
+            self._timeline_synced - dt.timedelta(seconds=self.light_lag)
+        ):
+            self._refresh_timeline()
+        return self.timeline.header_values(start_time)
+
     def match(self, instruction: Message, **_) -> bool:
         if instruction.action.name != "process_image":
             raise NoMatch("not an image processing instruction")
@@ -265,12 +494,24 @@ class ImageProcessor(Actor):
     def execute(
         self, node: Node, action: Message, key=None, noid=False, **_
     ) -> ImageRecord:
-        # localcall is a serialized mapping created from ParameterData.
-        # d is a mapping containing metadata including image header
-        # values; im is an ndarray containing the image data.
-        d, im = unpack_image_parameter_data(unpack_obj(action.localcall))
-        # this converts that to an in-memory ImageRecord object
-        return create_image.create(d, im, outdir=self.outdir)
+        trace_id = action.description.get("trace_id", "")
+        with traced("create_image", trace_id) as trace:
+            # localcall is a serialized mapping created from ParameterData.
+            # d is a mapping containing metadata including image header
+            # values; im is an ndarray containing the image data.
+            d, im = unpack_image_parameter_data(unpack_obj(action.localcall))
+            # products are sharded by product id (see
+            # viper_orchestrator.products), so work it out before writing
+            provisional = ImageRecord(**d)
+            pid = provisional.product_id
+            if provisional.start_time is not None:
+                d |= self.light_header_values(provisional.start_time)
+            outdir = self.outdir / product_shard(pid)
+            outdir.mkdir(parents=True, exist_ok=True)
+            # this converts that to an in-memory ImageRecord object
+            record = create_image.create(d, im, outdir=outdir)
+            trace["product_id"] = record.product_id
+        return record
 
     def _get_outdir(self) -> Path:
         return self._outdir
@@ -281,7 +522,12 @@ class ImageProcessor(Actor):
 
     _outdir = None
     outdir = property(_get_outdir, _set_outdir)
-    interface = ("outdir",)
+    # minimum number of seconds between light timeline queries
+    timeline_refresh_interval: float = 10
+    # maximum expected delay (s) between a light state change and its
+    # transition reaching the database
+    light_lag: float = 60
+    interface = ("outdir", "timeline_refresh_interval", "light_lag")
     actortype = "action"
     name = "image_processor"
 
@@ -453,8 +699,29 @@ class LightSensor(ParameterSensor):
 
     def __init__(self):
         super().__init__()
-        # initialize from most recent LightRecord per luminaire (if one exists)
-        self.lightmem = get_light_state()
+        # initialize from persisted light state if we have it; otherwise from
+        # most recent LightRecord per luminaire (if one exists)
+        self.lightmem = read_light_state()
+        if self.lightmem is None:
+            self.lightmem = get_light_state()
+        self.reorder = ReorderBuffer()
+
+    def checker(self, _, **__) -> tuple[None, deque]:
+        """
+        pass values through the reorder buffer, so that LightStateProcessor
+        sees them in generation time order.
+        """
+        _, results = super().checker(_)
+        passthrough = self.reorder.push(results)
+        released = self.reorder.release(
+            self.reorder_delay, self.reorder_capacity
+        )
+        return None, deque(released + passthrough)
+
+    @property
+    def late_values(self) -> int:
+        """values that arrived too late to be put in order"""
+        return self.reorder.late
 
     def get_logpath(self) -> Path:
         return self._logpath
@@ -468,20 +735,349 @@ class LightSensor(ParameterSensor):
 
     name = "light_watch"
     actions = (LightStateProcessor,)
-    interface = ParameterSensor.interface + ("logpath",)
+    # seconds (of generation time, or of waiting) to hold values for
+    # reordering, and maximum number of values to hold
+    reorder_delay: float = 2
+    reorder_capacity: int = 1000
+    interface = ParameterSensor.interface + (
+        "logpath",
+        "reorder_delay",
+        "reorder_capacity",
+        "late_values",
+    )
     logpath = property(get_logpath, set_logpath)
     _logpath = None
 
 
+class ArchiveSensor(Sensor):
+    """
+    constructs a yamcs client (optionally a mock one) and uses it to backfill
+    parameter values published while the orchestrator was not listening.
+
+    starting from each parameter's high-water mark, it streams the archive in
+    bounded time windows (several at once), skips values that already have
+    ImageRecords or LightRecords, and hands the rest to the same Actors the
+    realtime sensors use, throttled to a fixed number of values per second.
+
+    high-water marks and light state are read from the utility tables
+    InsertIntoDatabase persists along with each batch of records. it only
+    falls back to scanning ImageRecord and LightRecord for parameters with
+    no persisted mark. the light state parameter's mark is the time of the
+    last persisted transition, so after a long stretch without changes,
+    the backfill replays (without recording anything) the values since.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._parameters = []
+        self._client, self._archive, self._exec = None, None, None
+        # time windows not yet fetched, and in-flight fetches, in time order
+        self._windows, self._pending = deque(), deque()
+        # fetched (value, already recorded?) pairs not yet released
+        self._backlog = deque()
+        self._high_water = {}
+        self._allowance, self._last_release = 0, None
+        self._status = "uninitialized"
+        # light state immediately prior to the values we're replaying; used
+        # by LightStateProcessor exactly as it uses LightSensor.lightmem
+        self.lightmem = None
+
+    def checker(self, _, **__) -> tuple[None, deque]:
+        if self._status != "backfilling":
+            if self._start_backfill() is False:
+                return None, deque()
+        self._schedule()
+        self._collect()
+        results = self._release()
+        self._count += len(results)
+        if not any((self._windows, self._pending, self._backlog)):
+            self._exec.shutdown(wait=False)
+            self._exec, self._status = None, "caught up"
+        return None, results
+
+    def _start_backfill(self) -> bool:
+        """plan the backfill, if we are configured and haven't done it yet."""
+        if self._status == "caught up":
+            return False
+        if self._archive is None:
+            self._init_client()
+            if self._archive is None:
+                return False
+        if len(self._parameters) == 0:
+            self._status = "need parameters"
+            return False
+        marks = read_high_water_marks()
+        missing = [p for p in self._parameters if p not in marks]
+        if len(missing) > 0:
+            marks |= get_high_water_marks(missing)
+        marks = {p: marks.get(p) for p in self._parameters}
+        # image marks advance when an image is inserted, which can lag
+        # values that were in flight when we went down; look back a little.
+        # values we already recorded are skipped anyway.
+        lookback = dt.timedelta(seconds=self.lookback)
+        for p, t in marks.items():
+            if p != LIGHT_STATE_PARAMETER and t is not None:
+                marks[p] = t - lookback
+        marks |= self.start_times
+        # refuse to query from the beginning of time
+        self._high_water = {p: t for p, t in marks.items() if t is not None}
+        if len(self._high_water) == 0:
+            self._status = "caught up"
+            return False
+        start = min(self._high_water.values())
+        stop = self.stop if self.stop is not None else utcnow()
+        window = dt.timedelta(seconds=self.window)
+        while start < stop:
+            self._windows.append((start, min(start + window, stop)))
+            start += window
+        if LIGHT_STATE_PARAMETER in self._high_water:
+            light_mark = self._high_water[LIGHT_STATE_PARAMETER]
+            self.lightmem = read_light_state()
+            if (
+                self.lightmem is None
+                or self.lightmem["generation_time"] != light_mark
+            ):
+                self.lightmem = get_light_state(
+                    light_mark + dt.timedelta(microseconds=1)
+                )
+        self._exec = ThreadPoolExecutor(self.fetch_threads)
+        self._status = "backfilling"
+        return True
+
+    def _schedule(self):
+        """keep up to fetch_threads window fetches in flight."""
+        while (
+            len(self._windows) > 0
+            and len(self._pending) < self.fetch_threads
+            # don't race too far ahead of the throttle
+            and len(self._backlog) < self.max_backlog
+        ):
+            start, stop = self._windows.popleft()
+            self._pending.append((start, stop, self._submit(start, stop)))
+
+    def _submit(self, start: dt.datetime, stop: dt.datetime) -> Future:
+        return self._exec.submit(
+            fetch_archive_window,
+            self._archive,
+            tuple(self._high_water.keys()),
+            start,
+            stop,
+            not self._mock,
+        )
+
+    def _collect(self):
+        """move finished fetches into the backlog, preserving time order."""
+        while len(self._pending) > 0 and self._pending[0][2].done():
+            start, stop, future = self._pending[0]
+            try:
+                values, recorded = future.result()
+            except Exception as ex:
+                self._log("archive fetch failed", exception=ex)
+                # retry in place. later windows wait behind this one, so
+                # releasing their values can't move marks past its values.
+                self._pending[0] = (start, stop, self._submit(start, stop))
+                return
+            self._pending.popleft()
+            for value in values:
+                gentime = value["generation_time"].astimezone(dt.UTC)
+                mark = self._high_water.get(value["name"])
+                if mark is None or gentime <= mark:
+                    continue
+                self._backlog.append(
+                    (value, (value["name"], gentime) in recorded)
+                )
+
+    def _release(self) -> deque:
+        """release as many backlogged values as the throttle permits."""
+        now = time.monotonic()
+        if self._last_release is None:
+            self._allowance = self.rate
+        else:
+            self._allowance = min(
+                self.rate,
+                self._allowance + (now - self._last_release) * self.rate,
+            )
+        self._last_release = now
+        results = deque()
+        while len(self._backlog) > 0 and self._allowance >= 1:
+            value, recorded = self._backlog.popleft()
+            gentime = value["generation_time"].astimezone(dt.UTC)
+            self._high_water[value["name"]] = gentime
+            if recorded is True:
+                # don't duplicate records, but keep our idea of the light
+                # state consistent with the values we've seen
+                if value["name"] == LIGHT_STATE_PARAMETER:
+                    self._absorb_light_state(value, gentime)
+                self._skipped += 1
+                continue
+            results.append(value)
+            self._allowance -= 1
+        return results
+
+    def _absorb_light_state(self, light_pv: dict, gentime: dt.datetime):
+        if self.lightmem is None:
+            return
+        lights = light_pv["eng_value"]
+        for light in luminaire_names.keys():
+            self.lightmem[light] = {"OFF": False, "ON": True}[
+                lights[light]["measuredState"]
+            ]
+        self.lightmem["generation_time"] = gentime
+
+    def _init_client(self):
+        """try to (re)initialize the client."""
+        if self._mock is True:
+            if self._mock_server is None:
+                self._status = "need mock server"
+                return
+            self._client = MockYamcsClient(server=self._mock_server)
+        elif self.url is None:
+            self._status = "need server url"
+            return
+        else:
+            self._client = YamcsClient(self.url)
+        self._archive = self._client.get_archive(self.instance)
+        self._status = "ready"
+
+    def _reset(self):
+        self._archive = None
+        if self._status != "backfilling":
+            return
+        # configuration changed mid-backfill; start over from where we got
+        for _, _, future in self._pending:
+            future.cancel()
+        self._exec.shutdown(wait=False)
+        self.start_times = self.start_times | self._high_water
+        self._windows, self._pending, self._backlog = deque(), deque(), deque()
+        self._exec, self._status = None, "uninitialized"
+
+    def _set_parameters(self, parameters: Collection[str]):
+        self._parameters = list(parameters)
+
+    def _get_parameters(self) -> list[str]:
+        return self._parameters
+
+    def _set_mock(self, is_mock: bool):
+        if not isinstance(is_mock, bool):
+            raise DoNotUnderstand("mock must be True or False")
+        if is_mock == self._mock:
+            return
+        self._mock = is_mock
+        self._reset()
+
+    def _get_mock(self) -> bool:
+        return self._mock
+
+    def _get_mock_server(self) -> Optional[MockServer]:
+        if self._mock is False:
+            raise ValueError("this property may only be used in mock mode")
+        return self._mock_server
+
+    def _set_mock_server(self, server: MockServer):
+        if self._mock is False:
+            raise ValueError("this property may only be used in mock mode")
+        self._mock_server = server
+        self._reset()
+
+    def _get_url(self) -> Optional[str]:
+        return self._url
+
+    def _set_url(self, url: str):
+        if self._url == url:
+            return
+        self._url = url
+        if self._mock is False:
+            self._reset()
+
+    @property
+    def archive(self) -> Optional[MockArchive]:
+        """the (possibly mock) yamcs ArchiveClient in use"""
+        return self._archive
+
+    @property
+    def status(self) -> str:
+        """part of the interface, but cannot be assigned."""
+        return self._status
+
+    @property
+    def high_water(self) -> dict[str, dt.datetime]:
+        """
+        generation time of the latest value released (or skipped as already
+        recorded) for each parameter. cannot be assigned.
+        """
+        return self._high_water.copy()
+
+    @property
+    def count(self) -> int:
+        """number of values handed to Actors. cannot be assigned."""
+        return self._count
+
+    @property
+    def skipped(self) -> int:
+        """number of already-recorded values skipped. cannot be assigned."""
+        return self._skipped
+
+    name = "archive_watch"
+    actions = (ImageCheck, LightStateProcessor)
+    parameters = property(_get_parameters, _set_parameters)
+    mock = property(_get_mock, _set_mock)
+    _mock = False
+    # like ParameterSensor.mock_context, only intended for direct assignment
+    # within a process under test, so not part of the interface
+    mock_server = property(_get_mock_server, _set_mock_server)
+    _mock_server = None
+    url = property(_get_url, _set_url)
+    _url = None
+    instance = "viper"
+    # explicit per-parameter start times, overriding recorded high-water marks
+    start_times: dict[str, dt.datetime] = {}
+    # end of the backfill; None means the moment the backfill starts
+    stop: Optional[dt.datetime] = None
+    # seconds to back image parameter marks up by before querying
+    lookback: float = 60
+    # length of each archive query window, in seconds
+    window: float = 300
+    # number of archive windows to fetch concurrently
+    fetch_threads: int = 4
+    # maximum number of values per second to hand to Actors
+    rate: float = 20
+    # stop scheduling fetches while this many values are waiting for release
+    max_backlog: int = 256
+    # LightStateProcessor checks for this; we don't keep a light state log
+    logpath = None
+    _count = 0
+    _skipped = 0
+    interface = (
+        "count",
+        "fetch_threads",
+        "high_water",
+        "instance",
+        "lookback",
+        "max_backlog",
+        "mock",
+        "parameters",
+        "rate",
+        "skipped",
+        "start_times",
+        "status",
+        "stop",
+        "url",
+        "window",
+    )
+
+
 class InsertIntoDatabase(Actor):
     """
     take SQLAlchemy DeclarativeBase objects from a report and insert them
-    into a database.
+    into a database. rows of tables with natural keys (ImageRecord,
+    LightRecord) that are already in the database are skipped rather than
+    failing the batch.
     """
 
     def __init__(self):
         super().__init__()
         self._counts = defaultdict(int)
+        self._skipped = defaultdict(int)
 
     def match(self, event: Any, **_) -> bool:
         event = listify(event)
@@ -490,21 +1086,86 @@ class InsertIntoDatabase(Actor):
         # TODO, maybe: explicitly check against schema, check closed session
         return True
 
+    @counted_queries
     def execute(self, node, event: Collection[DeclarativeBase], **_):
         event = listify(event)
+        marks, lightstates = {}, defaultdict(dict)
+        for row in event:
+            if isinstance(row, ImageRecord):
+                if None in (row.yamcs_name, row.yamcs_generation_time):
+                    continue
+                param, gentime = row.yamcs_name, row.yamcs_generation_time
+            elif isinstance(row, LightRecord):
+                param, gentime = LIGHT_STATE_PARAMETER, row.datetime
+                lightstates[gentime][row.name] = row.on
+            else:
+                continue
+            if param not in marks or marks[param] < gentime:
+                marks[param] = gentime
+        pids = [r.product_id for r in event if isinstance(r, ImageRecord)]
+        start = time.time()
+        try:
+            tallies = self._write(event, marks, lightstates)
+        except IntegrityError as ie:
+            if "no partition of relation" not in str(ie):
+                raise
+            # another process archived a partition we had cached as existing
+            forget_light_partitions()
+            tallies = self._write(event, marks, lightstates)
+        end = time.time()
+        for pid in pids:
+            record_span("insert", start, end, product_id=pid)
+        # do this afterwards because we only want to count successful inserts
+        for row in event:
+            if type(row) not in NATURAL_KEYS:
+                self._counts[row.__class__.__name__] += 1
+        for name, (inserted, skipped) in tallies.items():
+            self._counts[name] += inserted
+            self._skipped[name] += skipped
+
+    @staticmethod
+    def _write(
+        event: Collection[DeclarativeBase],
+        marks: dict[str, dt.datetime],
+        lightstates: dict[dt.datetime, dict[str, bool]],
+    ) -> dict[str, tuple[int, int]]:
+        """
+        insert event's rows, and persist the orchestrator state they imply,
+        in one transaction. returns (inserted, skipped) counts of rows of
+        tables with natural keys, by table name.
+        """
+        keyed, tallies = defaultdict(list), {}
         with OSession() as session:
+            ensure_light_partitions(
+                [r.datetime for r in event if isinstance(r, LightRecord)],
+                session.connection(),
+            )
             for row in event:
-                session.add(row)
+                if type(row) in NATURAL_KEYS:
+                    keyed[type(row)].append(row)
+                else:
+                    session.add(row)
+            for table, rows in keyed.items():
+                tallies[table.__name__] = insert_new_rows(rows, session)
+            # persist orchestrator state in the same transaction, so that a
+            # restart never skips or double-counts these records
+            advance_high_water_marks(marks, session)
+            for gentime, states in lightstates.items():
+                write_light_state(states, gentime, session)
+            write_light_transitions(lightstates, session)
             session.commit()
-        # do this afterwards because we only want to count successful inserts
-        for row in event:
-            self._counts[row.__class__.__name__] += 1
+        return tallies
 
     @property
     def counts(self):
         return dict(self._counts)
 
-    interface = ("counts",)
+    @property
+    def skipped(self):
+        """rows not inserted because they were already in the database"""
+        return dict(self._skipped)
+
+    interface = ("counts", "skipped")
     actortype = ("completion", "info")
     name = "database"
 
@@ -535,129 +1196,3 @@ class CreationRecord(OrchestratorBase):
         nullable=True,
         doc="reference to image stats created by this instruction",
     )
-
-
-# class ArchiveSensor(Sensor):
-#     """
-#     construct an (optionally mock) yamcs client and use it to
-#     query a yamcs archive periodically.
-#     """
-#
-#     def __init__(self):
-#         raise NotImplementedError("unfinished, do not use")
-#         super().__init__()
-#         self._client, self._archive = None, None
-#         self._parameter_history = {}
-#         self.last_time = None
-#
-#     def _yamcs_setup(self, reset=False):
-#         if (self._archive is not None) and (reset is False):
-#             return
-#         if (self._mock is True) and (self.server is None):
-#             raise ValueError(
-#                 "mock_server must be set to use this sensor in mock mode"
-#             )
-#         elif self.mock is True:
-#             self._client = MockYamcsClient(server=self.server)
-#             self._archive = self._client.get_archive(self.instance)
-#         else:
-#             raise NotImplementedError("have to pass the url etc")
-#
-#     def checker(self, _):
-#         # TODO, maybe: this convoluted time tracking thing may not be totally
-#         #  necessary, pending clarification
-#         self._yamcs_setup()
-#         results = []
-#         # TODO, maybe: only really need to check this on init, and _could_
-#         #  just start from right now, but...
-#         if not set(self.parameters).issubset(
-#             self.parameter_history.keys()
-#         ):
-#             raise ValueError(
-#                 "Incomplete parameter history, refusing to query from "
-#                 "beginning of time"
-#             )
-#         if (self.offset.seconds != 0) and (self.mock is False):
-#             raise ValueError(
-#                 "Time offset may not be set unless running in mock mode"
-#             )
-#         for parameter in self.parameters:
-#             new_values = self._archive.list_parameter_values(
-#                 parameter,
-#                 start=self.parameter_history[parameter]
-#             )
-#             results += new_values
-#             if len(new_values) > 0:
-#                 self.last_time[parameter] = max(
-#                     v['generation_time'] for v in new_values
-#                 )
-#         return None,
-#
-#     def _set_parameters(self, parameters: Collection[str]):
-#         self._parameters = list(parameters)
-#         self._processor = self._client.get_processor(*self._processor_path)
-#         # TODO, maybe: something to remove / reset parameter subscriptions
-#         self._subscription = self._processor.create_parameter_subscription(
-#             self._parameters, self._push
-#         )
-#
-#     def _get_parameters(self) -> list[str]:
-#         return self._parameters
-#
-#     def _set_mock(self, is_mock: bool):
-#         if not isinstance(is_mock, bool):
-#             raise DoNotUnderstand("mock must be True or False")
-#         if is_mock == self._mock:
-#             return
-#         self._mock = is_mock
-#         # if already initialized, reinitialize with specified mockness
-#         if self._archive is not None:
-#             self._yamcs_setup(True)
-#
-#     def _get_mock(self) -> bool:
-#         return self._mock
-#
-#     def _get_mock_server(self) -> Optional[MockServer]:
-#         return self._mock_server
-#
-#     def _set_mock_server(self, server: MockServer):
-#         already_had_server = self._mock_server is not None
-#         self._mock_server = server
-#         if already_had_server:
-#             self._yamcs_setup(True)  # otherwise just do it lazily
-#
-#     def _get_poll(self):
-#         return self._poll
-#
-#     def _set_poll(self, poll: float):
-#         self._poll = poll
-#
-#     def _get_parameter_history(self):
-#         return self._parameter_history
-#
-#     def _set_parameter_history(self, history: Mapping):
-#         self._parameter_history = self._parameter_history | history
-#
-#     def _set_offset(self, offset: dt.timedelta):
-#         self._offset = offset
-#
-#     def _get_offset(self) -> dt.timedelta:
-#         return self._offset
-#
-#     name = "parameter_watch"
-#     parameters = property(_get_parameters, _set_parameters)
-#     parameter_history = property(
-#         _get_parameter_history, _set_parameter_history
-#     )
-#     actions = (ImageCheck, DBCheck)
-#     mock = property(_get_mock, _set_mock)
-#     _mock = False
-#     _yamcs_url = None
-#     poll = property(_get_poll, _set_poll)
-#     _poll = 5
-#     mock_server = property(_get_mock_server, _set_mock_server)
-#     _mock_server = None
-#     offset = property(_get_offset, _set_offset)
-#     _offset = dt.timedelta(seconds=0)
-#     instance = "viper"
-#     interface = ("parameters", "mock", "offset", "mock_server")
@@ -1,5 +1,4 @@
 """high-level definition of the orchestrator application."""
-from pathlib import Path
 import random
 from typing import Literal
 
@@ -11,8 +10,11 @@ from viper_orchestrator.config import (
     LIGHTSTATE_LOG_FILE,
     STATION_LOG_ROOT,
 )
+from viper_orchestrator.db.partitions import archive_old_light_partitions
 from viper_orchestrator.station.components import (
     InsertIntoDatabase,
+    InstructionFromCompletion,
+    has_tiff,
     process_image_instruction,
     thumbnail_instruction,
     jpeg_instruction,
@@ -21,6 +23,8 @@ from viper_orchestrator.station.components import (
 
 def create_station():
     """creates the station"""
+    # light_records partitions past LIGHT_RETENTION_MONTHS go to parquet
+    archive_old_light_partitions()
     host, port = "localhost", random.randint(10000, 20000)
     station = Station(host, port, n_threads=12, logdir=STATION_LOG_ROOT)
     # Actor that creates instructions to make image products when it receives
@@ -35,20 +39,12 @@ def create_station():
     # objects sent by Delegates in completion or info Messages
     station.add_element(InsertIntoDatabase)
     # add Actors that create instructions to make thumbnails and full-res
-    # JPEGs when we hear about a new TIFF file
-    station.add_element(InstructionFromInfo, name="thumbnail")
-    station.add_element(InstructionFromInfo, name="browse")
+    # JPEGs when the image processor reports that it has written a TIFF file
+    station.add_element(InstructionFromCompletion, name="thumbnail")
+    station.add_element(InstructionFromCompletion, name="browse")
     station.browse_instruction_maker = jpeg_instruction
     station.thumbnail_instruction_maker = thumbnail_instruction
-    browse_attrs = {
-        "criteria": [
-            lambda n: (
-                Path(n["content"]).is_file()
-                and Path(n["content"]).name.endswith("tif")
-            )
-        ],
-        "target_name": "browsemaker",
-    }
+    browse_attrs = {"criteria": [has_tiff], "target_name": "browsemaker"}
     for proc in ("browse", "thumbnail"):
         for attr, val in browse_attrs.items():
             setattr(station, f"{proc}_{attr}", val)
@@ -63,6 +59,7 @@ def launch_delegates(
     update_interval: float = 0.5,
     context: Literal["local", "subprocess", "daemon"] = "daemon",
     n_threads: int = 4,
+    backfill: bool = True,
 ) -> None:
     """defines, launches, and queues config instructions for delegates"""
     delkwargs = {
@@ -70,16 +67,6 @@ def launch_delegates(
         "context": context,
         "n_threads": n_threads,
     }
-    thumbnail_watch_launch_spec = {
-        # sensor that watches a directory on the filesystem
-        "elements": [("hostess.station.actors", "DirWatch")],
-    }
-    thumbnail_watch_config_spec = {
-        # what directory shall we watch?
-        "dirwatch_target": DATA_ROOT,
-        # what filename patterns are we watching for?
-        "dirwatch_patterns": (r".*\.tif",),
-    }
     # browse making is handled by a generic Actor that calls plain
     # functions; the details are specified in Instructions from the Station
     browse_launch_spec = {
@@ -119,11 +106,18 @@ def launch_delegates(
         elements=(("viper_orchestrator.station.components", "LightSensor"),),
         **subscriber_kwargs,
     )
-    # tiff-write-watching delegate. this watches the filesystem for writes
-    # performed in the create_image.create() workflow, not yamcs.
-    station.launch_delegate(
-        "thumbnail_watcher", **thumbnail_watch_launch_spec, **delkwargs
-    )
+    # archive-backfilling delegate. on startup, this replays parameter values
+    # published since the last ones we recorded (i.e., while the orchestrator
+    # was down) through the same Actors the parameter-watching delegates use.
+    # like them, it must be local to reach a MockServer in mock mode.
+    if backfill is True:
+        station.launch_delegate(
+            "archive_watcher",
+            elements=(
+                ("viper_orchestrator.station.components", "ArchiveSensor"),
+            ),
+            **subscriber_kwargs,
+        )
     # thumbnail-making delegate
     station.launch_delegate("browsemaker", **browse_launch_spec, **delkwargs)
     # delegate configuration
@@ -144,13 +138,17 @@ def launch_delegates(
         # analogous to the json labels produced in create_image.create()
         light_watch_logpath=LIGHTSTATE_LOG_FILE,
     )
+    if backfill is True:
+        station.set_delegate_properties(
+            "archive_watcher",
+            archive_watch_mock=mock,
+            archive_watch_parameters=list(PARAMETERS),
+            archive_watch_instance=processor_path[0],
+            archive_watch_url=yamcs_url,
+        )
     station.set_delegate_properties(
         "image_processor", image_processor_outdir=DATA_ROOT
     )
-    #
-    station.set_delegate_properties(
-        "thumbnail_watcher", **thumbnail_watch_config_spec
-    )
     # note that there are no special properties to set for the thumbnail maker.
     # it uses a generic FuncCaller Actor and gets all the details from
     # Instructions.
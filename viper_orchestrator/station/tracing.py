@@ -0,0 +1,145 @@
+"""
+lightweight per-product latency tracing for the image pipeline. each stage
+appends a span (trace id, product id, stage, start, end) to a shared
+append-only csv log at TRACE_LOG_FILE. run this module to summarize the log:
+
+python -m viper_orchestrator.station.tracing [--logpath=...] [--since=...]
+
+ImageCheck assigns a trace id when it sees a new image, and the stages up to
+create_image pass it along in their messages. stages downstream of the TIFF
+write only know the product id. the create_image span carries both, which is
+how the summarizer joins the two halves of a trace.
+"""
+from contextlib import contextmanager
+import datetime as dt
+from pathlib import Path
+import time
+from typing import Optional, Union
+from uuid import uuid4
+import warnings
+
+import fire
+import pandas as pd
+
+from viper_orchestrator.config import TRACE_LOG_FILE, TRACING
+
+TRACE_COLUMNS = ("trace_id", "product_id", "stage", "start", "end")
+# stages in pipeline order
+STAGES = (
+    "image_check",
+    "process_image_instruction",
+    "create_image",
+    "tiff_detected",
+    "thumbnail_instruction",
+    "jpeg_instruction",
+    "thumbnail",
+    "browse",
+    "insert",
+)
+
+
+def new_trace_id() -> str:
+    return uuid4().hex[:16]
+
+
+def record_span(
+    stage: str,
+    start: float,
+    end: Optional[float] = None,
+    trace_id: str = "",
+    product_id: str = "",
+    logpath: Optional[Path] = None,
+):
+    """
+    append a span to the trace log. start and end are unix timestamps; omit
+    end for point events. tracing is best-effort: failures to write the log
+    produce a warning rather than interrupting the traced stage.
+    """
+    if TRACING is False:
+        return
+    end = start if end is None else end
+    logpath = TRACE_LOG_FILE if logpath is None else logpath
+    # a single short write to a file opened in append mode is atomic on
+    # POSIX, so delegates in different processes can share the log unlocked
+    try:
+        with open(logpath, "a") as stream:
+            stream.write(
+                f"{trace_id},{product_id},{stage},{start:.6f},{end:.6f}\n"
+            )
+    except OSError as ose:
+        warnings.warn(f"couldn't write {stage} span to {logpath}: {ose}")
+
+
+@contextmanager
+def traced(stage: str, trace_id: str = "", product_id: str = ""):
+    """
+    record a span covering the body of a with block. yields a dict whose
+    trace_id and product_id entries may be filled in within the block. spans
+    are not recorded if the block raises an exception.
+    """
+    keys, start = {"trace_id": trace_id, "product_id": product_id}, time.time()
+    yield keys
+    record_span(stage, start, time.time(), **keys)
+
+
+def load_spans(logpath: Optional[Union[str, Path]] = None) -> pd.DataFrame:
+    logpath = TRACE_LOG_FILE if logpath is None else logpath
+    spans = pd.read_csv(
+        logpath,
+        names=TRACE_COLUMNS,
+        dtype={"trace_id": str, "product_id": str, "stage": str},
+    )
+    return spans.fillna({"trace_id": "", "product_id": ""})
+
+
+def summarize_spans(spans: pd.DataFrame) -> pd.DataFrame:
+    """
+    latency percentiles for each stage: 'duration' is the length of the span
+    itself; 'elapsed' is the time from the start of the trace to the end of
+    the span.
+    """
+    spans = spans.copy()
+    # attach product-only spans to the traces their products belong to
+    both = spans.loc[(spans["trace_id"] != "") & (spans["product_id"] != "")]
+    traces = both.drop_duplicates("product_id").set_index("product_id")
+    orphans = spans["trace_id"] == ""
+    spans.loc[orphans, "trace_id"] = (
+        spans.loc[orphans, "product_id"].map(traces["trace_id"]).fillna("")
+    )
+    spans = spans.loc[spans["trace_id"] != ""].copy()
+    origins = spans.groupby("trace_id")["start"].min()
+    spans["duration"] = spans["end"] - spans["start"]
+    spans["elapsed"] = spans["end"] - spans["trace_id"].map(origins)
+    rows = []
+    for stage, group in spans.groupby("stage"):
+        row = {"stage": stage, "n": len(group)}
+        for metric in ("duration", "elapsed"):
+            quantiles = group[metric].quantile((0.5, 0.95, 0.99))
+            for q, value in zip(("p50", "p95", "p99"), quantiles):
+                row[f"{metric}_{q}"] = value
+        rows.append(row)
+    summary = pd.DataFrame(rows).set_index("stage")
+    order = [s for s in STAGES if s in summary.index]
+    return summary.loc[order + [s for s in summary.index if s not in STAGES]]
+
+
+def summarize_trace_log(
+    logpath: Optional[str] = None, since: Optional[str] = None
+) -> str:
+    """
+    summarize stage latencies (in seconds) from a trace log, optionally only
+    for traces recorded after `since` (an ISO 8601 datetime).
+    """
+    spans = load_spans(logpath)
+    if since is not None:
+        cutoff = dt.datetime.fromisoformat(since)
+        if cutoff.tzinfo is None:
+            cutoff = cutoff.replace(tzinfo=dt.UTC)
+        spans = spans.loc[spans["start"] >= cutoff.timestamp()]
+    if len(spans) == 0:
+        return "no spans recorded"
+    return summarize_spans(spans).to_string(float_format="{:.4f}".format)
+
+
+if __name__ == "__main__":
+    fire.Fire(summarize_trace_log)
@@ -1,10 +1,14 @@
 """utilities for the orchestrator application."""
+from bisect import bisect_left, bisect_right
 import datetime as dt
 import re
 from collections import deque
+from heapq import heappop, heappush
 from io import BytesIO
+from itertools import count
+import time
 from pathlib import Path
-from typing import Mapping, MutableSequence, Any, Optional
+from typing import Iterable, Mapping, MutableSequence, Any, Optional
 
 import dateutil.parser
 import numpy as np
@@ -14,32 +18,112 @@ from imageio.v3 import imread
 
 from vipersci.pds.datetime import isozformat
 from vipersci.vis.db.image_records import ImageRecord
+from vipersci.vis.db.light_records import luminaire_names
 from yamcs.tmtc.model import ParameterValue, ParameterData
 
 from hostess.station.bases import NoMatch
+from viper_orchestrator.db.utility_tables import LUMINAIRE_BITS
+from viper_orchestrator.station.tracing import traced
 from hostess.utilities import curry
 
 IMAGERECORD_COLUMNS = frozenset(c.name for c in ImageRecord.__table__.columns)
 UnpackedParameter = Mapping[str, Any]
 
 
+PARAMETER_KEYS = (
+    'eng_value',
+    'generation_time',
+    'monitoring_result',
+    'name',
+    'processing_status',
+    'range_condition',
+    'raw_value',
+    'reception_time',
+    'validity_duration',
+    'validity_status',
+)
+# fields of image parameters that ImageProcessor needs
+IMAGE_PARAMETER_KEYS = ('eng_value', 'generation_time', 'name')
+_SLOTS = {key: f"_{key}" for key in PARAMETER_KEYS}
+
+
+class ParameterView(Mapping):
+    """
+    read-only mapping view of a yamcs ParameterValue with the keys in
+    PARAMETER_KEYS. fields are decoded from the underlying protobuf message
+    on first access and cached; most consumers (e.g. LightStateProcessor)
+    only ever look at a few of them.
+
+    pickling a view (e.g., to send it across a delegate boundary) keeps only
+    the fields decoded so far. use require() to decode any others that the
+    recipient will need first.
+    """
+
+    __slots__ = ("_value", *_SLOTS.values())
+
+    def __init__(self, value: Optional[ParameterValue]):
+        self._value = value
+
+    def __getitem__(self, key: str) -> Any:
+        if (slot := _SLOTS.get(key)) is None:
+            raise KeyError(key)
+        try:
+            return getattr(self, slot)
+        except AttributeError:
+            if self._value is None:
+                # unpickled, and this field wasn't decoded before pickling
+                raise KeyError(key)
+        field = getattr(self._value, key)
+        setattr(self, slot, field)
+        return field
+
+    def _has(self, key: str) -> bool:
+        return key in _SLOTS and (
+            self._value is not None or hasattr(self, _SLOTS[key])
+        )
+
+    def __contains__(self, key: Any) -> bool:
+        # check without decoding
+        return self._has(key)
+
+    def __iter__(self):
+        return (key for key in PARAMETER_KEYS if self._has(key))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def require(self, *keys: str) -> "ParameterView":
+        """decode keys now (so that they will survive pickling)."""
+        for key in keys:
+            self[key]
+        return self
+
+    @property
+    def decoded(self) -> dict[str, Any]:
+        """the fields decoded so far."""
+        return {
+            key: getattr(self, slot)
+            for key, slot in _SLOTS.items()
+            if hasattr(self, slot)
+        }
+
+    @classmethod
+    def from_fields(cls, fields: Mapping[str, Any]) -> "ParameterView":
+        view = cls(None)
+        for key, field in fields.items():
+            setattr(view, _SLOTS[key], field)
+        return view
+
+    def __reduce__(self):
+        return ParameterView.from_fields, (self.decoded,)
+
+    def __repr__(self):
+        return f"ParameterView({self.decoded})"
+
+
 def unpack_parameter_value(value: ParameterValue) -> UnpackedParameter:
-    """unpack a yamcs ParameterValue object into a dictionary for easy use."""
-    rec = {}
-    for key in (
-        'eng_value',
-        'generation_time',
-        'monitoring_result',
-        'name',
-        'processing_status',
-        'range_condition',
-        'raw_value',
-        'reception_time',
-        'validity_duration',
-        'validity_status'
-    ):
-        rec[key] = getattr(value, key)
-    return rec
+    """wrap a yamcs ParameterValue object in a mapping for easy use."""
+    return ParameterView(value)
 
 
 def unpack_parameters(messages: ParameterData) -> list[UnpackedParameter]:
@@ -53,18 +137,24 @@ def unpack_parameters(messages: ParameterData) -> list[UnpackedParameter]:
 def convert_16bit_tif(
     inpath: Path,
     outpath: Path,
-    size: Optional[tuple[int, int]] = None
+    size: Optional[tuple[int, int]] = None,
+    trace_stage: Optional[str] = None,
 ):
     """
     open a 16-bit tiff file, make a thumbnail from it, write it back to disk.
-    optionally also thumbnail it.
+    optionally also thumbnail it. if trace_stage is given, record a trace
+    span under that stage name.
     """
+    if trace_stage is not None:
+        with traced(trace_stage, product_id=Path(inpath).stem):
+            return convert_16bit_tif(inpath, outpath, size)
     # noinspection PyTypeChecker
     im = np.asarray(Image.open(inpath))
     # PIL's built-in conversion for 16-bit integer images does bad things
     im = Image.fromarray(np.floor(im / 65531 * 255).astype(np.uint8))
     if size is not None:
         im.thumbnail(size)
+    Path(outpath).parent.mkdir(parents=True, exist_ok=True)
     im.save(outpath)
 
 
@@ -85,6 +175,74 @@ def push(cache: MutableSequence, obj: Any):
     cache.append(obj)
 
 
+class ReorderBuffer:
+    """
+    holds unpacked parameter values briefly so they can be released in
+    generation time order. a value is released once a value generated
+    `delay` seconds after it has arrived (the watermark has passed it), once
+    it has been held for `delay` seconds, or once the buffer holds more than
+    `capacity` values, whichever comes first.
+
+    values generated before the latest value already released (i.e., that
+    arrived after the watermark) are released immediately; `late` counts
+    them. values without a generation time pass straight through.
+    """
+
+    def __init__(self):
+        # (generation time, arrival order, arrival monotonic time, value)
+        self._heap = []
+        self._arrivals = count()
+        self.newest: Optional[dt.datetime] = None
+        self.released_through: Optional[dt.datetime] = None
+        self.late = 0
+
+    def push(
+        self, values: Iterable[UnpackedParameter]
+    ) -> list[UnpackedParameter]:
+        """add values, returning any that should pass straight through."""
+        now, passthrough = time.monotonic(), []
+        for value in values:
+            if (gentime := value.get("generation_time")) is None:
+                passthrough.append(value)
+                continue
+            gentime = gentime.astimezone(dt.UTC)
+            if (
+                self.released_through is not None
+                and gentime < self.released_through
+            ):
+                self.late += 1
+                passthrough.append(value)
+                continue
+            if self.newest is None or gentime > self.newest:
+                self.newest = gentime
+            heappush(self._heap, (gentime, next(self._arrivals), now, value))
+        return passthrough
+
+    def release(
+        self, delay: float, capacity: int
+    ) -> list[UnpackedParameter]:
+        """pop values that are due, in generation time order."""
+        now, released = time.monotonic(), []
+        if len(self._heap) == 0:
+            return released
+        watermark = self.newest - dt.timedelta(seconds=delay)
+        while len(self._heap) > 0:
+            gentime, _, arrived, value = self._heap[0]
+            if (
+                gentime > watermark
+                and now - arrived < delay
+                and len(self._heap) <= capacity
+            ):
+                break
+            heappop(self._heap)
+            self.released_through = gentime
+            released.append(value)
+        return released
+
+    def __len__(self):
+        return len(self._heap)
+
+
 def validate_pdict(pdict: UnpackedParameter):
     """
     checks that pdict appears to be an unpacked yamcs ParameterData object;
@@ -97,7 +255,9 @@ def validate_pdict(pdict: UnpackedParameter):
 
 
 def temp_hardcoded_header_values():
-    # These are hard-coded until we figure out where they come from.
+    # These are hard-coded until we figure out where they come from. the
+    # luminaire fields are defaults; ImageProcessor fills them in from its
+    # LightTimeline.
     return {
         "bad_pixel_table_id": 0,
         "hazlight_aft_port_on": False,
@@ -113,6 +273,55 @@ def temp_hardcoded_header_values():
     }
 
 
+# image header field for each luminaire, e.g. 'navlight_left_on'
+LIGHT_HEADER_FIELDS = {
+    key: f"{name.lower().replace(' ', '_')}_on"
+    for key, name in luminaire_names.items()
+}
+
+
+class LightTimeline:
+    """
+    in-memory sequence of light state transitions (generation time, state
+    mask; see db.utility_tables.LightTransition), for looking up the light
+    state at any time by binary search.
+    """
+
+    def __init__(self):
+        self.times: list[dt.datetime] = []
+        self.states: list[int] = []
+
+    def extend(self, transitions: Iterable[tuple[dt.datetime, int]]):
+        """add or replace transitions. cheapest if they're newer than ours."""
+        for time, state in transitions:
+            i = bisect_left(self.times, time)
+            if i < len(self.times) and self.times[i] == time:
+                self.states[i] = state
+            else:
+                self.times.insert(i, time)
+                self.states.insert(i, state)
+
+    @property
+    def latest(self) -> Optional[dt.datetime]:
+        return self.times[-1] if len(self.times) > 0 else None
+
+    def state_at(self, time: dt.datetime) -> Optional[int]:
+        """state mask in effect at time, or None if it precedes the timeline"""
+        i = bisect_right(self.times, time)
+        return self.states[i - 1] if i > 0 else None
+
+    def header_values(self, time: dt.datetime) -> dict[str, bool]:
+        """luminaire fields of an image header for an image taken at time."""
+        mask = self.state_at(time) or 0
+        return {
+            LIGHT_HEADER_FIELDS[key]: bool(mask & bit)
+            for key, bit in LUMINAIRE_BITS.items()
+        }
+
+    def __len__(self):
+        return len(self.times)
+
+
 class NotAnImageParameter(ValueError):
     pass
 
@@ -135,7 +344,7 @@ def unpack_image_parameter_data(
         | get("eng_value")["imageHeader"]
         | temp_hardcoded_header_values()
     )
-    if isinstance(parameter, dict):
+    if isinstance(parameter, Mapping):
         # allows us to explicitly manipulate ImageRecord constructors
         parameter_dict |= itemfilter(
             lambda kv: kv[0] not in ("eng_value", "raw_value"), parameter
@@ -0,0 +1,332 @@
+"""
+end-to-end throughput benchmark for the image pipeline, driven by a mock
+yamcs server. publishes mock image parameters at a series of fixed rates and
+records when each image reaches each stage of the pipeline:
+
+published: the mock server published the parameter value
+instructed: the Station made a process_image instruction (i.e., ImageCheck
+    flagged the value and the Station heard about it)
+sent: the Station sent the instruction to the image processor
+started / processed: create_image.create() started / returned
+tiff: the TIFF file was written (file mtime)
+db_row: the ImageRecord was visible in the database (polled)
+thumbnail: the thumbnail was written (file mtime)
+
+results, including per-stage latency percentiles and the highest throughput
+achieved, are written as JSON so that runs on different commits can be
+compared. like generate_image_db.py, this wipes the test database and
+product folders, and must only be run in test mode. example:
+
+python -m viper_orchestrator.tests.benchmark_pipeline --rates=[1,2,5,10]
+"""
+import datetime as dt
+import json
+from pathlib import Path
+import random
+import subprocess
+import time
+from typing import Any, Collection, Optional, Sequence, Union
+
+import fire
+import numpy as np
+from sqlalchemy import select
+
+import viper_orchestrator.station.definition as vsd
+from viper_orchestrator.config import LOG_ROOT, PARAMETERS, TEST
+from viper_orchestrator.db import OSession
+from viper_orchestrator.db.runtime import SHUTDOWN
+from viper_orchestrator.products import browse_path, data_path
+from viper_orchestrator.station.components import image_task_title
+from viper_orchestrator.tests.utilities import (
+    make_mock_server,
+    reset_test_products,
+)
+from viper_orchestrator.yamcsutils.mock import MockContext, MockServer
+from vipersci.pds.pid import VISID
+from vipersci.vis.db.image_records import ImageRecord
+
+STAGES = (
+    "published",
+    "instructed",
+    "sent",
+    "started",
+    "processed",
+    "tiff",
+    "db_row",
+    "thumbnail",
+)
+# header overrides that make an image lossy; other images are served as
+# recorded in the mock data
+LOSSY_FIELDS = {
+    "eng_value_imageHeader_processingInfo": 8,
+    "eng_value_imageHeader_outputImageMask": 8,
+    "onboard_compression_ratio": 16,
+}
+# a level is saturated if it delivers less than this fraction of its
+# offered rate
+SATURATION_THRESHOLD = 0.9
+
+
+def _epoch(
+    timestamp: Union[dt.datetime, str, float, None]
+) -> Optional[float]:
+    if timestamp is None or isinstance(timestamp, float):
+        return timestamp
+    if isinstance(timestamp, str):
+        timestamp = dt.datetime.fromisoformat(timestamp)
+    return timestamp.timestamp()
+
+
+def _mtime(path: Path) -> Optional[float]:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def publish_images(
+    server: MockServer,
+    n_images: int,
+    rate: float,
+    lossy_fraction: float,
+    rng: random.Random,
+) -> dict[str, dict[str, Any]]:
+    """
+    publish up to n_images image parameter values at a fixed rate, keyed by
+    process_image task title. stops early if the mock server runs out.
+    """
+    timings, start = {}, time.time()
+    for i in range(n_images):
+        # schedule against the start time so that slow publishes don't
+        # compound into a lower offered rate
+        time.sleep(max(0.0, start + i / rate - time.time()))
+        fields = LOSSY_FIELDS if rng.random() < lossy_fraction else {}
+        try:
+            event = server.serve_event(**fields)
+        except IndexError:
+            break
+        header = event["eng_value"]["imageHeader"]
+        title = image_task_title(
+            VISID.instrument_name(header["cameraId"]), header["lobt"]
+        )
+        timings[title] = {"published": time.time()}
+        server.ctx.publish(event["name"], event)
+    return timings
+
+
+def poll_stages(
+    station,
+    timings: dict[str, dict[str, Any]],
+    timeout: float,
+    stale_tasks: Collection[str] = (),
+    poll_interval: float = 0.05,
+):
+    """
+    fill in stage times for published images until all of them have made it
+    through the pipeline or timeout seconds pass with no progress. ignores
+    tasks whose ids are in stale_tasks (e.g., tasks from earlier levels).
+    """
+    last_progress, n_done = time.time(), 0
+    while time.time() - last_progress < timeout:
+        for task_id, task in tuple(station.tasks.items()):
+            if task_id in stale_tasks or task["name"] != "process_image":
+                continue
+            title = task["description"].get("title")
+            if title not in timings:
+                continue
+            timings[title]["instructed"] = _epoch(task["init_time"])
+            timings[title]["sent"] = _epoch(task["sent_time"])
+            if task["status"] == "success":
+                timings[title]["started"] = _epoch(task["start_time"])
+                timings[title]["processed"] = _epoch(task["end_time"])
+        with OSession() as session:
+            records = session.scalars(select(ImageRecord)).all()
+        now = time.time()
+        for rec in records:
+            title = image_task_title(rec.instrument_name, rec.lobt)
+            if title not in timings or rec.file_path is None:
+                continue
+            image = timings[title]
+            image.setdefault("db_row", now)
+            image["product_id"] = rec.product_id
+            image["tiff"] = _mtime(data_path(rec.product_id))
+            image["thumbnail"] = _mtime(browse_path(rec.product_id, "thumb"))
+        done = sum(
+            all(image.get(s) is not None for s in STAGES)
+            for image in timings.values()
+        )
+        if done == len(timings):
+            return
+        if done > n_done:
+            last_progress, n_done = time.time(), done
+        time.sleep(poll_interval)
+
+
+def summarize(latencies: Sequence[float]) -> dict[str, Optional[float]]:
+    if len(latencies) == 0:
+        return {"n": 0}
+    latencies = np.asarray(latencies)
+    p50, p95, p99 = np.percentile(latencies, (50, 95, 99))
+    return {
+        "n": len(latencies),
+        "mean": float(latencies.mean()),
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "max": float(latencies.max()),
+    }
+
+
+def summarize_level(
+    rate: float, timings: dict[str, dict[str, Any]]
+) -> dict[str, Any]:
+    """per-stage latency statistics and achieved throughput for one level."""
+    stages = {}
+    for prev, stage in zip(STAGES, STAGES[1:]):
+        stages[f"{prev}->{stage}"] = summarize(
+            [
+                t[stage] - t[prev]
+                for t in timings.values()
+                if t.get(stage) is not None and t.get(prev) is not None
+            ]
+        )
+    complete = [
+        t
+        for t in timings.values()
+        if all(t.get(s) is not None for s in STAGES)
+    ]
+    # the thumbnail and the db row race each other, so 'done' is whichever
+    # of them happens last
+    finished = [max(t["db_row"], t["thumbnail"]) for t in complete]
+    end_to_end = [f - t["published"] for f, t in zip(finished, complete)]
+    if len(complete) > 1:
+        span = max(finished) - min(t["published"] for t in timings.values())
+        throughput = len(complete) / span
+    else:
+        throughput = None
+    return {
+        "offered_rate": rate,
+        "published": len(timings),
+        "completed": len(complete),
+        "throughput": throughput,
+        "saturated": (
+            throughput is None
+            or len(complete) < len(timings)
+            or throughput < rate * SATURATION_THRESHOLD
+        ),
+        "end_to_end": summarize(end_to_end),
+        "stages": stages,
+        "images": timings,
+    }
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(
+    rates: Sequence[float] = (1, 2, 5, 10),
+    images: int = 40,
+    lossy_fraction: float = 1.0,
+    timeout: float = 60,
+    stop_at_saturation: bool = True,
+    n_threads: int = 4,
+    seed: int = 0,
+    outpath: Optional[str] = None,
+) -> Path:
+    """
+    run the benchmark at each rate (images per second) in turn, wiping the
+    database between levels, and write results to outpath (by default, a
+    timestamped file in LOG_ROOT/benchmarks). returns the results path.
+    """
+    # only run this in test mode!
+    assert TEST is True
+    rng, levels, station, ctx = random.Random(seed), [], None, None
+    started = dt.datetime.now(dt.UTC)
+    try:
+        reset_test_products()
+        station = vsd.create_station()
+        station.save_port_to_shared_memory()
+        station.start()
+        vsd.launch_delegates(
+            station,
+            mock=True,
+            context="local",
+            n_threads=n_threads,
+            backfill=False,
+        )
+        # give delegate configuration a moment to propagate
+        time.sleep(0.6)
+        ctx = MockContext()
+        server = make_mock_server(ctx)
+        for watcher in ("image", "light"):
+            delegate = station.get_delegate(f"{watcher}_watcher")["obj"]
+            delegate.sensors[f"{watcher}_watch"].mock_context = ctx
+        for rate in sorted(rates):
+            reset_test_products()
+            stale_tasks = set(station.tasks.keys())
+            # (re)setting parameters rewinds the mock server
+            server.parameters = [p for p in PARAMETERS if "Images" in p]
+            print(f"publishing {images} images at {rate}/s")
+            timings = publish_images(
+                server, images, rate, lossy_fraction, rng
+            )
+            poll_stages(station, timings, timeout, stale_tasks)
+            level = summarize_level(rate, timings)
+            levels.append(level)
+            print(
+                f"{level['completed']}/{level['published']} complete; "
+                f"throughput {level['throughput']}; "
+                f"end-to-end {level['end_to_end']}"
+            )
+            if station.state == "crashed":
+                raise SystemError("station crashed")
+            if level["saturated"] and stop_at_saturation:
+                break
+    finally:
+        if station is not None:
+            station.shutdown()
+        if ctx is not None:
+            ctx.kill()
+        SHUTDOWN.maybe_shut_down_postgres()
+    throughputs = [lv["throughput"] for lv in levels if lv["throughput"]]
+    results = {
+        "commit": current_commit(),
+        "started": started.isoformat(),
+        "config": {
+            "rates": list(rates),
+            "images": images,
+            "lossy_fraction": lossy_fraction,
+            "timeout": timeout,
+            "n_threads": n_threads,
+            "seed": seed,
+        },
+        "stages": STAGES,
+        "saturation_throughput": max(throughputs, default=None),
+        "levels": levels,
+    }
+    if outpath is None:
+        outpath = Path(
+            LOG_ROOT,
+            "benchmarks",
+            f"pipeline_{started.strftime('%Y%m%dT%H%M%S')}.json",
+        )
+    outpath = Path(outpath)
+    outpath.parent.mkdir(parents=True, exist_ok=True)
+    with outpath.open("w") as stream:
+        json.dump(results, stream, indent=2)
+    print(f"wrote results to {outpath}")
+    return outpath
+
+
+if __name__ == "__main__":
+    fire.Fire(run_benchmark)
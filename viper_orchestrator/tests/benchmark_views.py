@@ -0,0 +1,120 @@
+"""
+concurrent load benchmark for the tracking frontend. a number of simulated
+reviewers request pages from a running server as fast as they can for a
+fixed duration; we record per-page latency and overall throughput. run it
+against the same database behind a WSGI and an ASGI deployment to compare
+them, e.g.:
+
+gunicorn visintent.wsgi:application -w 2
+gunicorn visintent.asgi:application -w 2 -k uvicorn.workers.UvicornWorker
+
+python -m viper_orchestrator.tests.benchmark_views --clients=[1,4,16]
+
+requests are sent without validators, so this measures rendering (or
+server-side cache hits), not 304 responses. results are written as JSON.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import datetime as dt
+import json
+from pathlib import Path
+import time
+from typing import Any, Optional, Sequence
+
+import fire
+import numpy as np
+import requests
+
+from viper_orchestrator.config import LOG_ROOT
+
+PAGES = ("images", "requestlist", "review", "ldst", "pllist")
+
+
+def _client(
+    base_url: str, pages: Sequence[str], deadline: float
+) -> list[tuple[str, float, int]]:
+    """request pages round-robin until deadline. returns (page, s, status)."""
+    results, i = [], 0
+    with requests.Session() as http:
+        while time.time() < deadline:
+            page, start = pages[i % len(pages)], time.time()
+            status = http.get(f"{base_url}/{page}").status_code
+            results.append((page, time.time() - start, status))
+            i += 1
+    return results
+
+
+def run_level(
+    base_url: str, pages: Sequence[str], clients: int, duration: float
+) -> dict[str, Any]:
+    deadline = time.time() + duration
+    with ThreadPoolExecutor(clients) as pool:
+        futures = [
+            pool.submit(_client, base_url, pages, deadline)
+            for _ in range(clients)
+        ]
+        results = [r for f in futures for r in f.result()]
+    level = {
+        "clients": clients,
+        "requests": len(results),
+        "errors": sum(status != 200 for _, _, status in results),
+        "throughput": len(results) / duration,
+        "pages": {},
+    }
+    for page in pages:
+        latencies = [s for p, s, _ in results if p == page]
+        if len(latencies) == 0:
+            continue
+        p50, p95, p99 = np.percentile(latencies, (50, 95, 99))
+        level["pages"][page] = {
+            "n": len(latencies),
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+        }
+    return level
+
+
+def run_view_benchmark(
+    base_url: str = "http://127.0.0.1:8000",
+    clients: Sequence[int] = (1, 4, 16),
+    duration: float = 20,
+    pages: Sequence[str] = PAGES,
+    outpath: Optional[str] = None,
+) -> Path:
+    """
+    run a level of the benchmark for each number of concurrent clients and
+    write results to outpath (by default, a timestamped file in
+    LOG_ROOT/benchmarks). returns the results path.
+    """
+    base_url, started = base_url.rstrip("/"), dt.datetime.now(dt.UTC)
+    levels = []
+    for n in sorted(clients):
+        print(f"{n} clients for {duration} s")
+        level = run_level(base_url, pages, n, duration)
+        print(
+            f"{level['requests']} requests ({level['errors']} errors); "
+            f"throughput {level['throughput']:.2f}/s"
+        )
+        levels.append(level)
+    results = {
+        "base_url": base_url,
+        "started": started.isoformat(),
+        "duration": duration,
+        "levels": levels,
+    }
+    if outpath is None:
+        outpath = Path(
+            LOG_ROOT,
+            "benchmarks",
+            f"views_{started.strftime('%Y%m%dT%H%M%S')}.json",
+        )
+    outpath = Path(outpath)
+    outpath.parent.mkdir(parents=True, exist_ok=True)
+    with outpath.open("w") as stream:
+        json.dump(results, stream, indent=2)
+    print(f"wrote results to {outpath}")
+    return outpath
+
+
+if __name__ == "__main__":
+    fire.Fire(run_view_benchmark)
@@ -0,0 +1,111 @@
+"""
+check that ArchiveSensor hands every archived value to its Actors exactly
+once and in generation time order, even when archive fetches fail. runs a
+backfill over the whole mock archive with a MockArchive whose first fetch of
+a window fails, and compares what the sensor released with what the archive
+holds. run in test mode:
+
+python -m viper_orchestrator.tests.check_archive_backfill --window=60
+"""
+import datetime as dt
+from typing import Any, Collection, Optional
+
+import fire
+
+from viper_orchestrator.config import PARAMETERS, TEST
+from viper_orchestrator.db.runtime import SHUTDOWN
+from viper_orchestrator.station.components import (
+    ArchiveSensor,
+    fetch_archive_window,
+)
+from viper_orchestrator.tests.utilities import make_mock_server
+from viper_orchestrator.yamcsutils.mock import MockArchive
+
+assert TEST is True
+
+
+class FlakyArchive:
+    """MockArchive wrapper whose first fetch of each window in fail fails"""
+
+    def __init__(self, archive: MockArchive, fail: Collection[dt.datetime]):
+        self.archive, self.fail, self.failures = archive, set(fail), 0
+
+    def stream_parameter_values(
+        self,
+        parameters: Collection[str],
+        start: Optional[dt.datetime] = None,
+        stop: Optional[dt.datetime] = None,
+        **fields,
+    ):
+        if start in self.fail:
+            self.fail.discard(start)
+            self.failures += 1
+            raise ConnectionError(f"simulated failure fetching {start}")
+        return self.archive.stream_parameter_values(
+            parameters, start=start, stop=stop, **fields
+        )
+
+
+class LogOwner:
+    """stands in for the Station a Sensor would normally belong to"""
+
+    def __init__(self):
+        self.logs = []
+
+    def _log(self, *args, **kwargs):
+        self.logs.append((args, kwargs))
+
+
+def _key(value: dict[str, Any]) -> tuple[str, dt.datetime]:
+    return value["name"], value["generation_time"].astimezone(dt.UTC)
+
+
+def check_archive_backfill(window: float = 60, max_checks: int = 100_000):
+    server = make_mock_server()
+    start = server.start_time.astimezone(dt.UTC) - dt.timedelta(seconds=1)
+    stop = server.stop_time.astimezone(dt.UTC) + dt.timedelta(seconds=1)
+    sensor = ArchiveSensor()
+    sensor.owner = LogOwner()
+    sensor.mock = True
+    sensor.mock_server = server
+    sensor.parameters = list(PARAMETERS)
+    sensor.start_times = {p: start for p in PARAMETERS}
+    sensor.stop, sensor.window, sensor.rate = stop, window, 1_000_000
+    sensor._init_client()
+    # fail the first window that has values, and the one after it, so the
+    # failed fetches are followed by in-flight fetches of later windows
+    expected, recorded = fetch_archive_window(
+        sensor.archive, tuple(PARAMETERS), start, stop, False
+    )
+    expected = [_key(v) for v in expected if _key(v) not in recorded]
+    first = min(t for _, t in expected)
+    first = start + dt.timedelta(
+        seconds=window * ((first - start) // dt.timedelta(seconds=window))
+    )
+    archive = FlakyArchive(
+        sensor.archive, (first, first + dt.timedelta(seconds=window))
+    )
+    sensor._archive = archive
+    released = []
+    for _ in range(max_checks):
+        _, values = sensor.checker(None)
+        released += [_key(v) for v in values]
+        if sensor.status == "caught up":
+            break
+    else:
+        raise AssertionError(f"backfill didn't finish ({sensor.status})")
+    SHUTDOWN.maybe_shut_down_postgres()
+    assert archive.failures == 2, f"{archive.failures} simulated failures"
+    missing = set(expected).difference(released)
+    assert len(missing) == 0, f"{len(missing)} values lost, e.g. {missing}"
+    assert len(released) == len(set(released)), "values released twice"
+    times = [t for _, t in released]
+    assert times == sorted(times), "values released out of order"
+    print(
+        f"ok: {len(released)} values released; "
+        f"{archive.failures} failed fetches retried"
+    )
+
+
+if __name__ == "__main__":
+    fire.Fire(check_archive_backfill)
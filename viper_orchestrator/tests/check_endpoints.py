@@ -0,0 +1,57 @@
+"""
+check that the tracking app's JSON endpoints answer good and bad requests
+with the expected status codes. run against a test database (see
+generate_image_db.py):
+
+python -m viper_orchestrator.tests.check_endpoints
+"""
+import os
+
+import django
+import fire
+from django.core.cache import cache
+
+# note that django setup _must_ occur before importing any modules that
+# rely on the django API
+os.environ.setdefault(
+    "DJANGO_SETTINGS_MODULE", "viper_orchestrator.visintent.visintent.settings"
+)
+django.setup()
+from django.test import Client
+
+# expected status code for each request path
+EXPECTED_STATUS = {
+    "/lighttimeline": 200,
+    "/lighttimeline?start=2024-01-01T00:00:00&stop=2030-01-01T00:00:00": 200,
+    "/lighttimeline?start=not-a-time": 400,
+}
+
+
+def assert_status(path: str, status: int, client=None):
+    """
+    request path with an empty page cache and raise an AssertionError if
+    the response doesn't have the expected status code.
+    """
+    client = Client() if client is None else client
+    cache.clear()
+    response = client.get(path)
+    assert response.status_code == status, (
+        f"{path}: {response.status_code} (expected {status})"
+    )
+
+
+def check_endpoints():
+    client, failures = Client(), []
+    for path, status in EXPECTED_STATUS.items():
+        try:
+            assert_status(path, status, client)
+            print(f"{path}: ok")
+        except AssertionError as ae:
+            print(ae)
+            failures.append(path)
+    if len(failures) > 0:
+        raise AssertionError(f"unexpected status: {', '.join(failures)}")
+
+
+if __name__ == "__main__":
+    fire.Fire(check_endpoints)
@@ -0,0 +1,115 @@
+"""
+check that LightTransition states are correct when several batches of light
+state changes are written concurrently and out of order, as light_watch and
+archive_watch batches can be. writes synthetic transitions far in the future
+(so that no real transitions follow them), compares the stored states with
+ones computed sequentially, and deletes them afterwards:
+
+python -m viper_orchestrator.tests.check_light_transitions --n_writers=4
+"""
+import datetime as dt
+import random
+from threading import Barrier, Thread
+import time
+
+import fire
+from sqlalchemy import delete, select
+
+from viper_orchestrator.db import OSession
+from viper_orchestrator.db.runtime import SHUTDOWN
+from viper_orchestrator.db.utility_tables import (
+    LUMINAIRE_BITS,
+    LightTransition,
+    encode_light_state,
+    light_state_at,
+    write_light_transitions,
+)
+
+# time of the first synthetic change
+EPOCH = dt.datetime(2200, 1, 1, tzinfo=dt.UTC)
+
+Changes = dict[dt.datetime, dict[str, bool]]
+
+
+def random_changes(n_writers: int, per_writer: int) -> list[Changes]:
+    """
+    batches of changes to random luminaires at one-second intervals, dealt
+    out to writers round-robin so that every batch interleaves the others.
+    """
+    batches = [{} for _ in range(n_writers)]
+    for i in range(n_writers * per_writer):
+        name = random.choice(tuple(LUMINAIRE_BITS.keys()))
+        batches[i % n_writers][EPOCH + dt.timedelta(seconds=i)] = {
+            name: random.choice((True, False))
+        }
+    return batches
+
+
+def expected_states(base: int, batches: list[Changes]) -> dict:
+    """states after each change, applying all batches in time order."""
+    merged = {t: c for batch in batches for t, c in batch.items()}
+    states, state = {}, base
+    for gentime in sorted(merged):
+        for name, on in merged[gentime].items():
+            bit = LUMINAIRE_BITS[name]
+            state = state | bit if on is True else state & ~bit
+        states[gentime] = state
+    return states
+
+
+def write_batch(changes: Changes, barrier: Barrier, hold: float):
+    with OSession() as session:
+        barrier.wait()
+        write_light_transitions(changes, session=session)
+        # keep the transaction open, so that unserialized writers would
+        # overlap
+        time.sleep(hold)
+        session.commit()
+
+
+def check_light_transitions(
+    n_writers: int = 4, per_writer: int = 25, hold: float = 0.2
+):
+    base = light_state_at(EPOCH)
+    base = 0 if base is None else encode_light_state(
+        {k: v for k, v in base.items() if k != "generation_time"}
+    )
+    batches = random_changes(n_writers, per_writer)
+    barrier = Barrier(n_writers)
+    threads = [
+        Thread(target=write_batch, args=(batch, barrier, hold))
+        for batch in batches
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with OSession() as session:
+            stored = dict(
+                session.execute(
+                    select(
+                        LightTransition.generation_time, LightTransition.state
+                    ).where(LightTransition.generation_time >= EPOCH)
+                ).all()
+            )
+    finally:
+        with OSession() as session:
+            session.execute(
+                delete(LightTransition).where(
+                    LightTransition.generation_time >= EPOCH
+                )
+            )
+            session.commit()
+        SHUTDOWN.maybe_shut_down_postgres()
+    expected = expected_states(base, batches)
+    wrong = [t for t in expected if stored.get(t) != expected[t]]
+    assert len(wrong) == 0, (
+        f"{len(wrong)} of {len(expected)} transitions have wrong states, "
+        f"starting at {min(wrong)}"
+    )
+    print(f"ok: {len(expected)} transitions from {n_writers} writers")
+
+
+if __name__ == "__main__":
+    fire.Fire(check_light_transitions)
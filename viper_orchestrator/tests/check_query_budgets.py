@@ -0,0 +1,67 @@
+"""
+check that list and review pages render within a fixed number of SQL
+queries, regardless of how many requests, images, or protected list entries
+are in the database. a page whose query count grows with the size of the
+database has an N+1 pattern somewhere. run against a populated test
+database (see generate_image_db.py and generate_test_django_forms.py):
+
+python -m viper_orchestrator.tests.check_query_budgets
+"""
+import os
+
+import django
+import fire
+from django.core.cache import cache
+
+from viper_orchestrator.db.instrumentation import QueryStats, measure_queries
+
+# note that django setup _must_ occur before importing any modules that
+# rely on the django API
+os.environ.setdefault(
+    "DJANGO_SETTINGS_MODULE", "viper_orchestrator.visintent.visintent.settings"
+)
+django.setup()
+from django.test import Client
+
+# maximum queries per page, including the page's version query
+QUERY_BUDGETS = {
+    "/requestlist": 6,
+    "/review": 8,
+    "/ldst": 6,
+    "/pllist": 8,
+    "/images": 3,
+}
+
+
+def assert_query_budget(path: str, budget: int, client=None) -> QueryStats:
+    """
+    render path with an empty page cache and raise an AssertionError if it
+    takes more than budget queries.
+    """
+    client = Client() if client is None else client
+    cache.clear()
+    with measure_queries() as stats:
+        response = client.get(path)
+    assert response.status_code == 200, f"{path}: {response.status_code}"
+    assert stats.count <= budget, (
+        f"{path} made {stats.count} queries (budget {budget}); repeated: "
+        f"{stats.repeated()}"
+    )
+    return stats
+
+
+def check_query_budgets():
+    client, failures = Client(), []
+    for path, budget in QUERY_BUDGETS.items():
+        try:
+            stats = assert_query_budget(path, budget, client)
+            print(f"{path}: {stats.count}/{budget} queries")
+        except AssertionError as ae:
+            print(ae)
+            failures.append(path)
+    if len(failures) > 0:
+        raise AssertionError(f"over query budget: {', '.join(failures)}")
+
+
+if __name__ == "__main__":
+    fire.Fire(check_query_budgets)
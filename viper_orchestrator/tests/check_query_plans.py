@@ -0,0 +1,266 @@
+"""
+check that the orchestrator's hot lookups use indexes (see
+db.utility_tables.LOOKUP_INDEXES) rather than sequential scans. fills the
+database with a large number of synthetic ImageRecords and LightRecords --
+copies of an existing ImageRecord with varied keys, so run
+generate_image_db.py first -- runs EXPLAIN on each query, and rolls
+everything back afterwards:
+
+python -m viper_orchestrator.tests.check_query_plans --n_rows=200000
+"""
+import datetime as dt
+from typing import Any, Iterator, Optional
+
+import fire
+from sqlalchemy import (
+    Select,
+    String,
+    cast,
+    func,
+    insert,
+    literal,
+    select,
+    text,
+    true,
+    tuple_,
+)
+from sqlalchemy.dialects.postgresql import array
+from sqlalchemy.orm import Session
+
+from viper_orchestrator.db import OSession
+from viper_orchestrator.db.partitions import ensure_light_partitions
+from viper_orchestrator.db.runtime import SHUTDOWN
+from viper_orchestrator.visintent.tracking.tables import ProtectedListEntry
+from vipersci.vis.db.image_records import ImageRecord
+from vipersci.vis.db.light_records import LightRecord, luminaire_names
+
+SYNTHETIC_PREFIX = "synthetic_"
+# memory slots synthetic records cycle through
+N_SLOTS = 4096
+# generation time of the first synthetic LightRecord; they follow at 1 s
+LIGHT_EPOCH = dt.datetime(2020, 1, 1, tzinfo=dt.UTC)
+
+
+def insert_synthetic_records(n_rows: int, session: Session):
+    """
+    insert n_rows ImageRecords, each a copy of an existing one with a new
+    product id, capture id, memory slot, and start time, and n_rows
+    LightRecords spread across the luminaires (creating light_records
+    partitions for them as needed).
+    """
+    table = ImageRecord.__table__
+    template = select(table).limit(1).subquery("template")
+    if session.execute(select(template.c.id)).first() is None:
+        raise ValueError("no ImageRecords to copy; run generate_image_db.py")
+    series = func.generate_series(1, n_rows).table_valued("g")
+    varied = {
+        "product_id": literal(SYNTHETIC_PREFIX) + cast(series.c.g, String),
+        "capture_id": 10_000_000 + series.c.g // 4,
+        "image_id": series.c.g % N_SLOTS,
+        "start_time": template.c.start_time + func.make_interval(
+            0, 0, 0, 0, 0, 0, series.c.g
+        ),
+        "image_request_id": literal(None),
+    }
+    columns = [c.name for c in table.columns if c.name != "id"]
+    session.execute(
+        insert(table).from_select(
+            columns,
+            select(
+                *(varied.get(c, template.c[c]) for c in columns)
+            ).select_from(template.join(series, true())),
+        )
+    )
+    ensure_light_partitions(
+        [LIGHT_EPOCH, LIGHT_EPOCH + dt.timedelta(seconds=n_rows)],
+        session.connection(),
+    )
+    lights = func.generate_series(0, n_rows - 1).table_valued("g")
+    # LightRecords hold full luminaire names
+    names = array(list(luminaire_names.values()))
+    session.execute(
+        insert(LightRecord.__table__).from_select(
+            ["name", "datetime", "on"],
+            select(
+                names[lights.c.g % len(luminaire_names) + 1],
+                literal(LIGHT_EPOCH) + func.make_interval(
+                    0, 0, 0, 0, 0, 0, lights.c.g
+                ),
+                lights.c.g % 2 == 0,
+            ),
+        )
+    )
+    session.connection().exec_driver_sql(
+        f"ANALYZE {table.name}; ANALYZE {LightRecord.__tablename__}"
+    )
+
+
+def hot_queries(
+    n_rows: int, session: Session
+) -> dict[str, tuple[Select, str, Optional[str]]]:
+    """
+    hot lookups, keyed by caller, with the table each reads and the name of
+    the index it should use (None if any index will do).
+    """
+    sample = session.scalars(
+        select(ImageRecord)
+        .where(ImageRecord._pid.startswith(SYNTHETIC_PREFIX))
+        .limit(1)
+    ).one()
+    entry = ProtectedListEntry(
+        instrument_name=sample.instrument_name,
+        image_id=sample.image_id,
+        start_time=sample.start_time,
+        rationale="",
+    )
+    light = next(iter(luminaire_names.values()))
+    return {
+        "get_one(_pid)": (
+            select(ImageRecord).where(ImageRecord._pid == sample._pid),
+            "image_records",
+            None,
+        ),
+        "records_from_capture_ids": (
+            select(ImageRecord).where(
+                ImageRecord.capture_id == sample.capture_id
+            ),
+            "image_records",
+            "image_records_capture_id_idx",
+        ),
+        "ProtectedListEntry.match_selector": (
+            entry.match_selector(),
+            "image_records",
+            "image_records_slot_idx",
+        ),
+        "ProtectedListEntry.supselector": (
+            entry.supselector(),
+            "image_records",
+            "image_records_slot_idx",
+        ),
+        "ProtectedListEntry.populate_many": (
+            select(ImageRecord).where(
+                ImageRecord.image_id.in_(range(sample.image_id, N_SLOTS, 512))
+            ),
+            "image_records",
+            "image_records_slot_idx",
+        ),
+        "iterkeyset(start_time)": (
+            select(ImageRecord)
+            .where(
+                tuple_(ImageRecord.start_time, ImageRecord.id)
+                < tuple_(sample.start_time, sample.id)
+            )
+            .order_by(ImageRecord.start_time.desc(), ImageRecord.id.desc())
+            .limit(50),
+            "image_records",
+            "image_records_start_time_id_idx",
+        ),
+        "summaries (image_request_id)": (
+            select(ImageRecord.id).where(
+                ImageRecord.image_request_id.in_((1, 2, 3))
+            ),
+            "image_records",
+            "image_records_image_request_id_idx",
+        ),
+        "get_light_state": (
+            select(LightRecord)
+            .where(
+                LightRecord.name == light,
+                LightRecord.datetime
+                < LIGHT_EPOCH + dt.timedelta(seconds=n_rows // 2),
+            )
+            .order_by(LightRecord.datetime.desc())
+            .limit(1),
+            "light_records",
+            "light_records_name_datetime_key",
+        ),
+    }
+
+
+def plan_nodes(plan: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def explain(statement: Select, session: Session) -> list[dict[str, Any]]:
+    """flattened nodes of the query plan for statement."""
+    connection = session.connection()
+    compiled = statement.compile(
+        dialect=connection.dialect,
+        compile_kwargs={"render_postcompile": True},
+    )
+    plan = connection.exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+    ).scalar()
+    return list(plan_nodes(plan[0]["Plan"]))
+
+
+def with_partitions(name: str, session: Session) -> set[str]:
+    """
+    name, plus the names of its partitions if it's a partitioned table, or
+    of its partitions' indexes if it's a partitioned index.
+    """
+    return {name} | set(
+        session.scalars(
+            text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = :name"
+            ),
+            {"name": name},
+        )
+    )
+
+
+def check_plan(
+    nodes: list[dict[str, Any]],
+    relation: str,
+    index: Optional[str],
+    session: Session,
+):
+    """
+    raise an AssertionError if a plan doesn't use index (or, for a
+    partitioned table, its partitions' indexes) to read relation
+    """
+    relations = with_partitions(relation, session)
+    scans = [n for n in nodes if n.get("Relation Name") in relations]
+    if any(n["Node Type"] == "Seq Scan" for n in scans):
+        raise AssertionError(f"sequential scan on {relation}")
+    # bitmap index scans don't name their relation, but our indexes (and
+    # postgres's default index names) are prefixed with it
+    used = {
+        n["Index Name"] for n in nodes
+        if n.get("Index Name", "").startswith(relation)
+    }
+    if len(used) == 0:
+        raise AssertionError(f"no index scan on {relation}")
+    if index is not None and used.isdisjoint(with_partitions(index, session)):
+        raise AssertionError(f"used {used} rather than {index}")
+
+
+def check_query_plans(n_rows: int = 200_000):
+    failures = []
+    with OSession() as session:
+        try:
+            insert_synthetic_records(n_rows, session)
+            queries = hot_queries(n_rows, session)
+            for name, (statement, relation, index) in queries.items():
+                try:
+                    check_plan(
+                        explain(statement, session), relation, index, session
+                    )
+                    print(f"{name}: ok")
+                except AssertionError as ae:
+                    print(f"{name}: {ae}")
+                    failures.append(name)
+        finally:
+            session.rollback()
+    SHUTDOWN.maybe_shut_down_postgres()
+    if len(failures) > 0:
+        raise AssertionError(f"unindexed hot queries: {', '.join(failures)}")
+
+
+if __name__ == "__main__":
+    fire.Fire(check_query_plans)
@@ -7,7 +7,7 @@ import shutil
 import time
 
 from hostess.utilities import timeout_factory
-from sqlalchemy import select
+from sqlalchemy import delete, select
 
 import viper_orchestrator.station.definition as vsd
 # noinspection PyUnresolvedReferences
@@ -16,7 +16,12 @@ from viper_orchestrator.config import (
 )
 from viper_orchestrator.db import OSession
 from viper_orchestrator.db.runtime import SHUTDOWN
-from viper_orchestrator.db.table_utils import delete_cascade
+from viper_orchestrator.db.table_utils import bulk_delete
+from viper_orchestrator.db.utility_tables import (
+    HighWaterMark,
+    LastLightState,
+    LightTransition,
+)
 from viper_orchestrator.tests.utilities import make_mock_server
 from viper_orchestrator.yamcsutils.mock import MockContext, MockServer
 from vipersci.vis.db.image_records import ImageRecord
@@ -34,11 +39,21 @@ for folder in (DATA_ROOT, BROWSE_ROOT, LOG_ROOT):
     folder.mkdir(parents=True, exist_ok=True)
 with OSession() as session:
     print("dumping ImageRecords")
-    for rec in session.scalars(select(ImageRecord)).all():
-        delete_cascade(rec, ["image_tag_associations"], session=session, commit=False)
+    print(
+        bulk_delete(
+            ImageRecord,
+            select(ImageRecord),
+            ["image_tag_associations"],
+            session=session,
+            commit=False,
+        )
+    )
     print("dumping LightRecords")
-    for rec in session.scalars(select(LightRecord)).all():
-        session.delete(rec)
+    session.execute(delete(LightRecord))
+    session.execute(delete(LightTransition))
+    # forget persisted marks and light state, so sensors start fresh
+    session.execute(delete(HighWaterMark))
+    session.execute(delete(LastLightState))
     session.commit()
 
 
@@ -36,7 +36,7 @@ from viper_orchestrator.exceptions import (
     AlreadyLosslessError,
     AlreadyDeletedError,
 )
-from viper_orchestrator.db.table_utils import delete_cascade, get_one
+from viper_orchestrator.db.table_utils import bulk_delete, get_one
 
 
 # clean up
@@ -45,13 +45,21 @@ def dump_objects(session=None):
     # cannot just drop tables because of relationships to
     # ImageRecord, LDST, etc.
     print("dumping ImageRequests")
-    image_requests = session.scalars(select(ImageRequest)).all()
-    for request in image_requests:
-        delete_cascade(request, ["ldst_associations"], session=session)
+    counts = bulk_delete(
+        ImageRequest,
+        select(ImageRequest),
+        ["ldst_associations"],
+        session=session,
+        commit=False,
+    )
     print("dumping ProtectedListEntries")
-    entries = session.scalars(select(ProtectedListEntry)).all()
-    for entry in entries:
-        delete_cascade(entry, session=session, commit=False)
+    counts |= bulk_delete(
+        ProtectedListEntry,
+        select(ProtectedListEntry),
+        session=session,
+        commit=False,
+    )
+    print(counts)
     # make a bunch of additional random ImageRecords if we haven't
     images = image_records_by_compression(session=session)
     if len(images['lossy']) < 530:
@@ -15,7 +15,7 @@ from django.forms import (
     Form,
 )
 from hostess.utilities import curry
-from sqlalchemy import select
+from sqlalchemy import delete, select
 
 from viper_orchestrator.config import (
     PARAMETERS,
@@ -25,7 +25,15 @@ from viper_orchestrator.config import (
     BROWSE_ROOT
 )
 from viper_orchestrator.db.session import autosession
+from viper_orchestrator.db.table_utils import bulk_delete
+from viper_orchestrator.db.utility_tables import (
+    HighWaterMark,
+    LastLightState,
+    LightTransition,
+)
+from viper_orchestrator.products import browse_path, data_path
 from vipersci.vis.db.image_records import ImageRecord
+from vipersci.vis.db.light_records import LightRecord
 
 from viper_orchestrator.db import OSession
 from viper_orchestrator.yamcsutils.mock import MockServer, MockContext
@@ -112,6 +120,31 @@ def image_records_by_compression(session=None) -> dict[
     return compdict
 
 
+def reset_test_products():
+    """
+    delete all ImageRecords and LightRecords, along with raw and browse
+    products on disk and persisted high-water marks and light state.
+    destructive; for use only in test mode.
+    """
+    for folder in (DATA_ROOT, BROWSE_ROOT):
+        shutil.rmtree(folder, ignore_errors=True)
+        folder.mkdir(parents=True, exist_ok=True)
+    with OSession() as session:
+        bulk_delete(
+            ImageRecord,
+            select(ImageRecord),
+            ["image_tag_associations"],
+            session=session,
+            commit=False,
+        )
+        session.execute(delete(LightRecord))
+        session.execute(delete(LightTransition))
+        # forget persisted marks and light state, so sensors start fresh
+        session.execute(delete(HighWaterMark))
+        session.execute(delete(LastLightState))
+        session.commit()
+
+
 def make_mock_server(ctx: Optional[MockContext] = None) -> MockServer:
     """
     create a mock yamcs server backed by a parquet file and a directory of
@@ -166,9 +199,17 @@ def copy_imagerecord(
     del product_dict['id']
     new = ImageRecord(**(product_dict | extra_kwargs))
     if copy_files is True:
-        for d in (DATA_ROOT, BROWSE_ROOT):
-            for m in [f for f in d.iterdir() if source._pid in f.name]:
-                shutil.copy(m, d / m.name.replace(source._pid, new._pid))
+        paths = [
+            (data_path(source._pid, s), data_path(new._pid, s))
+            for s in (".tif", ".json")
+        ] + [
+            (browse_path(source._pid, k), browse_path(new._pid, k))
+            for k in ("thumb", "browse")
+        ]
+        for src, dst in paths:
+            if src.exists():
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy(src, dst)
         new.file_path = source.file_path.replace(source._pid, new._pid)
     return new
 
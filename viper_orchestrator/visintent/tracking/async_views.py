@@ -0,0 +1,98 @@
+"""
+async versions of the read-heavy tracking views, for deployment under an
+ASGI server (see visintent/visintent/asgi.py), e.g.:
+
+gunicorn visintent.asgi:application -k uvicorn.workers.UvicornWorker
+
+each blocking query runs in a worker thread with its own Session (see
+db.session.in_session), so a slow page holds a thread rather than a whole
+worker process, and queries a page needs that don't depend on one another
+run concurrently. rendering happens on the event loop, except for
+imageview, whose template touches lazy-loaded relationships.
+
+the synchronous views in views.py remain in place for internal callers
+(e.g. form submission handlers that redisplay a page).
+"""
+import asyncio
+import json
+
+from cytoolz import valmap
+from django.http import HttpResponse
+from django.shortcuts import render
+
+from viper_orchestrator.db.session import in_session
+from viper_orchestrator.visintent.tracking import views
+from viper_orchestrator.visintent.tracking.caching import conditional_page
+from viper_orchestrator.visintent.tracking.tables import ProtectedListEntry
+from viper_orchestrator.visintent.tracking.vis_db_structures import (
+    ldst_status_dict,
+    merge_review_info,
+    request_review_dict,
+    verification_info_dict,
+)
+from vipersci.vis.db.image_records import ImageRecord
+
+
+@conditional_page(*views.REQUEST_TABLES)
+async def imageview(request, pid=None, rec_id=None, **_) -> HttpResponse:
+    if pid is None and rec_id is None:
+        pid = request.path.strip("/")
+    return await in_session(
+        lambda s: views.render_imageview(request, s, pid=pid, rec_id=rec_id)
+    )
+
+
+@conditional_page(*views.REQUEST_TABLES)
+async def requestlist(request) -> HttpResponse:
+    """prep and render list of all existing requests"""
+    records = await in_session(views.request_list_records)
+    return render(
+        request, "request_list.html", views.requestlist_context(records)
+    )
+
+
+@conditional_page(*views.REQUEST_TABLES)
+async def ldst(request) -> HttpResponse:
+    """render LDST status page"""
+    status = await in_session(ldst_status_dict)
+    return render(
+        request, "ldst_status.html", context=valmap(json.dumps, status)
+    )
+
+
+@conditional_page(*views.REQUEST_TABLES)
+async def review(request) -> HttpResponse:
+    verifications, req_info = await asyncio.gather(
+        in_session(verification_info_dict), in_session(request_review_dict)
+    )
+    return render(
+        request,
+        "review.html",
+        context=valmap(
+            json.dumps, merge_review_info(verifications, req_info)
+        ),
+    )
+
+
+@conditional_page(ImageRecord, ProtectedListEntry)
+async def pllist(request) -> HttpResponse:
+    """
+    prep and render list of all existing protected list entries, along with
+    most recent downlinked image ID (memory location) for each CCU
+    """
+    records, last_ids = await asyncio.gather(
+        in_session(views.protected_list_records),
+        in_session(views.get_last_image_ids),
+    )
+    return render(
+        request, "pl_display.html", views.pllist_context(records, last_ids)
+    )
+
+
+@conditional_page(ImageRecord)
+async def imagelist(request) -> HttpResponse:
+    """prep and render list of all existing images"""
+    records = await in_session(views.image_list_records)
+    return render(
+        request, "image_list.html", views.imagelist_context(records)
+    )
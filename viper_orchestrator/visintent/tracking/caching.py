@@ -0,0 +1,166 @@
+"""
+conditional GET support and server-side page caching for read-heavy views.
+
+a page's version token is derived from the TableVersion of each table it
+depends on, which triggers bump whenever a statement modifies the table
+(see db.utility_tables.VERSIONED_TABLES). the token is sent as the page's
+ETag, and rendered pages are kept in Django's cache keyed by URL, so an
+unchanged page costs one primary key lookup whether or not the client has
+it cached.
+
+conditional_page() works on both synchronous and async views.
+"""
+from functools import partial, wraps
+from hashlib import sha1
+from inspect import iscoroutinefunction
+import time
+from typing import Callable, Collection, Optional
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import (
+    add_never_cache_headers,
+    get_conditional_response,
+    patch_cache_control,
+)
+from django.utils.http import http_date, quote_etag
+from sqlalchemy import select
+from sqlalchemy.orm import DeclarativeBase, Session
+
+from viper_orchestrator.db import OSession
+from viper_orchestrator.db.session import in_session
+from viper_orchestrator.db.utility_tables import (
+    TableVersion,
+    VERSIONED_TABLES,
+)
+
+# kwargs internal callers pass to views after handling a form submission.
+# pages rendered with these are never cached.
+BYPASS_KWARGS = (
+    "assign_record_form",
+    "verification_form",
+    "redirect_from_success",
+)
+
+
+def table_versions(
+    tables: Collection[type[DeclarativeBase]], session: Session
+) -> str:
+    """
+    version token for a set of tables: a hash of their TableVersions.
+    tables that have never been modified have no TableVersion row yet.
+    """
+    names = sorted(t.__tablename__ for t in tables)
+    selector = select(TableVersion.table_name, TableVersion.version).where(
+        TableVersion.table_name.in_(names)
+    )
+    versions = dict(session.execute(selector).all())
+    token = [(name, versions.get(name, 0)) for name in names]
+    return sha1(repr(token).encode()).hexdigest()[:20]
+
+
+def _bypasses_cache(request, kwargs) -> bool:
+    return (
+        request.method not in ("GET", "HEAD")
+        or any(kwargs.get(k) for k in BYPASS_KWARGS)
+        # internal call from a view with its own session
+        or kwargs.get("session") is not None
+    )
+
+
+def _page_key(view: Callable, request) -> str:
+    return f"page:{view.__name__}:{request.get_full_path()}"
+
+
+def _from_cache(cached: Optional[tuple], etag: str) -> Optional[tuple]:
+    """(response, modified) for a cache entry, if it's current."""
+    if cached is None or cached[0] != etag:
+        return None
+    _, modified, content, content_type = cached
+    return HttpResponse(content, content_type=content_type), modified
+
+
+def _cache_entry(etag: str, response: HttpResponse) -> tuple:
+    return etag, time.time(), response.content, response["Content-Type"]
+
+
+def _conditional_response(request, response, etag: str, modified: float):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(modified)
+    patch_cache_control(response, no_cache=True, private=True)
+    return get_conditional_response(
+        request, etag=etag, last_modified=int(modified), response=response
+    )
+
+
+def conditional_page(*tables: type[DeclarativeBase]) -> Callable:
+    """
+    decorator for GET views whose output depends only on the URL and the
+    contents of `tables`. answers with 304 Not Modified if the client's copy
+    is current, serves the page from cache if we rendered it since the
+    tables last changed, and renders it otherwise. all of tables must be in
+    VERSIONED_TABLES.
+
+    synchronous views must take a keyword-only 'session' argument, and
+    share the decorator's Session on a miss. async views manage their own
+    Sessions; the version query runs in a worker thread.
+    """
+
+    unversioned = {t.__tablename__ for t in tables} - set(VERSIONED_TABLES)
+    if len(unversioned) > 0:
+        raise ValueError(f"changes to {unversioned} aren't versioned")
+
+    def decorator(view: Callable) -> Callable:
+        if iscoroutinefunction(view):
+            return _async_conditional(view, tables)
+
+        @wraps(view)
+        def conditional_view(request, *args, **kwargs):
+            if _bypasses_cache(request, kwargs):
+                response = view(request, *args, **kwargs)
+                add_never_cache_headers(response)
+                return response
+            key = _page_key(view, request)
+            with OSession() as session:
+                etag = quote_etag(table_versions(tables, session))
+                if (hit := _from_cache(cache.get(key), etag)) is not None:
+                    response, modified = hit
+                else:
+                    response = view(
+                        request, *args, session=session, **kwargs
+                    )
+                    if response.status_code != 200:
+                        return response
+                    entry = _cache_entry(etag, response)
+                    cache.set(key, entry)
+                    modified = entry[1]
+            return _conditional_response(request, response, etag, modified)
+
+        return conditional_view
+
+    return decorator
+
+
+def _async_conditional(view: Callable, tables) -> Callable:
+    @wraps(view)
+    async def async_conditional_view(request, *args, **kwargs):
+        if _bypasses_cache(request, kwargs):
+            response = await view(request, *args, **kwargs)
+            add_never_cache_headers(response)
+            return response
+        key = _page_key(view, request)
+        etag = quote_etag(
+            await in_session(partial(table_versions, tables))
+        )
+        if (hit := _from_cache(await cache.aget(key), etag)) is not None:
+            response, modified = hit
+        else:
+            response = await view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            entry = _cache_entry(etag, response)
+            await cache.aset(key, entry)
+            modified = entry[1]
+        return _conditional_response(request, response, etag, modified)
+
+    return async_conditional_view
@@ -1,14 +1,17 @@
 """conventional django forms module"""
+from collections import defaultdict
 import datetime as dt
 from functools import cached_property, wraps
+from itertools import chain
 from pathlib import Path
 from types import MappingProxyType as MPt
-from typing import Optional, Union
+from typing import Any, Mapping, Optional, Sequence, Union
 
 from django import forms
 from django.core.exceptions import ValidationError
 from sqlalchemy import select
 from sqlalchemy.exc import InvalidRequestError, NoResultFound
+from sqlalchemy.orm import Session, joinedload
 
 # noinspection PyUnresolvedReferences
 from viper_orchestrator.config import REQUEST_FILE_ROOT
@@ -19,6 +22,11 @@ from viper_orchestrator.exceptions import (
     AlreadyDeletedError,
 )
 from viper_orchestrator.visintent.tracking.sa_forms import JunctionForm, SAForm
+from viper_orchestrator.visintent.tracking.summaries import (
+    LDST_EVAL_FIELDS,
+    RequestStatusMixin,
+    _ldst_eval_record,
+)
 from viper_orchestrator.visintent.tracking.tables import ProtectedListEntry
 from viper_orchestrator.visintent.visintent.settings import REQUEST_FILE_URL
 from vipersci.pds.pid import vis_instruments, vis_instrument_aliases
@@ -61,7 +69,6 @@ def initialize_options(session=None):
 OPTIONS = initialize_options()
 LDST_IDS = OPTIONS["ldst_ids"]
 TAG_NAMES = OPTIONS["tags"]
-LDST_EVAL_FIELDS = ("critical", "evaluation", "evaluator", "evaluation_notes")
 
 
 def _blank_eval_info():
@@ -71,10 +78,6 @@ def _blank_eval_info():
     }
 
 
-def _ldst_eval_record(row: JuncImageRequestLDST):
-    return {f: getattr(row, f) for f in LDST_EVAL_FIELDS} | {"relevant": True}
-
-
 def _blank_ldst_hypotheses():
     return {hyp: {"relevant": False, "critical": False} for hyp in LDST_IDS}
 
@@ -354,6 +357,7 @@ class VerificationForm(JunctionForm):
                 "pivot": ("image_record_id", "rec_id"),
                 "junc_pivot": "image_tag_id",
                 "junc_instance_spec_key": "image_tag",
+                "target_lookup": "name",
                 "self_attr": "image_record",
                 "form_field": "image_tags",
             }
@@ -370,13 +374,14 @@ class VerificationForm(JunctionForm):
     @autosession
     def _construct_image_tag_attrs(self, session=None):
         """construct JuncImageRecordTag attrs from form content"""
-        for tag in self.cleaned_data["image_tags"]:
-            attrs = {
-                "image_tag": session.scalars(
-                    select(ImageTag).where(ImageTag.name == tag)
-                ).one()
-            }
-            self.junc_specs[JuncImageRecordTag].append(attrs)
+        names = self.cleaned_data["image_tags"]
+        tags = self.resolve_targets(
+            JuncImageRecordTag, names, session=session
+        )
+        for name in names:
+            self.junc_specs[JuncImageRecordTag].append(
+                {"image_tag": tags[name]}
+            )
 
     def clean(self):
         super().clean()
@@ -399,7 +404,127 @@ class VerificationForm(JunctionForm):
     verified: bool
 
 
-class RequestForm(JunctionForm):
+class BulkVerification:
+    """
+    VIS verification of many images at once. not a Django form: entries
+    arrive as JSON, each a mapping with keys 'rec_id', 'verified' (true or
+    false), and optionally 'tags' (a list of ImageTag names) and 'notes'.
+    given tags or notes replace the record's current ones; omitted ones are
+    left alone. entries are validated by the same rules as VerificationForm.
+
+    validation makes three queries however many entries there are, and
+    commit() writes all of them in one transaction. use the same Session
+    for both.
+    """
+
+    def __init__(self, entries: Sequence[Mapping[str, Any]]):
+        self.entries = entries
+        self.errors: dict[str, list[str]] = defaultdict(list)
+        self.cleaned: Optional[dict[int, Mapping[str, Any]]] = None
+        self.records: dict[int, ImageRecord] = {}
+        self.tags: dict[str, ImageTag] = {}
+        # rec_id -> image_tag_id -> junction row
+        self.junc_rows: dict[int, dict[int, JuncImageRecordTag]] = {}
+
+    def _check_entry(self, i: int, entry: Any) -> Optional[int]:
+        """check an entry's shape, returning its rec_id if it's ok."""
+        key = f"entry {i}"
+        try:
+            rec_id = int(entry["rec_id"])
+        except (KeyError, TypeError, ValueError):
+            self.errors[key].append("rec_id must be an integer")
+            return None
+        if not isinstance(entry.get("verified"), bool):
+            self.errors[key].append("verified must be true or false")
+        tags = entry.get("tags", [])
+        if not (
+            isinstance(tags, list) and all(isinstance(t, str) for t in tags)
+        ):
+            self.errors[key].append("tags must be a list of tag names")
+        if not isinstance(entry.get("notes", ""), str):
+            self.errors[key].append("notes must be a string")
+        return None if key in self.errors else rec_id
+
+    def clean(self, session: Session):
+        entries = {}
+        for i, entry in enumerate(self.entries):
+            if (rec_id := self._check_entry(i, entry)) is None:
+                continue
+            if rec_id in entries:
+                self.errors[str(rec_id)].append("duplicate entry")
+            entries[rec_id] = entry
+        self.records = {
+            r.id: r
+            for r in session.scalars(
+                select(ImageRecord).where(ImageRecord.id.in_(entries))
+            )
+        }
+        names = set(
+            chain.from_iterable(e.get("tags", []) for e in entries.values())
+        )
+        self.tags = {
+            t.name: t
+            for t in session.scalars(
+                select(ImageTag).where(ImageTag.name.in_(names))
+            )
+        }
+        self.junc_rows = defaultdict(dict)
+        for row in session.scalars(
+            select(JuncImageRecordTag)
+            .where(JuncImageRecordTag.image_record_id.in_(self.records))
+            .options(joinedload(JuncImageRecordTag.image_tag))
+        ):
+            self.junc_rows[row.image_record_id][row.image_tag_id] = row
+        for rec_id, entry in entries.items():
+            if (record := self.records.get(rec_id)) is None:
+                self.errors[str(rec_id)].append(
+                    f"no ImageRecord with id {rec_id} exists"
+                )
+                continue
+            unknown = set(entry.get("tags", [])) - self.tags.keys()
+            if len(unknown) > 0:
+                self.errors[str(rec_id)].append(
+                    f"unknown tag(s): {', '.join(sorted(unknown))}"
+                )
+            if entry["verified"] is True:
+                continue
+            existing = self.junc_rows[rec_id].values()
+            tags = entry.get("tags", [r.image_tag.name for r in existing])
+            notes = entry.get("notes", record.verification_notes)
+            if len(tags) == 0 and not notes:
+                self.errors[str(rec_id)].append(
+                    "give tags or notes to mark bad"
+                )
+        self.cleaned = entries
+
+    def is_valid(self, session: Session) -> bool:
+        if self.cleaned is None:
+            self.clean(session)
+        return len(self.errors) == 0
+
+    def commit(self, session: Session):
+        if not self.is_valid(session):
+            raise ValueError("cannot commit invalid verifications")
+        for rec_id, entry in self.cleaned.items():
+            record = self.records[rec_id]
+            record.verified = entry["verified"]
+            if "notes" in entry:
+                record.verification_notes = entry["notes"]
+            if "tags" not in entry:
+                continue
+            wanted = {self.tags[name].id for name in entry["tags"]}
+            existing = self.junc_rows[rec_id]
+            for tag_id, row in existing.items():
+                if tag_id not in wanted:
+                    session.delete(row)
+            session.add_all(
+                JuncImageRecordTag(image_record_id=rec_id, image_tag_id=t)
+                for t in wanted - existing.keys()
+            )
+        session.commit()
+
+
+class RequestForm(RequestStatusMixin, JunctionForm):
     """form for submitting or editing an image request."""
 
     def __init__(
@@ -452,33 +577,6 @@ class RequestForm(JunctionForm):
             r._pid: r.verified for r in self.image_request.image_records
         }
 
-    @property
-    def acquired(self):
-        return len(self.image_request.image_records) > 0
-
-    @property
-    def pending_vis(self):
-        return (
-            self.acquired
-            and any(v is None for v in self.verification_status.values())
-        )
-
-    @property
-    def verification_code(self):
-        if len(self.verification_status) == 0:
-            return "no images"
-        if all(v is None for v in self.verification_status.values()):
-            return "none"
-        if self.pending_vis:
-            return "partial"
-        if all(v is True for v in self.verification_status.values()):
-            return "full (passed)"
-        if all(v is True for v in self.verification_status.values()):
-            return "full (passed)"
-        if all(v is False for v in self.verification_status.values()):
-            return "full (failed)"
-        return "full (mixed)"
-
     def filepaths(self):
         # TODO, maybe: is this pathing a little sketchy?
         try:
@@ -546,49 +644,6 @@ class RequestForm(JunctionForm):
         }
         return self._eval_info
 
-    @property
-    def critical_hypotheses(self):
-        return [k for k, v in self.eval_info.items() if v['critical'] is True]
-
-    @property
-    def is_critical(self):
-        return len(self.critical_hypotheses) > 0
-
-    @property
-    def evaluation_possible(self):
-        if not self.acquired:
-            return False
-        if self.pending_vis:
-            return False
-        return True
-
-    @property
-    def pending_evaluations(self):
-        if not self.evaluation_possible:
-            return {}
-        return [
-            hyp for hyp, status in self.eval_info.items()
-            if (status['critical'] is True) and (status['evaluation'] is None)
-        ]
-
-    @property
-    def pending_eval(self):
-        return len(self.pending_evaluations) > 0
-
-    @property
-    def ecode(self):
-        if len(self.verification_status) == 0:
-            return "unfulfilled"
-        if not self.is_critical:
-            return "no critical LDST"
-        if self.pending_vis:
-            return "pending VIS"
-        if len(self.pending_evaluations) == 0:
-            return "full"
-        if len(self.pending_evaluations) == len(self.critical_hypotheses):
-            return "none"
-        return "partial"
-
     # TODO: cut this in a clean way
     def _populate_from_junc_image_request_ldst(self, junc_rows):
         pass
@@ -777,12 +832,18 @@ class RequestForm(JunctionForm):
     @autosession
     def _construct_ldst_specs(self, session=None):
         """construct JuncImageRequestLDST attrs from form content"""
-        for hyp, qualities in self.ldst_hypotheses.items():
-            if qualities["relevant"] is False:
-                continue
+        relevant = {
+            hyp: qualities
+            for hyp, qualities in self.ldst_hypotheses.items()
+            if qualities["relevant"] is not False
+        }
+        hypotheses = self.resolve_targets(
+            JuncImageRequestLDST, relevant.keys(), session=session
+        )
+        for hyp, qualities in relevant.items():
             attrs = {
                 "critical": qualities["critical"],
-                "ldst": get_one(LDST, hyp, session=session),
+                "ldst": hypotheses[hyp],
             }
             self.junc_specs[JuncImageRequestLDST].append(attrs)
 
@@ -0,0 +1,48 @@
+"""
+middleware that counts and times the SQL queries made while handling each
+request (see db.instrumentation). active only if QUERY_INSTRUMENTATION is
+True. adds X-Query-Count, X-Query-Time (ms), and X-Query-Max-Repeats
+headers to every response and logs a summary of each request's queries to
+QUERY_LOG_FILE. a high X-Query-Max-Repeats usually means an N+1 pattern.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+
+from viper_orchestrator.config import QUERY_INSTRUMENTATION
+from viper_orchestrator.db.instrumentation import (
+    QueryStats,
+    log_query_summary,
+    measure_queries,
+)
+
+
+def _annotate(request, response, stats: QueryStats):
+    response["X-Query-Count"] = str(stats.count)
+    response["X-Query-Time"] = f"{stats.seconds * 1000:.1f}"
+    response["X-Query-Max-Repeats"] = str(stats.max_repeats)
+    log_query_summary(f"view:{request.path}", stats)
+    return response
+
+
+class QueryCountMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if QUERY_INSTRUMENTATION is False:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with measure_queries() as stats:
+            response = self.get_response(request)
+        return _annotate(request, response, stats)
+
+    async def __acall__(self, request):
+        with measure_queries() as stats:
+            response = await self.get_response(request)
+        return _annotate(request, response, stats)
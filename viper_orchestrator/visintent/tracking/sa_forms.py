@@ -6,7 +6,7 @@ classes will raise NotImplementedErrors.
 """
 from collections import defaultdict
 from functools import cached_property
-from typing import Mapping, Optional
+from typing import Any, Collection, Mapping, Optional
 
 from cytoolz import keyfilter
 from django import forms
@@ -15,7 +15,7 @@ from sqlalchemy.exc import NoResultFound, InvalidRequestError
 from sqlalchemy.orm import Session, object_session
 
 from viper_orchestrator.db.session import autosession
-from viper_orchestrator.db.table_utils import get_one, pk
+from viper_orchestrator.db.table_utils import get_one, pk, pk_value
 from viper_orchestrator.utils import get_argnames
 from viper_orchestrator.orchtypes import AppTable, JuncRow, JuncRule
 
@@ -155,33 +155,53 @@ class JunctionForm(SAForm):
         rel['existing'] = session.scalars(exist_selector).all()
         return rel['existing']
 
-    @staticmethod
-    def _check_row_against_specs(adict, junc_row, rules, specs):
-        matches = []
-        for i, s in specs.items():
-            if (row := s.get(rules['junc_instance_spec_key'])) is None:
-                return
-            row_pk = getattr(row, pk(row))
-            if row_pk == getattr(junc_row, rules['junc_pivot']):
-                matches.append((i, s))
-        # mark table entries not specified in this form for deletion,
-        # unless the form is only for updates and/or single inserts
-        if len(matches) == 0:
-            # TODO, maybe: remove this special-case stuff
-            if rules.get('update_only') or rules.get('never_delete'):
-                return
-            adict['missing'].append(junc_row)
-        elif len(matches) > 1:
-            raise InvalidRequestError(
-                "Only one matching row is expected here; table "
-                "contents appear invalid"
+    @autosession
+    def resolve_targets(
+        self,
+        table: type[JuncRow],
+        keys: Collection[Any],
+        *,
+        session: Optional[Session] = None,
+    ) -> dict[Any, AppTable]:
+        """
+        fetch the target rows of a junction table in one query, keyed by
+        rules['target_lookup'] (the target's primary key by default). raises
+        NoResultFound if any are missing.
+        """
+        target = self.junc_rules[table]["target"]
+        lookup = self.junc_rules[table].get("target_lookup", pk(target))
+        keys = set(keys)
+        if len(keys) == 0:
+            return {}
+        rows = session.scalars(
+            select(target).where(getattr(target, lookup).in_(keys))
+        ).all()
+        found = {getattr(row, lookup): row for row in rows}
+        if len(missing := keys.difference(found)) > 0:
+            raise NoResultFound(
+                f"No {target.__name__} with {lookup}(s): "
+                f"{', '.join(map(str, sorted(missing)))}"
             )
-        # update fields of existing, specified table entries
-        else:
-            for attr, val in matches[0][1].items():
-                setattr(junc_row, attr, val)
-            adict['present'].append(junc_row)
-            specs.pop(matches[0][0])
+        return found
+
+    @staticmethod
+    def _index_specs(specs: list[dict], rules: JuncRule):
+        """
+        split specs into those that identify a target row, keyed by that
+        row's primary key, and those that don't.
+        """
+        keyed, unkeyed = {}, []
+        for spec in specs:
+            if (row := spec.get(rules["junc_instance_spec_key"])) is None:
+                unkeyed.append(spec)
+                continue
+            if (key := pk_value(row)) in keyed:
+                raise InvalidRequestError(
+                    "Only one matching row is expected here; table "
+                    "contents appear invalid"
+                )
+            keyed[key] = spec
+        return keyed, unkeyed
 
     def _build_commit(self, table, *, session):
         rel = self._relations[table]
@@ -189,13 +209,24 @@ class JunctionForm(SAForm):
             object_session(r) is session for r in rel.get('existing', [])
         ):
             rel['existing'] = self.get_relations(table, session=session)
-        specs = {i: s for i, s in enumerate(self.junc_specs[table])}
         rules = self.junc_rules[table]
+        specs, unkeyed = self._index_specs(self.junc_specs[table], rules)
         adict = defaultdict(list, {'existing': rel['existing']})
         for junc_row in adict['existing']:
-            self._check_row_against_specs(adict, junc_row, rules, specs)
+            spec = specs.pop(getattr(junc_row, rules['junc_pivot']), None)
+            # mark table entries not specified in this form for deletion,
+            # unless the form is only for updates and/or single inserts
+            if spec is None:
+                # TODO, maybe: remove this special-case stuff
+                if not (rules.get('update_only') or rules.get('never_delete')):
+                    adict['missing'].append(junc_row)
+                continue
+            # update fields of existing, specified table entries
+            for attr, val in spec.items():
+                setattr(junc_row, attr, val)
+            adict['present'].append(junc_row)
         # leftover specs are new table entries
-        if len(specs) > 0:
+        if len(leftover := [*specs.values(), *unkeyed]) > 0:
             # TODO, maybe: remove this special-case stuff
             # for forms that are only used to update existing table entries
             if rules.get('update_only') is True:
@@ -205,7 +236,7 @@ class JunctionForm(SAForm):
                 )
             # note: shouldn't need to set self_attr on existing junc rows
             row = self.get_row(session)
-            for s in specs.values():
+            for s in leftover:
                 junc_row = table()
                 # TODO, maybe: sloppy?
                 for attr, val in s.items():
@@ -0,0 +1,322 @@
+"""
+precomputed verification / evaluation summaries of ImageRequests (see
+tables.RequestSummary), so that pages listing many requests can read their
+status directly rather than constructing a RequestForm for each one.
+
+importing this module registers Session event hooks that note which
+requests each flush affects -- via an ImageRecord's 'verified' value or
+request assignment, or via a JuncImageRequestLDST row -- and rewrite their
+summaries in the same transaction. summaries that are missing (e.g. for
+requests that predate the table) are filled in by request_summaries().
+writes that bypass the ORM unit of work (bulk UPDATEs, other programs) are
+not noticed; run rebuild_request_summaries() after making any.
+"""
+from collections import defaultdict
+from itertools import chain
+from typing import Collection, Optional
+
+from sqlalchemy import Connection, delete, event, inspect, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from viper_orchestrator.db import OSession
+from viper_orchestrator.db.session import autosession
+from viper_orchestrator.visintent.tracking.tables import RequestSummary
+from vipersci.vis.db.image_records import ImageRecord
+from vipersci.vis.db.image_requests import ImageRequest
+from vipersci.vis.db.junc_image_req_ldst import JuncImageRequestLDST
+from vipersci.vis.db.ldst import LDST
+
+LDST_EVAL_FIELDS = ("critical", "evaluation", "evaluator", "evaluation_notes")
+# RequestStatusMixin properties stored in RequestSummary
+STATUS_COLUMNS = (
+    "verification_code",
+    "ecode",
+    "acquired",
+    "is_critical",
+    "pending_vis",
+    "pending_eval",
+    "evaluation_possible",
+    "pending_evaluations",
+)
+# ImageRecord attributes that feed into its request's summary
+_RECORD_ATTRS = ("verified", "image_request_id", "image_request")
+_STALE_KEY = "stale_request_summaries"
+
+
+def _ldst_eval_record(row: JuncImageRequestLDST):
+    return {f: getattr(row, f) for f in LDST_EVAL_FIELDS} | {"relevant": True}
+
+
+class RequestStatusMixin:
+    """
+    derived verification and evaluation status of an image request.
+    subclasses must provide verification_status (ImageRecord pid -> value of
+    'verified') and eval_info (LDST hypothesis -> evaluation record).
+    """
+
+    verification_status: dict[str, Optional[bool]]
+    eval_info: dict[str, dict]
+
+    @property
+    def acquired(self):
+        return len(self.verification_status) > 0
+
+    @property
+    def pending_vis(self):
+        return (
+            self.acquired
+            and any(v is None for v in self.verification_status.values())
+        )
+
+    @property
+    def verification_code(self):
+        if len(self.verification_status) == 0:
+            return "no images"
+        if all(v is None for v in self.verification_status.values()):
+            return "none"
+        if self.pending_vis:
+            return "partial"
+        if all(v is True for v in self.verification_status.values()):
+            return "full (passed)"
+        if all(v is False for v in self.verification_status.values()):
+            return "full (failed)"
+        return "full (mixed)"
+
+    @property
+    def critical_hypotheses(self):
+        return [k for k, v in self.eval_info.items() if v['critical'] is True]
+
+    @property
+    def is_critical(self):
+        return len(self.critical_hypotheses) > 0
+
+    @property
+    def evaluation_possible(self):
+        if not self.acquired:
+            return False
+        if self.pending_vis:
+            return False
+        return True
+
+    @property
+    def pending_evaluations(self):
+        if not self.evaluation_possible:
+            return {}
+        return [
+            hyp for hyp, status in self.eval_info.items()
+            if (status['critical'] is True) and (status['evaluation'] is None)
+        ]
+
+    @property
+    def pending_eval(self):
+        return len(self.pending_evaluations) > 0
+
+    @property
+    def ecode(self):
+        if len(self.verification_status) == 0:
+            return "unfulfilled"
+        if not self.is_critical:
+            return "no critical LDST"
+        if self.pending_vis:
+            return "pending VIS"
+        if len(self.pending_evaluations) == 0:
+            return "full"
+        if len(self.pending_evaluations) == len(self.critical_hypotheses):
+            return "none"
+        return "partial"
+
+
+class RequestStatus(RequestStatusMixin):
+    """RequestStatusMixin over plain values rather than a RequestForm."""
+
+    def __init__(
+        self,
+        verification_status: dict[str, Optional[bool]],
+        eval_info: dict[str, dict],
+    ):
+        self.verification_status = verification_status
+        self.eval_info = eval_info
+
+
+def summarize_requests(
+    req_ids: Collection[int], connection: Connection
+) -> list[dict]:
+    """
+    RequestSummary values for those of req_ids that identify extant
+    ImageRequests. makes three queries regardless of len(req_ids).
+    """
+    extant = connection.scalars(
+        select(ImageRequest.id).where(ImageRequest.id.in_(req_ids))
+    ).all()
+    if len(extant) == 0:
+        return []
+    records = defaultdict(list)
+    for row in connection.execute(
+        select(
+            ImageRecord.image_request_id,
+            ImageRecord.id,
+            ImageRecord._pid,
+            ImageRecord.verified,
+        )
+        .where(ImageRecord.image_request_id.in_(extant))
+        .order_by(ImageRecord.id)
+    ):
+        records[row[0]].append(row[1:])
+    blank = {f: None for f in LDST_EVAL_FIELDS} | {"relevant": False}
+    hypotheses = connection.scalars(select(LDST.id)).all()
+    evals = defaultdict(lambda: {hyp: blank.copy() for hyp in hypotheses})
+    junc = JuncImageRequestLDST
+    for row in connection.execute(
+        select(
+            junc.image_request_id,
+            junc.ldst_id,
+            *(getattr(junc, f) for f in LDST_EVAL_FIELDS),
+        ).where(junc.image_request_id.in_(extant))
+    ):
+        evals[row.image_request_id][row.ldst_id] = _ldst_eval_record(row)
+    summaries = []
+    for req_id in extant:
+        status = RequestStatus(
+            {pid: verified for _, pid, verified in records[req_id]},
+            evals[req_id],
+        )
+        summaries.append(
+            {"req_id": req_id}
+            | {c: getattr(status, c) for c in STATUS_COLUMNS}
+            | {
+                "rec_ids": [rec_id for rec_id, _, _ in records[req_id]],
+                "rec_pids": [pid for _, pid, _ in records[req_id]],
+                "eval_info": status.eval_info,
+            }
+        )
+    return summaries
+
+
+def refresh_request_summaries(
+    req_ids: Collection[Optional[int]],
+    connection: Connection,
+    overwrite: bool = True,
+):
+    """
+    recompute the summaries of the ImageRequests with ids in req_ids, and
+    delete those of requests that no longer exist. if overwrite is False,
+    only write missing summaries. does not commit.
+
+    locks the requests' rows until the transaction ends before summarizing
+    them, so that a concurrent refresh waits for this one to commit and
+    then summarizes its changes too, rather than overwriting this summary
+    with one computed without them.
+    """
+    req_ids = {i for i in req_ids if i is not None}
+    if len(req_ids) == 0:
+        return
+    # in id order, so that concurrent refreshes can't deadlock each other
+    connection.execute(
+        select(ImageRequest.id)
+        .where(ImageRequest.id.in_(req_ids))
+        .order_by(ImageRequest.id)
+        .with_for_update()
+    )
+    summaries = summarize_requests(req_ids, connection)
+    if len(gone := req_ids - {s["req_id"] for s in summaries}) > 0:
+        connection.execute(
+            delete(RequestSummary).where(RequestSummary.req_id.in_(gone))
+        )
+    if len(summaries) == 0:
+        return
+    statement = pg_insert(RequestSummary).values(summaries)
+    if overwrite is False:
+        # a concurrent writer's summary is at least as fresh as ours
+        statement = statement.on_conflict_do_nothing()
+    else:
+        statement = statement.on_conflict_do_update(
+            index_elements=[RequestSummary.req_id],
+            set_={
+                c: statement.excluded[c]
+                for c in summaries[0].keys()
+                if c != "req_id"
+            },
+        )
+    connection.execute(statement)
+
+
+@autosession
+def request_summaries(
+    req_ids: Optional[Collection[int]] = None, session=None
+) -> dict[int, RequestSummary]:
+    """
+    get summaries keyed by request id, for all ImageRequests by default.
+    missing summaries are computed and committed in a separate Session, so
+    this never commits (or expires) `session`.
+    """
+    summary_selector = select(RequestSummary)
+    request_selector = select(ImageRequest.id)
+    if req_ids is not None:
+        summary_selector = summary_selector.where(
+            RequestSummary.req_id.in_(req_ids)
+        )
+        request_selector = request_selector.where(
+            ImageRequest.id.in_(req_ids)
+        )
+    summaries = {s.req_id: s for s in session.scalars(summary_selector)}
+    missing = set(session.scalars(request_selector)) - summaries.keys()
+    if len(missing) == 0:
+        return summaries
+    with OSession() as filler:
+        refresh_request_summaries(
+            missing, filler.connection(), overwrite=False
+        )
+        filler.commit()
+    return summaries | {
+        s.req_id: s
+        for s in session.scalars(
+            select(RequestSummary).where(RequestSummary.req_id.in_(missing))
+        )
+    }
+
+
+@autosession
+def rebuild_request_summaries(session=None):
+    """recompute all request summaries."""
+    connection = session.connection()
+    connection.execute(delete(RequestSummary))
+    refresh_request_summaries(
+        connection.scalars(select(ImageRequest.id)).all(), connection
+    )
+    session.commit()
+
+
+def _affected_requests(session: Session) -> set[int]:
+    """ids of requests whose summaries a pending flush will change."""
+    affected = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, ImageRequest) and obj not in session.dirty:
+            affected.add(obj.id)
+        elif isinstance(obj, JuncImageRequestLDST):
+            affected.add(obj.image_request_id)
+        elif isinstance(obj, ImageRecord):
+            attrs = inspect(obj).attrs
+            changed = [attrs[a].history for a in _RECORD_ATTRS]
+            if obj in session.dirty and not any(
+                h.has_changes() for h in changed
+            ):
+                continue
+            affected.add(obj.image_request_id)
+            # former requests of reassigned records
+            for old in chain(changed[1].deleted, changed[2].deleted):
+                affected.add(old.id if isinstance(old, ImageRequest) else old)
+    return affected - {None}
+
+
+@event.listens_for(Session, "after_flush")
+def _note_stale_summaries(session: Session, _flush_context):
+    session.info.setdefault(_STALE_KEY, set()).update(
+        _affected_requests(session)
+    )
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _refresh_stale_summaries(session: Session, _flush_context):
+    if len(stale := session.info.pop(_STALE_KEY, set())) > 0:
+        refresh_request_summaries(stale, session.connection())
@@ -4,7 +4,12 @@ than the django ORM for compatibility with vipersci.
 """
 from __future__ import annotations
 
+from collections import defaultdict
+from typing import Collection
+
 from sqlalchemy import (
+    JSON,
+    Boolean,
     DateTime,
     Identity,
     Integer,
@@ -211,9 +216,64 @@ class ProtectedListEntry(IntentBase):
             "start_time": record.start_time,
         }
 
+    @staticmethod
+    @autosession
+    def populate_many(entries: Collection[ProtectedListEntry], session=None):
+        """
+        fill in matching products and supersession for many entries with one
+        query, rather than two per entry.
+        """
+        candidates = defaultdict(list)
+        for rec in session.scalars(
+            select(ImageRecord).where(
+                ImageRecord.image_id.in_({e.image_id for e in entries})
+            )
+        ):
+            candidates[rec.image_id].append(rec)
+        for entry in entries:
+            products = [
+                r for r in candidates[entry.image_id]
+                if r.instrument_name == entry.instrument_name
+                and r.start_time == entry.start_time
+            ]
+            entry._has_lossless = has_lossless(products)
+            entry._matching_pids = tuple(p.product_id for p in products)
+            entry._matching_products = products
+            entry._superseded = any(
+                r.instrument_name in CCU_REVERSE_HASH[entry.ccu]
+                and r.start_time > entry.start_time
+                for r in candidates[entry.image_id]
+            )
+
     _superseded = None
     _has_lossless = None
     _matching_pids = None
     _matching_products = None
 
 
+
+
+class RequestSummary(IntentBase):
+    """
+    derived verification / evaluation state of an ImageRequest, as reported
+    by RequestForm. maintained by tracking.summaries whenever an associated
+    ImageRecord or JuncImageRequestLDST row changes, so that list and review
+    pages don't need to construct a RequestForm for every request.
+    """
+
+    __tablename__ = "request_summary"
+    # not a foreign key: image_requests belongs to another MetaData
+    req_id = mapped_column(Integer, primary_key=True, doc="ImageRequest id")
+    verification_code = mapped_column(String, nullable=False)
+    ecode = mapped_column(String, nullable=False)
+    acquired = mapped_column(Boolean, nullable=False)
+    is_critical = mapped_column(Boolean, nullable=False)
+    pending_vis = mapped_column(Boolean, nullable=False)
+    pending_eval = mapped_column(Boolean, nullable=False)
+    evaluation_possible = mapped_column(Boolean, nullable=False)
+    pending_evaluations = mapped_column(JSON, nullable=False)
+    rec_ids = mapped_column(JSON, nullable=False, doc="ImageRecord ids")
+    rec_pids = mapped_column(JSON, nullable=False, doc="ImageRecord pids")
+    eval_info = mapped_column(
+        JSON, nullable=False, doc="RequestForm.eval_info"
+    )
@@ -2,23 +2,30 @@
 
 from django.urls import path, re_path
 
-from viper_orchestrator.visintent.tracking import views
+from viper_orchestrator.visintent.tracking import async_views, views
 from vipersci.pds.pid import vis_pid_re
 
 urlpatterns = [
     path("imagerequest", views.imagerequest, name="imagerequest"),
     path("submitrequest", views.submitrequest, name="submitrequest"),
-    path("images", views.imagelist, name="images"),
-    path("requestlist", views.requestlist, name="requestlist"),
+    path("images", async_views.imagelist, name="images"),
+    path("requestlist", async_views.requestlist, name="requestlist"),
     path("assign_record", views.assign_record, name="assign_record"),
     path("plrequest", views.plrequest, name="plrequest"),
     path("submitplrequest", views.submitplrequest, name="submitplrequest"),
-    path("pllist", views.pllist, name="protectedlist"),
+    path("pllist", async_views.pllist, name="protectedlist"),
     path("", views.pages, name="landing"),
     path("pages", views.pages, name="pages"),
     path("submitverification", views.submitverification, name="verification"),
+    path(
+        "submitverifications",
+        views.submitverifications,
+        name="bulk_verification",
+    ),
     path("submitevaluation", views.submitevaluation, name="evaluation"),
-    re_path(f"^{vis_pid_re.pattern}", views.imageview, name="image"),
-    path("review", views.review, name="review"),
-    path("ldst", views.ldst, name="ldst"),
+    re_path(f"^{vis_pid_re.pattern}", async_views.imageview, name="image"),
+    path("review", async_views.review, name="review"),
+    path("ldst", async_views.ldst, name="ldst"),
+    path("lighttimeline", views.lighttimeline, name="lighttimeline"),
+    path("export/<str:name>", views.export, name="export"),
 ]
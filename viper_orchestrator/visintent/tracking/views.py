@@ -1,12 +1,15 @@
 """django view functions and helpers."""
+import asyncio
+import datetime as dt
 import json
 import shutil
 from collections import defaultdict
-from typing import Optional
+from typing import AsyncIterator, Generator, Optional
 
 from cytoolz import groupby, valmap
+from django.core.handlers.asgi import ASGIRequest
 from django.core.handlers.wsgi import WSGIRequest
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.views.decorators.cache import never_cache
 from sqlalchemy import select
@@ -14,40 +17,69 @@ from sqlalchemy.exc import NoResultFound, MultipleResultsFound
 from sqlalchemy.orm import Session
 
 # noinspection PyUnresolvedReferences
-from viper_orchestrator.config import DATA_ROOT, PRODUCT_ROOT
+from viper_orchestrator.config import PRODUCT_ROOT
+from viper_orchestrator.products import (
+    browse_relpath,
+    data_relpath,
+    read_label,
+)
+from viper_orchestrator.db.exports import CONTENT_TYPES, export_chunks
 from viper_orchestrator.db.session import autosession
 from viper_orchestrator.db.table_utils import (
-    get_one, iterquery, )
+    get_one, iterkeyset, )
+from viper_orchestrator.db.utility_tables import (
+    LUMINAIRE_BITS,
+    LightTransition,
+    light_transitions,
+)
 from viper_orchestrator.exceptions import (
     AlreadyDeletedError,
     AlreadyLosslessError,
     BadURLError,
 )
 from viper_orchestrator.orchtypes import DjangoResponseType
+from viper_orchestrator.visintent.tracking.caching import conditional_page
 from viper_orchestrator.visintent.tracking.forms import (
     AssignRecordForm,
+    BulkVerification,
     PLSubmission,
     RequestForm,
     VerificationForm, EvaluationForm, )
 from viper_orchestrator.visintent.tracking.forms import (
     request_supplementary_path,
 )
+from viper_orchestrator.visintent.tracking.summaries import (
+    request_summaries,
+)
 from viper_orchestrator.visintent.tracking.tables import (
     CCU_HASH,
     ProtectedListEntry,
 )
 from viper_orchestrator.visintent.tracking.vis_db_structures import \
     req_info_record, ldst_status_dict, review_info_dict, rec_file_links, \
-    protected_list_record, image_rec_brief
+    protected_list_record, image_rec_brief, verification_review_state
 from viper_orchestrator.visintent.visintent.settings import (
     BROWSE_URL,
     DATA_URL,
 )
 from vipersci.vis.db.image_records import ImageRecord
 from vipersci.vis.db.image_requests import ImageRequest, Status
+from vipersci.vis.db.image_tags import ImageTag
+from vipersci.vis.db.junc_image_record_tags import JuncImageRecordTag
+from vipersci.vis.db.junc_image_req_ldst import JuncImageRequestLDST
+
+# tables whose contents determine how image requests are displayed.
+# imageview also shows each record's tags.
+REQUEST_TABLES = (
+    ImageRequest,
+    ImageRecord,
+    ImageTag,
+    JuncImageRecordTag,
+    JuncImageRequestLDST,
+)
 
 
-@never_cache
+@conditional_page(*REQUEST_TABLES)
 @autosession
 def imageview(
     request: WSGIRequest,
@@ -57,6 +89,19 @@ def imageview(
     pid=None,
     rec_id=None,
     **_regex_kwargs,
+) -> HttpResponse:
+    return render_imageview(
+        request, session, assign_record_form, verification_form, pid, rec_id
+    )
+
+
+def render_imageview(
+    request: WSGIRequest,
+    session: Session,
+    assign_record_form=None,
+    verification_form=None,
+    pid=None,
+    rec_id=None,
 ) -> HttpResponse:
     try:
         if rec_id is not None:
@@ -70,9 +115,7 @@ def imageview(
         return HttpResponse(
             f"No image in the database has {suffix}.", status=404,
         )
-    label_path_stub = record.file_path.replace(".tif", ".json")
-    with (DATA_ROOT / label_path_stub).open() as stream:
-        metadata = json.load(stream)
+    metadata = read_label(record._pid)
     metadata["verified"] = record.verified
     metadata['verification_notes'] = record.verification_notes
     metadata['id'] = record.id
@@ -81,9 +124,7 @@ def imageview(
     else:
         req_id = record.image_request.id
         request_url = f"imagerequest?req_id={req_id}&editing=True"
-        ecode = RequestForm(
-            image_request=get_one(ImageRequest, req_id, session=session)
-        ).ecode
+        ecode = request_summaries([req_id], session=session)[req_id].ecode
         # these will usually be None in the on-disk labels
         metadata["image_request_id"] = req_id
     if assign_record_form is None:
@@ -99,12 +140,10 @@ def imageview(
         "image_view.html",
         {
             "assign_record_form": assign_record_form,
-            "browse_url": (
-                BROWSE_URL + record.file_path.replace(".tif", "_browse.jpg")
-            ),
+            "browse_url": BROWSE_URL + str(browse_relpath(record._pid)),
             "ecode": ecode,
-            "image_url": DATA_URL + record.file_path,
-            "label_url": DATA_URL + label_path_stub,
+            "image_url": DATA_URL + str(data_relpath(record._pid)),
+            "label_url": DATA_URL + str(data_relpath(record._pid, ".json")),
             "metadata": metadata,
             "pid": record._pid,
             "rec_id": record.id,
@@ -168,9 +207,9 @@ def imagerequest(
         "redirect_from_success": redirect_from_success,
         "live_form_state": request.POST.get("live_form_state", "{}")
     }
-    if request_form.image_request is not None:
+    if (req := request_form.image_request) is not None:
         context["req_info_json"] = json.dumps(
-            req_info_record(request_form.image_request)[0]
+            req_info_record(req, request_summaries([req.id])[req.id])
         )
     else:
         context["req_info_json"] = "{}"
@@ -202,7 +241,9 @@ def imagerequest(
 def submitverification(
     request: WSGIRequest, session: Optional[Session] = None
 ) -> DjangoResponseType:
-    image_record = get_one(ImageRecord, int(request.POST['rec_id']))
+    image_record = get_one(
+        ImageRecord, int(request.POST['rec_id']), session=session
+    )
     form = VerificationForm(
         request.POST, session=session, image_record=image_record
     )
@@ -214,6 +255,37 @@ def submitverification(
     return imageview(request, rec_id=request.POST['rec_id'])
 
 
+@never_cache
+@autosession
+def submitverifications(
+    request: WSGIRequest, session: Optional[Session] = None
+) -> JsonResponse:
+    """
+    verify many images in one transaction. expects a JSON body of the form
+    {"verifications": [{"rec_id": ..., "verified": ..., "tags": [...],
+    "notes": ...}, ...]} (see forms.BulkVerification), and responds with
+    the updated review state of those images and their requests, or with
+    errors keyed by entry.
+    """
+    malformed = JsonResponse(
+        {"errors": {"body": ["expected {'verifications': [...]}"]}},
+        status=400,
+    )
+    try:
+        entries = json.loads(request.body)["verifications"]
+    except (ValueError, KeyError, TypeError):
+        return malformed
+    if not isinstance(entries, list):
+        return malformed
+    form = BulkVerification(entries)
+    if not form.is_valid(session):
+        return JsonResponse({"errors": form.errors}, status=400)
+    form.commit(session)
+    return JsonResponse(
+        verification_review_state(form.cleaned.keys(), session)
+    )
+
+
 def submitevaluation(request: WSGIRequest) -> DjangoResponseType:
     form = EvaluationForm.from_wsgirequest(request)
     if form.is_valid() is False:
@@ -245,26 +317,36 @@ def submitrequest(request: WSGIRequest) -> DjangoResponseType:
     return requestlist(request, redirect_from_success=True)
 
 
-@autosession
-@never_cache
-def requestlist(request, session=None, redirect_from_success=False):
-    """prep and render list of all existing requests"""
+def request_list_records(session: Session) -> list[dict]:
     rows = session.scalars(select(ImageRequest)).all()
     rows.sort(key=lambda r: r.request_time, reverse=True)
-    records = [req_info_record(row)[0] for row in rows]
+    summaries = request_summaries(session=session)
+    return [req_info_record(row, summaries[row.id]) for row in rows]
+
+
+def requestlist_context(records: list[dict], redirect_from_success=False):
     # TODO: paginate, preferably configurably
+    return {
+        "request_json": json.dumps(records),
+        "statuses": ["all", *[s.name for s in Status]],
+        'redirect_from_success': redirect_from_success
+    }
+
+
+@conditional_page(*REQUEST_TABLES)
+@autosession
+def requestlist(request, session=None, redirect_from_success=False):
+    """prep and render list of all existing requests"""
     return render(
         request,
         "request_list.html",
-        {
-            "request_json": json.dumps(records),
-            "statuses": ["all", *[s.name for s in Status]],
-            'redirect_from_success': redirect_from_success
-        },
+        requestlist_context(
+            request_list_records(session), redirect_from_success
+        ),
     )
 
 
-@never_cache
+@conditional_page(*REQUEST_TABLES)
 @autosession
 def ldst(
     request: WSGIRequest, session: Optional[Session]
@@ -279,7 +361,7 @@ def ldst(
 
 # TODO, maybe: if there are performance issues with this as db size increases,
 #  selectively populate via Fetch API
-@never_cache
+@conditional_page(*REQUEST_TABLES)
 @autosession
 def review(
     request: WSGIRequest, session: Optional[Session]
@@ -322,7 +404,7 @@ def plrequest(request):
 
 def get_last_image_ids(session):
     last_image_ids = {0: None, 1: None}
-    for recs in iterquery(
+    for recs in iterkeyset(
             select(ImageRecord), ImageRecord.start_time, session=session
     ):
         by_ccu = groupby(lambda r: CCU_HASH[r.instrument_name], recs)
@@ -336,27 +418,39 @@ def get_last_image_ids(session):
     return last_image_ids
 
 
-@never_cache
+def protected_list_records(session: Session) -> list[dict]:
+    rows = session.scalars(select(ProtectedListEntry)).all()
+    rows.sort(key=lambda r: r.request_time, reverse=True)
+    ProtectedListEntry.populate_many(rows, session=session)
+    return [protected_list_record(row) for row in rows]
+
+
+def pllist_context(
+    records: list[dict], last_ids: dict, redirect_from_success=False
+):
+    return {
+        "pl_json": json.dumps(records),
+        "write_head": {'zero': last_ids[0], 'one': last_ids[1]},
+        "pagetitle": "Protected List Display",
+        "redirect_from_success": redirect_from_success
+    }
+
+
+@conditional_page(ImageRecord, ProtectedListEntry)
 @autosession
 def pllist(request, redirect_from_success=False, session=None):
     """
     prep and render list of all existing protected list entries, along with
     most recent downlinked image ID (memory location) for each CCU
     """
-
-    last_ids = get_last_image_ids(session)
-    rows = session.scalars(select(ProtectedListEntry)).all()
-    rows.sort(key=lambda r: r.request_time, reverse=True)
-    records = [protected_list_record(row) for row in rows]
     return render(
         request,
         "pl_display.html",
-        {
-            "pl_json": json.dumps(records),
-            "write_head": {'zero': last_ids[0], 'one': last_ids[1]},
-            "pagetitle": "Protected List Display",
-            "redirect_from_success": redirect_from_success
-        },
+        pllist_context(
+            protected_list_records(session),
+            get_last_image_ids(session),
+            redirect_from_success
+        ),
     )
 
 
@@ -380,10 +474,8 @@ def submitplrequest(request, session=None):
     return pllist(request, redirect_from_success=True)
 
 
-@never_cache
-@autosession
-def imagelist(request, session=None):
-    """prep and render list of all existing images"""
+def image_list_records(session: Session) -> dict[str, list[dict]]:
+    """brief records for all images, by instrument and under 'all'"""
     rows = session.scalars(select(ImageRecord)).all()
     # noinspection PyUnresolvedReferences
     rows.sort(key=lambda r: r.start_time, reverse=True)
@@ -392,16 +484,98 @@ def imagelist(request, session=None):
         record = image_rec_brief(row)
         records["all"].append(record)
         records[record["instrument"].split(" ")[0]].append(record)
+    return dict(records)
+
+
+def imagelist_context(records: dict[str, list[dict]]):
+    return {
+        "record_json": json.dumps(records),
+        "pagetitle": "Image List",
+        "instruments": records.keys()
+    }
+
+
+@conditional_page(ImageRecord)
+@autosession
+def imagelist(request, session=None):
+    """prep and render list of all existing images"""
     return render(
         request,
         "image_list.html",
+        imagelist_context(image_list_records(session)),
+    )
+
+
+@conditional_page(LightTransition)
+@autosession
+def lighttimeline(request, session=None) -> JsonResponse:
+    """
+    light state transitions as JSON: {"luminaires": [...], "transitions":
+    [[generation time, mask], ...]}, where bit i of each mask is the state
+    of luminaires[i]. optional ISO 8601 'start' and 'stop' query parameters
+    bound the timeline; the transition in effect at 'start' is included.
+    """
+    try:
+        start, stop = (
+            None if (t := request.GET.get(k)) is None
+            else dt.datetime.fromisoformat(t)
+            for k in ("start", "stop")
+        )
+    except ValueError as ve:
+        return JsonResponse({"errors": {"time": [str(ve)]}}, status=400)
+    return JsonResponse(
         {
-            "record_json": json.dumps(records),
-            "pagetitle": "Image List",
-            "instruments": records.keys()
-        },
+            "luminaires": list(LUMINAIRE_BITS.keys()),
+            "transitions": [
+                [gentime.isoformat(), mask]
+                for gentime, mask in light_transitions(
+                    start, stop, session=session
+                )
+            ],
+        }
     )
 
 
+async def _aiterate(chunks: Generator) -> AsyncIterator:
+    """
+    iterate over a blocking generator in worker threads, so that ASGI
+    servers stream it rather than reading it all into memory first. closes
+    the generator (releasing its database connection) even if the client
+    disconnects partway through.
+    """
+    done = object()
+    try:
+        while (
+            chunk := await asyncio.to_thread(next, chunks, done)
+        ) is not done:
+            yield chunk
+    finally:
+        await asyncio.to_thread(chunks.close)
+
+
+def export(request, name: str) -> StreamingHttpResponse | JsonResponse:
+    """
+    stream an export of a table (see db.exports.EXPORTS for names). query
+    parameters: 'format' (csv, parquet, or arrow; default csv), 'start' and
+    'stop' (ISO 8601 times), and 'instrument' (may be repeated).
+    """
+    fmt = request.GET.get("format", "csv")
+    try:
+        chunks = export_chunks(
+            name,
+            fmt,
+            request.GET.get("start"),
+            request.GET.get("stop"),
+            request.GET.getlist("instrument"),
+        )
+    except ValueError as ve:
+        return JsonResponse({"errors": {"export": [str(ve)]}}, status=400)
+    if isinstance(request, ASGIRequest):
+        chunks = _aiterate(chunks)
+    response = StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[fmt])
+    response["Content-Disposition"] = f'attachment; filename="{name}.{fmt}"'
+    return response
+
+
 def pages(request):
     return render(request, "pages.html")
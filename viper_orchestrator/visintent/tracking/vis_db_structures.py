@@ -2,14 +2,20 @@
 functions for formatting data about VIS db DeclarativeBase instances for
 exchange.
 """
-from typing import Union, MutableMapping, Any
+from typing import Any, Collection, MutableMapping, Optional, Union
 
 from dustgoggles.structures import NestingDict
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from viper_orchestrator.visintent.tracking.forms import RequestForm
-from viper_orchestrator.visintent.tracking.tables import ProtectedListEntry
+from viper_orchestrator.products import browse_relpath, data_relpath
+from viper_orchestrator.visintent.tracking.summaries import (
+    request_summaries,
+)
+from viper_orchestrator.visintent.tracking.tables import (
+    ProtectedListEntry,
+    RequestSummary,
+)
 from viper_orchestrator.visintent.visintent.settings import (
     DATA_URL,
     BROWSE_URL,
@@ -41,35 +47,37 @@ def verification_record(rec: ImageRecord) -> verificationRecord:
         "verified": rec.verified,
         "pid": rec._pid,
         "gentime": rec.yamcs_generation_time.isoformat()[:19] + "Z",
-        "req_id": None if rec.image_request is None else rec.image_request.id,
+        "req_id": rec.image_request_id,
     }
 
 
-def req_info_record(req: ImageRequest) -> tuple[reqInfoRecord, RequestForm]:
-    form = RequestForm(image_request=req)
+def req_info_record(
+    req: ImageRequest, summary: RequestSummary
+) -> reqInfoRecord:
     return {
-        "vcode": form.verification_code,
-        "ecode": form.ecode,
+        "vcode": summary.verification_code,
+        "ecode": summary.ecode,
         "status": req.status.name,
         "title": req.title,
-        "critical": form.is_critical,
-        "rec_ids": [rec.id for rec in req.image_records],
-        "rec_pids": [rec._pid for rec in req.image_records],
-        "acquired": form.acquired,
-        "pending_vis": form.pending_vis,
-        "pending_eval": form.pending_eval,
-        "evaluation_possible": form.evaluation_possible,
-        "pending_evaluations": form.pending_evaluations,
-        "edit_url": f"imagerequest?req_id={form.req_id}",
+        "critical": summary.is_critical,
+        "rec_ids": summary.rec_ids,
+        "rec_pids": summary.rec_pids,
+        "acquired": summary.acquired,
+        "pending_vis": summary.pending_vis,
+        "pending_eval": summary.pending_eval,
+        "evaluation_possible": summary.evaluation_possible,
+        "pending_evaluations": summary.pending_evaluations,
+        "edit_url": f"imagerequest?req_id={req.id}",
         "request_time": req.request_time.isoformat()[:19] + "Z",
         "justification": req.justification,
         "req_id": req.id
-    }, form
+    }
 
 
 def request_review_dict(session) -> dict[int, reqInfoRecord]:
+    summaries = request_summaries(session=session)
     return {
-        req.id: req_info_record(req)[0]
+        req.id: req_info_record(req, summaries[req.id])
         for req in session.scalars(select(ImageRequest)).all()
     }
 
@@ -111,9 +119,11 @@ def ldst_eval_summary(hyp_eval: dict, req_info: dict) -> ldstEvalSummary:
 
 def ldst_status_dict(session: Session):
     eval_by_req, eval_by_hyp, req_info = {}, NestingDict(), NestingDict()
+    summaries = request_summaries(session=session)
     for req in session.scalars(select(ImageRequest)).all():
-        req_info[req.id], form = req_info_record(req)
-        eval_by_req[req.id] = form.eval_info
+        summary = summaries[req.id]
+        req_info[req.id] = req_info_record(req, summary)
+        eval_by_req[req.id] = summary.eval_info
         for hyp, e in eval_by_req[req.id].items():
             eval_by_hyp[hyp][req.id]["relevant"] = e["relevant"]
             eval_by_hyp[hyp][req.id]["critical"] = e["critical"]
@@ -133,29 +143,62 @@ def ldst_status_dict(session: Session):
     }
 
 
-def verification_info_dict(session) -> dict[int, verificationRecord]:
+def verification_info_dict(
+    session, rec_ids: Optional[Collection[int]] = None
+) -> dict[int, verificationRecord]:
+    selector = select(ImageRecord)
+    if rec_ids is not None:
+        selector = selector.where(ImageRecord.id.in_(rec_ids))
     return {
         rec.id: verification_record(rec)
-        for rec in session.scalars(select(ImageRecord)).all()
+        for rec in session.scalars(selector).all()
     }
 
 
 def review_info_dict(session: Session):
-    verifications = verification_info_dict(session)  # verificationRecords
-    req_info = request_review_dict(session)  # reqInfoRecords
+    return merge_review_info(
+        verification_info_dict(session), request_review_dict(session)
+    )
+
+
+def merge_review_info(
+    verifications: dict[int, verificationRecord],
+    req_info: dict[int, reqInfoRecord],
+):
     for req_id, info in req_info.items():
         for rec_id in info["rec_ids"]:
+            if rec_id not in verifications:
+                continue
             verifications[rec_id]["req_id"] = req_id
             verifications[rec_id]["critical"] = info["critical"]
     return {"req_info": req_info, "verifications": verifications}
 
 
+def verification_review_state(
+    rec_ids: Collection[int], session: Session
+) -> dict[str, dict[int, sharedJSONType]]:
+    """
+    like review_info_dict, but only for the given ImageRecords and the
+    ImageRequests they belong to.
+    """
+    verifications = verification_info_dict(session, rec_ids)
+    req_ids = {v["req_id"] for v in verifications.values()} - {None}
+    summaries = request_summaries(req_ids, session=session)
+    req_info = {
+        req.id: req_info_record(req, summaries[req.id])
+        for req in session.scalars(
+            select(ImageRequest).where(ImageRequest.id.in_(req_ids))
+        )
+    }
+    return merge_review_info(verifications, req_info)
+
+
 def rec_file_links(rec: ImageRecord):
+    pid = rec.product_id
     return {
-        "image_url": DATA_URL + rec.file_path,
-        "label_url": DATA_URL + rec.file_path.replace("tif", "json"),
-        "thumbnail_url": BROWSE_URL
-        + rec.file_path.replace(".tif", "_thumb.jpg"),
+        "image_url": DATA_URL + str(data_relpath(pid)),
+        "label_url": DATA_URL + str(data_relpath(pid, ".json")),
+        "thumbnail_url": BROWSE_URL + str(browse_relpath(pid, "thumb")),
     }
 
 
@@ -1,10 +1,12 @@
 import datetime as dt
 import time
 from collections import defaultdict, deque
-from concurrent.futures import ThreadPoolExecutor, Future
+from functools import cache
 from itertools import count
 from pathlib import Path
+from queue import Empty, Full, Queue
 from random import shuffle
+from threading import Event, Lock, Thread
 from typing import (
     Literal,
     Any,
@@ -13,14 +15,13 @@ from typing import (
     Iterator,
     Callable,
     Mapping,
-    Hashable,
     MutableMapping,
 )
 
 import pandas as pd
 import viper_orchestrator.station.utilities
 from cytoolz import get_in
-from dustgoggles.structures import dig_and_edit, NestingDict
+from dustgoggles.structures import NestingDict
 from pyarrow import parquet
 
 from viper_orchestrator.yamcsutils.parameter_record_helpers import (
@@ -28,22 +29,32 @@ from viper_orchestrator.yamcsutils.parameter_record_helpers import (
 )
 
 
-def _poll_ctx(
-    cache: Mapping[str, deque],
-    parameters: Collection[str],
-    on_data: Callable,
-    delay: float,
-    signals: Mapping[Hashable, int],
-    thread_id: Hashable,
-):
-    """poll a cache representing a yamcs server websocket."""
-    while True:
-        if signals[thread_id] != 0:
-            return
-        for param in parameters:
-            while len(cache[param]) > 0:
-                on_data(cache[param].popleft())
-        time.sleep(delay)
+StructurePlan = tuple[
+    tuple[tuple[str, ...], tuple[tuple[str, str, bool, bool], ...]], ...
+]
+"""
+compiled nesting plan for a parameter's mock events: (parent key path,
+(column, leaf key, is timestamp, is nullable) slots) pairs
+"""
+
+
+@cache
+def _nesting_path(key: str) -> Optional[tuple[str, ...]]:
+    """
+    key path of a flattened mock event column within a re-nested event, or
+    None if the column is not copied directly into the event.
+    """
+    if "eng_value_" in key:
+        return ("eng_value", *key.split("_value_")[1].split("_"))
+    if "raw_value_" in key:
+        return ("raw_value", *key.split("_value_")[1].split("_"))
+    if any(val in key for val in ("eng_value", "raw_value", "pivot")):
+        return None
+    return (key,)
+
+
+def _utc_datetime(timestamp: pd.Timestamp) -> dt.datetime:
+    return timestamp.to_pydatetime().astimezone(dt.timezone.utc)
 
 
 class MockServer:
@@ -75,6 +86,8 @@ class MockServer:
         if mode not in ("no_replacement", "sequential", "replacement"):
             raise ValueError("unrecognized mode")
         self._pickable_indices, self.mode = None, mode
+        self._structure_plans: dict[str, StructurePlan] = {}
+        self._blob_index: Optional[dict[tuple[str, str], Path]] = None
 
     def _pick_event(self, event_ix: Optional[int] = None) -> tuple[dict, int]:
         if event_ix is not None:
@@ -100,8 +113,9 @@ class MockServer:
         stop: Optional[dt.datetime] = None,
     ) -> pd.DataFrame:
         rangeslice = self.source
+        # like the yamcs archive, start is inclusive and stop is exclusive
         if start is not None:
-            rangeslice = rangeslice.loc[rangeslice["generation_time"] > start]
+            rangeslice = rangeslice.loc[rangeslice["generation_time"] >= start]
         if stop is not None:
             rangeslice = rangeslice[rangeslice["generation_time"] < stop]
         return rangeslice.loc[rangeslice["name"].isin(parameters)]
@@ -120,48 +134,107 @@ class MockServer:
     def _get_parameters(self):
         return self._parameters
 
+    def _compile_structure_plan(self, name: str) -> StructurePlan:
+        """
+        compile a nesting plan for events of the named parameter. the layout
+        of a re-nested event depends only on the parameter, so we work out
+        key paths, timestamp columns, and nullable columns once per parameter
+        rather than once per event.
+        """
+        rows = self.source.loc[self.source["name"] == name]
+        missing = rows.isna()
+        groups = {}
+        for column in rows.columns:
+            if (path := _nesting_path(column)) is None:
+                continue
+            # columns that are always empty for this parameter never appear
+            # in its events
+            if missing[column].all():
+                continue
+            if pd.api.types.is_datetime64_any_dtype(rows[column].dtype):
+                is_timestamp = True
+            elif rows[column].dtype == object:
+                is_timestamp = bool(
+                    rows[column].map(lambda v: isinstance(v, pd.Timestamp))
+                    .any()
+                )
+            else:
+                is_timestamp = False
+            groups.setdefault(path[:-1], []).append(
+                (column, path[-1], is_timestamp, bool(missing[column].any()))
+            )
+        return tuple(
+            (parents, tuple(slots)) for parents, slots in groups.items()
+        )
+
+    def _get_structure_plan(self, name: str) -> StructurePlan:
+        if (plan := self._structure_plans.get(name)) is None:
+            plan = self._compile_structure_plan(name)
+            self._structure_plans[name] = plan
+        return plan
+
     # noinspection PyTypeChecker
     def _create_structure(
         self, record: dict, ix: int, **fields
     ) -> NestingDict:
-        record = {k: v for k, v in record.items() if not pd.isna(v)}
-        # add/overwrite requested keys first
-        record |= fields
-        # now re-nest the unnested values
         event = NestingDict()
-        for key in record.keys():
-            if "eng_value_" in key:
-                put_into_dict(key, event["eng_value"], record)
-            elif "raw_value_" in key:
-                put_into_dict(key, event["raw_value"], record)
-            elif not any(
-                val in key for val in ("eng_value", "raw_value", "pivot")
-            ):
-                event[key] = record[key]
+        # straight-line fill of the parameter's compiled template. requested
+        # fields are added/overwritten afterwards.
+        for parents, slots in self._get_structure_plan(record["name"]):
+            target = None
+            for column, leaf, is_timestamp, nullable in slots:
+                if column in fields:
+                    continue
+                value = record[column]
+                if nullable is True and pd.isna(value):
+                    continue
+                if is_timestamp is True:
+                    value = _utc_datetime(value)
+                # don't make levels for groups with no values in this event
+                if target is None:
+                    target = event
+                    for key in parents:
+                        target = target[key]
+                target[leaf] = value
+        for key, value in fields.items():
+            if (path := _nesting_path(key)) is None:
+                continue
+            if isinstance(value, pd.Timestamp):
+                value = _utc_datetime(value)
+            target = event
+            for level in path[:-1]:
+                target = target[level]
+            target[path[-1]] = value
         for data_type in ("eng", "raw"):
-            if record[f"{data_type}_value"] not in ("unnested", None, "None"):
+            value = fields.get(
+                f"{data_type}_value", record.get(f"{data_type}_value")
+            )
+            if isinstance(value, float) and pd.isna(value):
+                value = None
+            if value not in ("unnested", None, "None"):
                 assert f"{data_type}_value" not in event.keys()
-                event[f"{data_type}_value"] = record[f"{data_type}_value"]
-            elif record["pivot"] is True:
+                if isinstance(value, pd.Timestamp):
+                    value = _utc_datetime(value)
+                event[f"{data_type}_value"] = value
+            elif fields.get("pivot", record.get("pivot")) is True:
                 event = self._add_blob(event, data_type, ix)
-        return dig_and_edit(
-            event,
-            filter_func=lambda _, v: isinstance(v, pd.Timestamp),
-            setter_func=lambda _, v: v.to_pydatetime().astimezone(
-                dt.timezone.utc
-            ),
-            mtypes=(dict, NestingDict),
-        )
+        return event
 
     def _add_blob(
         self, event: NestingDict, data_type: Literal["eng", "raw"], ix: int
     ) -> NestingDict[str, Any]:
         """add stored binary blobs to a mock parameter publication"""
-        matches = filter(
-            lambda p: p.name.startswith(f"pivot_{ix}_{data_type}"),
-            self.blobs_folder.iterdir(),
-        )
-        blob_file = next(matches)
+        if self._blob_index is None:
+            # index the blobs folder once rather than scanning it per event
+            self._blob_index = {}
+            for blob_path in sorted(self.blobs_folder.iterdir()):
+                fields = blob_path.name.split("_", maxsplit=3)
+                if len(fields) < 3 or fields[0] != "pivot":
+                    continue
+                self._blob_index.setdefault(
+                    (fields[1], fields[2]), blob_path
+                )
+        blob_file = self._blob_index[(str(ix), data_type)]
         blob = blob_file.read_bytes()
         if "imageData" in blob_file.name:
             event["eng_value"]["imageData"] = blob
@@ -183,8 +256,8 @@ class MockServer:
         range_df = self._get_event_range(parameters, start, stop)
         # noinspection PyTypeChecker
         return iter(
-            self._create_structure(self._pickable[ix], ix, **fields)
-            for ix in range_df.index
+            self._create_structure(record, ix, **fields)
+            for ix, record in range_df.to_dict("index").items()
         )
 
     def serve_event(
@@ -205,7 +278,7 @@ class MockServer:
         if self.ctx is None:
             raise ValueError(".ctx attribute not assigned")
         event = self.serve_event(event_ix, **fields)
-        self.ctx[event["name"]].append(event)
+        self.ctx.publish(event["name"], event)
 
     @property
     def start_time(self):
@@ -221,64 +294,238 @@ class MockServer:
     ctx = None
 
 
+# sentinel telling a _Subscriber's delivery thread to exit
+_STOP = object()
+# seconds a blocked publisher waits between checks for a stopped subscription
+PUT_TIMEOUT = 0.1
+
+
+class _Subscriber:
+    """
+    a single subscription to a MockContext: a bounded queue of pending
+    parameter values, a thread that delivers them to a callback, and
+    delivery statistics.
+    """
+
+    def __init__(
+        self,
+        subscriber_id: int,
+        parameters: Collection[str],
+        on_data: Callable,
+        maxsize: int,
+        overflow: Literal["block", "drop_oldest"],
+    ):
+        if overflow not in ("block", "drop_oldest"):
+            raise ValueError("unrecognized overflow policy")
+        self.id, self.parameters = subscriber_id, frozenset(parameters)
+        self.on_data, self.overflow = on_data, overflow
+        self.queue = Queue(maxsize)
+        self.delivered, self.dropped, self.errors = 0, 0, 0
+        self.last_latency, self.max_latency, self._total_latency = (
+            None, 0.0, 0.0
+        )
+        self.last_exception = None
+        self.stopped = Event()
+        self.thread = Thread(
+            target=self._deliver, daemon=True, name=f"mock_sub_{subscriber_id}"
+        )
+        self.thread.start()
+
+    def put(self, event: Any, published: float):
+        """
+        queue a parameter value for delivery. in 'block' mode, wait for room
+        in the queue; in 'drop_oldest' mode, discard the oldest pending value
+        instead. values put after (or while waiting when) the subscription
+        is stopped are discarded.
+        """
+        if self.overflow == "block":
+            # wait in short increments so that a stop() while we're waiting
+            # on a full queue can't block us forever
+            while not self.stopped.is_set():
+                try:
+                    self.queue.put((published, event), timeout=PUT_TIMEOUT)
+                    return
+                except Full:
+                    continue
+            return
+        while not self.stopped.is_set():
+            try:
+                self.queue.put_nowait((published, event))
+                return
+            except Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except Empty:
+                    continue
+
+    def _deliver(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            published, event = item
+            latency = time.perf_counter() - published
+            try:
+                self.on_data(event)
+            except Exception as ex:
+                # a broken callback shouldn't kill delivery (and block
+                # publishers behind a full queue)
+                self.errors += 1
+                self.last_exception = ex
+                continue
+            self.delivered += 1
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self._total_latency += latency
+
+    def stop(self):
+        """discard pending values and shut down the delivery thread."""
+        self.stopped.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                break
+        try:
+            self.queue.put_nowait(_STOP)
+        except Full:
+            # a blocked publisher beat us to the space we just made
+            self.queue.get_nowait()
+            self.queue.put_nowait(_STOP)
+
+    def running(self) -> bool:
+        return self.thread.is_alive()
+
+    @property
+    def lag(self) -> dict[str, Any]:
+        """
+        delivery statistics. latencies are in seconds from publication to
+        handoff to the callback.
+        """
+        return {
+            "parameters": sorted(self.parameters),
+            "backlog": self.queue.qsize(),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "last_latency": self.last_latency,
+            "mean_latency": (
+                None if self.delivered == 0
+                else self._total_latency / self.delivered
+            ),
+            "max_latency": self.max_latency,
+        }
+
+
 class MockContext:
     """
     mock for a collection of 'under the hood' objects yamcs-client uses to
     manage connections to the yamcs server.
 
-    it is basically a mock non-blocking websocket represented by a
-    thread pool and a dictionary. this does not support
-    multiple subscriptions to the same parameters in a single
-    process, which we would never want to do anyway: the cache
-    is intentionally volatile.
+    it is basically a mock websocket represented by a pub/sub broker. each
+    subscription gets its own bounded queue and delivery thread, which blocks
+    until a value arrives, and every value published to a parameter is fanned
+    out to all subscriptions to that parameter. values published to a
+    parameter with no subscriptions are retained and handed to the first
+    subscription to it.
     """
 
     def __init__(
         self,
-        cache: Optional[MutableMapping[str, deque]] = None,
-        n_threads: int = 4,
+        maxsize: int = 4096,
+        overflow: Literal["block", "drop_oldest"] = "block",
     ):
-        self.exec = ThreadPoolExecutor(n_threads)
-        if cache is None:
-            self.cache = defaultdict(deque)
-        self._signals = {}
+        self.maxsize, self.overflow = maxsize, overflow
+        self._subscribers: dict[int, _Subscriber] = {}
+        self._by_parameter: defaultdict[str, set[int]] = defaultdict(set)
+        self._retained: defaultdict[str, deque] = defaultdict(deque)
+        self._lock = Lock()
         self._counter = count()
 
-    def __getitem__(self, key):
-        return self.cache[key]
-
-    def __setitem__(self, key, value):
-        self.cache[key] = value
-
-    def run(
-        self, parameters: Collection[str], on_data: Callable, delay: float
-    ) -> tuple[Future, int]:
-        thread_id = next(self._counter)
-        self._signals[thread_id] = 0
-        manager = self.exec.submit(
-            _poll_ctx,
-            self.cache,
+    def subscribe(
+        self,
+        parameters: Collection[str],
+        on_data: Callable,
+        maxsize: Optional[int] = None,
+        overflow: Optional[Literal["block", "drop_oldest"]] = None,
+    ) -> int:
+        """
+        start delivering values of `parameters` to `on_data`. returns an id
+        for the new subscription.
+        """
+        subscriber = _Subscriber(
+            next(self._counter),
             parameters,
             on_data,
-            delay,
-            self._signals,
-            thread_id,
+            self.maxsize if maxsize is None else maxsize,
+            self.overflow if overflow is None else overflow,
         )
-        return manager, thread_id
-
-    def addevent(self, param: str, event: Any):
-        """simulate a parameter value publication"""
-        self[param].append(event)
+        with self._lock:
+            self._subscribers[subscriber.id] = subscriber
+            for param in subscriber.parameters:
+                self._by_parameter[param].add(subscriber.id)
+            retained = [
+                self._retained.pop(param)
+                for param in subscriber.parameters
+                if param in self._retained
+            ]
+        for item in sorted(
+            (item for backlog in retained for item in backlog),
+            key=lambda i: i[0]
+        ):
+            subscriber.put(item[1], item[0])
+        return subscriber.id
+
+    def publish(self, param: str, event: Any) -> int:
+        """
+        simulate a parameter value publication. returns the number of
+        subscriptions the value was delivered to.
+        """
+        published = time.perf_counter()
+        with self._lock:
+            subscribers = [
+                self._subscribers[i] for i in self._by_parameter.get(param, ())
+            ]
+            if len(subscribers) == 0:
+                self._retained[param].append((published, event))
+                return 0
+        for subscriber in subscribers:
+            subscriber.put(event, published)
+        return len(subscribers)
+
+    addevent = publish
+
+    def cancel(self, subscriber_id: int):
+        """cancel a subscription"""
+        with self._lock:
+            subscriber = self._subscribers.pop(subscriber_id, None)
+            if subscriber is None:
+                return
+            for param in subscriber.parameters:
+                self._by_parameter[param].discard(subscriber_id)
+        subscriber.stop()
 
     def kill(self):
         """shut the context down"""
-        for thread_id in self._signals.keys():
-            self._signals[thread_id] = 1
-        self.exec.shutdown(wait=False, cancel_futures=True)
+        for subscriber_id in tuple(self._subscribers.keys()):
+            self.cancel(subscriber_id)
 
-    def cancel(self, thread_id):
-        """attempt to cancel a thread"""
-        self._signals[thread_id] = 1
+    def running(self, subscriber_id: int) -> bool:
+        if (subscriber := self._subscribers.get(subscriber_id)) is None:
+            return False
+        return subscriber.running()
+
+    def lag(
+        self, subscriber_id: Optional[int] = None
+    ) -> dict[str, Any] | dict[int, dict[str, Any]]:
+        """
+        delivery statistics for one subscription, or for all of them (keyed
+        by subscription id) if subscriber_id is None.
+        """
+        if subscriber_id is not None:
+            return self._subscribers[subscriber_id].lag
+        return {i: s.lag for i, s in tuple(self._subscribers.items())}
 
 
 class MockYamcsClient:
@@ -376,7 +623,7 @@ class MockSubscription:
         on_data: Callable[[NestingDict], None],
         yamcs_processor: MockYamcsProcessor,
         ctx: MockContext,
-        delay: float = 0.1,
+        maxsize: Optional[int] = None,
     ):
         if isinstance(parameters, str):
             raise TypeError("parameters must be a collection of str")
@@ -385,30 +632,41 @@ class MockSubscription:
         self.ctx = ctx
         self.callback = on_data
         # mock version of WebSocketSubscriptionManager functionality
-        self._manager, self.thread_id = ctx.run(parameters, on_data, delay)
+        self.subscriber_id = ctx.subscribe(parameters, on_data, maxsize)
 
     def cancel(self):
-        self.ctx.cancel(self.thread_id)
-        return self._manager.cancel()
+        self.ctx.cancel(self.subscriber_id)
 
     def running(self):
-        return self._manager.running()
+        return self.ctx.running(self.subscriber_id)
+
+    @property
+    def lag(self) -> dict[str, Any]:
+        """delivery statistics for this subscription"""
+        return self.ctx.lag(self.subscriber_id)
 
 
 def test_mock_client():
     ctx = MockContext()
     client = MockYamcsClient(ctx)
     processor = client.get_processor("viper", "realtime")
-    read_cache = []
-    sub = processor.create_parameter_subscription(
-        ["/Fake/parameter"], lambda a: read_cache.append(a)
-    )
+    read_caches = [], []
+    subs = [
+        processor.create_parameter_subscription(
+            ["/Fake/parameter"], lambda a, c=cache: c.append(a)
+        )
+        for cache in read_caches
+    ]
     time.sleep(0.1)
-    assert sub.running()
+    assert all(sub.running() for sub in subs)
     ctx.addevent("/Fake/parameter", 1)
     time.sleep(0.2)
-    assert read_cache.pop() == 1
+    # every subscription to a parameter gets every value
+    assert all(cache.pop() == 1 for cache in read_caches)
+    assert all(sub.lag["delivered"] == 1 for sub in subs)
     ctx.kill()
+    time.sleep(0.1)
+    assert not any(sub.running() for sub in subs)
 
 
 def put_into_dict(